@@ -0,0 +1,94 @@
+"""
+Benchmark reverse reachability on synthetic import graphs made up of stacked diamonds.
+
+Each layer of the graph is a diamond i.e. the top node of the layer imports `width` nodes which all import the bottom
+node of the layer. The bottom node of one layer is the top node of the next layer. A change to the bottom node of the
+graph has width ** depth paths to the single root so naive traversal is exponential in depth.
+
+Usage: python benchmarks/bench_find_root_ancestors.py [--depth 2000] [--width 4] [--repeat 5]
+"""
+
+import argparse
+import sys
+import time
+
+from pytest_git_selector.compact_graph import CompactGraph
+
+
+def diamond_graph(depth: int, width: int) -> CompactGraph:
+    edges = []
+
+    for layer in range(depth):
+        top = f"layer_{layer}"
+        bottom = f"layer_{layer + 1}"
+
+        for i in range(width):
+            middle = f"layer_{layer}_{i}"
+            edges.append((top, middle))
+            edges.append((middle, bottom))
+
+    return CompactGraph.from_edges(edges)
+
+
+def _find_root_ancestors(graph, paths):
+    return graph.root_ancestors(graph.ids[p] for p in paths)
+
+
+def _naive_find_root_ancestors(graph, node, root_ancestors):
+    # Reference implementation without a visited set to compare against on small graphs
+    predecessors = [graph.paths[p] for p in graph.predecessors(graph.ids[node])]
+
+    if not predecessors:
+        root_ancestors.add(node)
+        return
+
+    for predecessor in predecessors:
+        _naive_find_root_ancestors(graph, predecessor, root_ancestors)
+
+
+def _time(func, repeat):
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=2000)
+    parser.add_argument("--width", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    graph = diamond_graph(args.depth, args.width)
+    changed = [f"layer_{args.depth}"]
+
+    elapsed = _time(lambda: _find_root_ancestors(graph, changed), args.repeat)
+    print(
+        f"iterative: depth={args.depth} width={args.width} "
+        f"nodes={graph.number_of_nodes()} edges={graph.number_of_edges()} best={elapsed * 1000:.3f}ms"
+    )
+
+    # The naive traversal visits width ** depth paths so only run it on shallow graphs
+    for depth in range(2, 11, 2):
+        small_graph = diamond_graph(depth, args.width)
+        small_changed = f"layer_{depth}"
+        naive = _time(
+            lambda: _naive_find_root_ancestors(small_graph, small_changed, set()), 1
+        )
+        iterative = _time(
+            lambda: _find_root_ancestors(small_graph, [small_changed]), args.repeat
+        )
+        print(
+            f"depth={depth} width={args.width} naive={naive * 1000:.3f}ms iterative={iterative * 1000:.3f}ms"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
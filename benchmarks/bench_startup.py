@@ -0,0 +1,69 @@
+"""
+Benchmark the startup cost the plugin adds to pytest runs that do not select tests.
+
+Times a fresh interpreter importing the plugin module and running `pytest --version` with and without the plugin
+loaded, and lists the heavy dependencies imported by the plugin module. Selection only imports GitPython, importlab and
+networkx once git diff args are given so none of them should be listed.
+
+Usage: python benchmarks/bench_startup.py [--repeat 10]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ("git", "importlab", "networkx", "pytest_git_selector.selector")
+
+
+def _best_of(repeat: int, argv) -> float:
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(argv, check=True, stdout=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    timings = {
+        "python": [sys.executable, "-c", "pass"],
+        "import plugin": [sys.executable, "-c", "import pytest_git_selector.plugin"],
+        "pytest without plugin": [
+            sys.executable,
+            "-m",
+            "pytest",
+            "-p",
+            "no:git-selector",
+            "--version",
+        ],
+        "pytest with plugin": [sys.executable, "-m", "pytest", "--version"],
+    }
+
+    for name, argv in timings.items():
+        print(f"{name}: best={_best_of(args.repeat, argv) * 1000:.1f}ms")
+
+    imported = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, pytest_git_selector.plugin; "
+            f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    print(f"heavy modules imported by the plugin: {', '.join(imported) or 'none'}")
+
+    return 1 if imported else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Benchmark test selection on a synthetic git repository.
+
+Times each phase of select_test_files as well as end-to-end runs of git-select-tests and the pytest plugin. Results
+can be saved as a baseline and later runs compared against it e.g.
+
+    python benchmarks/run.py --modules 5000 --save benchmarks/baseline.json
+    python benchmarks/run.py --modules 5000 --compare benchmarks/baseline.json
+
+See python benchmarks/run.py --help for all parameters.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from pytest_git_selector.git_backend import create_git_backend
+from pytest_git_selector.profiling import SelectionProfile
+from pytest_git_selector.selector import select_test_files
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import create_synthetic_repo, modify_synthetic_repo  # noqa: E402
+
+GIT_DIFF_ARGS = ["HEAD~1..."]
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", type=int, default=1000)
+    parser.add_argument("--fan-out", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--tests", type=int, default=200)
+    parser.add_argument("--diff-size", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--skip-end-to-end",
+        action="store_true",
+        help="only time select_test_files and skip running git-select-tests and pytest",
+    )
+    parser.add_argument("--save", help="path to save the results to as a baseline")
+    parser.add_argument("--compare", help="path of a baseline to compare results to")
+    parser.add_argument(
+        "--max-slowdown",
+        type=float,
+        default=None,
+        help="exit with a non-zero status if any timing is slower than the baseline by more than this factor",
+    )
+    return parser
+
+
+def _best_of(repeat: int, func) -> float:
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def _run(cmd, cwd):
+    # Test modules import the synthetic package from the root of the repository
+    env = {**os.environ, "PYTHONPATH": cwd}
+    process = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True)
+
+    # pytest exits with 5 when no tests are selected
+    if process.returncode not in (0, 5):
+        raise RuntimeError(process.stdout.decode() + process.stderr.decode())
+
+
+def run_benchmarks(args) -> dict:
+    results = {}
+
+    with tempfile.TemporaryDirectory() as repo_dir:
+        create_synthetic_repo(
+            repo_dir,
+            modules=args.modules,
+            fan_out=args.fan_out,
+            depth=args.depth,
+            tests=args.tests,
+            seed=args.seed,
+        )
+        modify_synthetic_repo(repo_dir, diff_size=args.diff_size, seed=args.seed)
+
+        cwd = os.getcwd()
+        os.chdir(repo_dir)
+
+        try:
+            select_args = (GIT_DIFF_ARGS, ["tests"], ["."])
+            results["select_test_files"] = _best_of(
+                args.repeat,
+                lambda: select_test_files(*select_args, workers=args.workers),
+            )
+
+            for backend in ("native", "subprocess"):
+                results[f"git_diff:{backend}"] = _best_of(
+                    args.repeat,
+                    lambda: list(
+                        create_git_backend(backend).diff_name_status(GIT_DIFF_ARGS)
+                    ),
+                )
+
+            # Profile separately so the overhead of profiling is not included in the end-to-end time above
+            profiles = []
+
+            for _ in range(args.repeat):
+                profile = SelectionProfile()
+                select_test_files(*select_args, workers=args.workers, profile=profile)
+                profiles.append(profile.to_dict())
+        finally:
+            os.chdir(cwd)
+
+        # Report the phases of the fastest run
+        fastest = min(profiles, key=lambda p: p["total_wall_time"])
+
+        for name, phase in fastest["phases"].items():
+            results[f"phase:{name}"] = phase["wall_time"]
+
+        counts = fastest["counts"]
+
+        if not args.skip_end_to_end:
+            workers = ["--selector-workers", str(args.workers)]
+            results["git-select-tests"] = _best_of(
+                args.repeat,
+                lambda: _run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "pytest_git_selector.cmd",
+                        "--test-path",
+                        "tests",
+                        "--src-path",
+                        ".",
+                        *workers,
+                        "--",
+                        *GIT_DIFF_ARGS,
+                    ],
+                    repo_dir,
+                ),
+            )
+            results["pytest --collect-only"] = _best_of(
+                args.repeat,
+                lambda: _run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "pytest",
+                        "--collect-only",
+                        "-q",
+                        "-p",
+                        "no:cacheprovider",
+                        *workers,
+                        "--",
+                        *GIT_DIFF_ARGS,
+                    ],
+                    repo_dir,
+                ),
+            )
+
+    return {
+        "params": {
+            "modules": args.modules,
+            "fan_out": args.fan_out,
+            "depth": args.depth,
+            "tests": args.tests,
+            "diff_size": args.diff_size,
+            "seed": args.seed,
+            "workers": args.workers,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "counts": counts,
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, max_slowdown=None) -> bool:
+    if current["params"] != baseline["params"]:
+        print("warning: benchmark parameters differ from the baseline", file=sys.stderr)
+
+    ok = True
+    print(f"{'benchmark':<32}{'baseline':>12}{'current':>12}{'ratio':>10}")
+
+    for name, value in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<32}{'-':>12}{value:>11.3f}s{'-':>10}")
+            continue
+
+        base_value = baseline["results"][name]
+        ratio = value / base_value if base_value else float("inf")
+        print(f"{name:<32}{base_value:>11.3f}s{value:>11.3f}s{ratio:>9.2f}x")
+
+        if max_slowdown is not None and ratio > max_slowdown:
+            ok = False
+
+    return ok
+
+
+def main():
+    args = _build_parser().parse_args()
+    current = run_benchmarks(args)
+
+    print(json.dumps(current, indent=2))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+        if not compare(current, baseline, args.max_slowdown):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
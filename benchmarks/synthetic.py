@@ -0,0 +1,90 @@
+"""
+Generate synthetic git repositories for benchmarking test selection.
+
+Source modules are arranged in `depth` layers under the `synthetic` package. Each module imports `fan_out` modules from
+the layers below it so changes to modules in the bottom layer affect a large share of the test modules. Each test module
+imports `fan_out` modules from the top layer.
+"""
+
+import os
+import random
+
+import git
+
+
+def create_synthetic_repo(
+    dest: str,
+    modules: int = 1000,
+    fan_out: int = 3,
+    depth: int = 10,
+    tests: int = 200,
+    seed: int = 0,
+) -> git.Repo:
+    rng = random.Random(seed)
+    layers = _layer_modules(modules, depth)
+
+    os.makedirs(os.path.join(dest, "synthetic"), exist_ok=True)
+    os.makedirs(os.path.join(dest, "tests"), exist_ok=True)
+    _write(os.path.join(dest, "synthetic", "__init__.py"), "")
+
+    for i, layer in enumerate(layers):
+        lower_modules = [m for lower_layer in layers[i + 1 :] for m in lower_layer]
+
+        for module in layer:
+            imports = _sample(rng, lower_modules, fan_out)
+            _write(
+                os.path.join(dest, "synthetic", f"{module}.py"),
+                "".join(f"import synthetic.{m}\n" for m in imports)
+                + f"\n\ndef {module}():\n    return {rng.randint(0, 1000)}\n",
+            )
+
+    for i in range(tests):
+        imports = _sample(rng, layers[0], fan_out)
+        _write(
+            os.path.join(dest, "tests", f"test_{i}.py"),
+            "".join(f"import synthetic.{m}\n" for m in imports)
+            + f"\n\ndef test_{i}():\n    pass\n",
+        )
+
+    repo = git.Repo.init(dest)
+    repo.git.config("--local", "user.name", "benchmark")
+    repo.git.config("--local", "user.email", "benchmark@example.com")
+    repo.git.add(".")
+    repo.git.commit("-m", "Initial commit", "--no-verify")
+    return repo
+
+
+def modify_synthetic_repo(dest: str, diff_size: int = 10, seed: int = 0) -> None:
+    """
+    Commit a change to `diff_size` randomly chosen source modules.
+    """
+    rng = random.Random(seed)
+    source_dir = os.path.join(dest, "synthetic")
+    modules = sorted(f for f in os.listdir(source_dir) if f != "__init__.py")
+
+    for module in _sample(rng, modules, diff_size):
+        with open(os.path.join(source_dir, module), "a") as f:
+            f.write("# modified\n")
+
+    repo = git.Repo(dest)
+    repo.git.add(".")
+    repo.git.commit("-m", "Modify modules", "--no-verify")
+
+
+def _layer_modules(modules: int, depth: int):
+    depth = max(1, min(depth, modules))
+    layers = [[] for _ in range(depth)]
+
+    for i in range(modules):
+        layers[i * depth // modules].append(f"m_{i}")
+
+    return layers
+
+
+def _sample(rng: random.Random, population, k: int):
+    return rng.sample(population, min(k, len(population)))
+
+
+def _write(filename: str, content: str) -> None:
+    with open(filename, "w") as f:
+        f.write(content)
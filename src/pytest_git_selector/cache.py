@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from typing import AbstractSet, Callable, Dict, Iterable, List, Optional, Tuple
+
+import importlab.environment
+
+# (provenance kind, path, module name) of a resolved import
+ResolvedImport = Tuple[str, str, str]
+
+CACHE_FORMAT_VERSION = 2
+
+
+def blob_sha(filename: str) -> str:
+    with open(filename, "rb") as f:
+        return content_blob_sha(f.read())
+
+
+def content_blob_sha(content: bytes) -> str:
+    # Same hash git uses for blob objects so the key matches `git hash-object <filename>`
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class GraphCache:
+    """
+    Resolved imports of each file keyed by the file's git blob SHA.
+
+    The cache is only valid for the interpreter version and python path it was created with. Entries are discarded
+    when any of the files they resolved to no longer exist or any of the paths looked up before them now exists. Files
+    with unresolved imports are never cached since a new file may make them resolvable.
+
+    A cache without a filename is kept in memory only.
+    """
+
+    def __init__(
+        self,
+        filename: Optional[str],
+        key: dict,
+        files: Optional[Dict[str, dict]] = None,
+    ):
+        self.filename = filename
+        self.key = key
+        self.files = files if files is not None else {}
+        self.modified = False
+        self._exists = {}
+        self._shas = {}
+        # Checks whether the files entries resolved to still exist e.g. in the tree of a commit instead of on disk
+        self.exists: Callable[[str], bool] = os.path.exists
+
+    @staticmethod
+    def cache_key(env: importlab.environment.Environment) -> dict:
+        return {
+            "version": CACHE_FORMAT_VERSION,
+            "python_version": list(env.python_version),
+            "python_path": [fs.root for fs in env.path],
+        }
+
+    @classmethod
+    def load(
+        cls, filename: Optional[str], env: importlab.environment.Environment
+    ) -> "GraphCache":
+        key = cls.cache_key(env)
+
+        if filename is None:
+            return cls(filename, key)
+
+        try:
+            with open(filename, "r") as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return cls(filename, key)
+
+        if content.get("key") != key:
+            return cls(filename, key)
+
+        return cls._from_content(filename, key, content)
+
+    @classmethod
+    def _from_content(cls, filename: str, key: dict, content: dict) -> "GraphCache":
+        return cls(filename, key, content.get("files", {}))
+
+    def _to_content(self, files: Dict[str, dict]) -> dict:
+        return {"key": self.key, "files": files}
+
+    def get(self, filename: str, sha: str) -> Optional[List[ResolvedImport]]:
+        entry = self.files.get(filename)
+
+        if entry is None or entry["sha"] != sha:
+            return None
+
+        if not all(self._path_exists(path) for _, path, _ in entry["deps"]):
+            return None
+
+        # A file added where an import was looked up before it was found, e.g. a module shadowing a name defined in
+        # its package, changes what the import resolves to
+        if any(self._path_exists(path) for path in entry.get("missing", [])):
+            return None
+
+        return [tuple(dep) for dep in entry["deps"]]
+
+    def put(
+        self,
+        filename: str,
+        sha: str,
+        deps: List[ResolvedImport],
+        missing: Iterable[str] = (),
+    ) -> None:
+        # missing are the paths looked up while resolving the imports that did not exist
+        self.files[filename] = {
+            "sha": sha,
+            "deps": [list(dep) for dep in deps],
+            "missing": list(missing),
+        }
+        self.modified = True
+
+    def missing(self, filename: str) -> List[str]:
+        # Paths looked up while resolving the imports of a cached file that did not exist
+        return self.files[filename]["missing"]
+
+    def blob_sha(self, filename: str) -> str:
+        # Files whose size and modification time have not changed since they were last hashed are not read again
+        stat = os.stat(filename)
+        stat_key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        if (memo := self._shas.get(filename)) is not None and memo[0] == stat_key:
+            return memo[1]
+
+        sha = blob_sha(filename)
+        self._shas[filename] = stat_key, sha
+        return sha
+
+    def refresh(self) -> None:
+        # Forget which files exist so long lived caches pick up files that were added or removed
+        self._exists.clear()
+
+    def save(self) -> None:
+        if not self.modified or self.filename is None:
+            return
+
+        files = {k: v for k, v in self.files.items() if self._path_exists(k)}
+        dir_name = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(dir_name, exist_ok=True)
+
+        # Write to a temporary file then rename so concurrent readers never see a partially written cache
+        fd, temp_filename = tempfile.mkstemp(dir=dir_name, prefix=".graph-cache-")
+
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._to_content(files), f)
+            os.replace(temp_filename, self.filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+        self.modified = False
+
+    def _path_exists(self, path: str) -> bool:
+        if path not in self._exists:
+            self._exists[path] = self.exists(path)
+        return self._exists[path]
+
+
+class GraphSnapshot(GraphCache):
+    """
+    Graph cache tagged with the commit it was saved at.
+
+    Files that were tracked by git and unmodified when the snapshot was saved are trusted to still have the content
+    they had at that commit unless git reports them as changed since. Their blob SHA is not computed again so updating
+    a snapshot only reads the files that changed. All other entries are checked against their blob SHA as in
+    GraphCache.
+    """
+
+    def __init__(
+        self,
+        filename: Optional[str],
+        key: dict,
+        files: Optional[Dict[str, dict]] = None,
+        commit: Optional[str] = None,
+        dirty: Iterable[str] = (),
+    ):
+        super().__init__(filename, key, files)
+        self.commit = commit
+        self.dirty = set(dirty)
+        self.trusted = set()
+
+    @classmethod
+    def _from_content(cls, filename: str, key: dict, content: dict) -> "GraphSnapshot":
+        return cls(
+            filename,
+            key,
+            content.get("files", {}),
+            commit=content.get("commit"),
+            dirty=content.get("dirty", []),
+        )
+
+    def _to_content(self, files: Dict[str, dict]) -> dict:
+        content = super()._to_content(files)
+        content["commit"] = self.commit
+        content["dirty"] = sorted(self.dirty.intersection(files))
+        return content
+
+    def update(
+        self,
+        changed_files: Optional[AbstractSet[str]],
+        deleted_files: AbstractSet[str] = frozenset(),
+    ) -> None:
+        # changed_files are the files that differ between the snapshot's commit and the working tree or None if they
+        # are unknown e.g. the commit is missing from a shallow clone
+        for filename in deleted_files:
+            if self.files.pop(filename, None) is not None:
+                self.modified = True
+
+        if changed_files is None:
+            self.trusted = set()
+        else:
+            self.trusted = set(self.files) - self.dirty - changed_files
+
+    def tag(self, commit: Optional[str], dirty: AbstractSet[str]) -> None:
+        # dirty are the files that differ from the commit in the working tree or are not tracked by git
+        if commit != self.commit or dirty != self.dirty:
+            self.modified = True
+
+        self.commit = commit
+        self.dirty = set(dirty)
+        self.trusted = set(self.files) - self.dirty
+
+    def blob_sha(self, filename: str) -> str:
+        if filename in self.trusted:
+            return self.files[filename]["sha"]
+        return super().blob_sha(filename)
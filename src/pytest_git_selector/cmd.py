@@ -1,36 +1,198 @@
 import argparse
+import contextlib
+import json
+import os
+import shlex
+import signal
 import sys
 
-from pytest_git_selector.selector import select_test_files
-from pytest_git_selector.util import parse_extra_deps_file
+from typing import TYPE_CHECKING, IO, Iterable, Iterator, List, MutableSet, Optional
 
+from pytest_git_selector.errors import UnsupportedArgumentException
+from pytest_git_selector.profiling import SelectionProfile
+from pytest_git_selector.shards import (
+    load_durations,
+    shard_test_files,
+    validate_shard_args,
+)
+from pytest_git_selector.util import (
+    DEFAULT_PARSE_CACHE_MAX_SIZE_MB,
+    GIT_BACKENDS,
+    GRANULARITIES,
+    parse_extra_deps_file,
+)
 
-def parse_args():
-    do_exit_and_print_usage = False
+# The parse cache is only imported when it is used
+if TYPE_CHECKING:
+    from pytest_git_selector.parse_cache import ParseCache
 
-    try:
-        delimiter_index = sys.argv.index("--")
-        git_diff_args = sys.argv[delimiter_index + 1 :]
+OUTPUT_FORMATS = ("lines", "nul", "jsonl", "relative", "nodeid")
 
-        if not git_diff_args:
-            raise ValueError
 
+def parse_args(load_graph: bool = False):
+    if "--" in sys.argv:
+        delimiter_index = sys.argv.index("--")
+        git_diff_args = sys.argv[delimiter_index + 1 :] or None
         sys.argv[:] = sys.argv[:delimiter_index]
-    except ValueError:
+    else:
         git_diff_args = None
-        do_exit_and_print_usage = True  # Delay raising error so that help message is populated with args below
 
-    parser = _build_parser()
+    parser = _build_parser(load_graph)
+    args = parser.parse_args()
 
-    if do_exit_and_print_usage:
+    if args.batch is not None:
+        if load_graph:
+            parser.error("--batch cannot be used with load-graph")
+        if git_diff_args is not None:
+            parser.error("git diff args cannot be used with --batch")
+        if args.format in ("nul", "jsonl"):
+            parser.error(f"--format {args.format} cannot be used with --batch")
+    elif git_diff_args is None:
         parser.print_help(sys.stderr)
-        raise ValueError  # reraise the ValueError after printing help
+        raise ValueError
+
+    try:
+        validate_shard_args(args.shards, args.shard_index)
+    except UnsupportedArgumentException as e:
+        parser.error(str(e))
 
-    return parser.parse_args(), git_diff_args
+    return args, git_diff_args
+
+
+def _build_parser(load_graph: bool = False) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="git-select-tests load-graph" if load_graph else None
+    )
+    _add_project_args(parser)
+    parser.add_argument(
+        "--graph-cache",
+        help=(
+            "path of a file used to cache the resolved imports of each file between runs. "
+            "Entries are keyed by the git blob SHA of each file so only files that have changed since the last run "
+            "are parsed again. The file is created if it does not exist"
+        ),
+        default=None,
+    )
+    parser.add_argument(
+        "--graph-snapshot",
+        help=(
+            "path of a file holding the resolved imports of each file tagged with the commit they were saved at. "
+            "Only files that changed since that commit according to git are parsed and the snapshot is then saved "
+            "tagged with the current commit. The file is created if it does not exist. Takes precedence over "
+            "'--graph-cache'"
+        ),
+        default=None,
+    )
+    _add_parse_args(parser)
+    parser.add_argument(
+        "--selector-granularity",
+        choices=GRANULARITIES,
+        help=(
+            "granularity of test selection. 'file' selects every test module that imports a changed file. "
+            "'symbol' maps the changed lines to the top level functions and classes of each changed module and only "
+            "follows modules that import one of the changed names with 'from x import y' or import the whole module. "
+            "Changes outside functions and classes are treated as changes to the whole module. "
+            "'symbol' assumes the working tree matches the new side of the diff. Defaults to 'file'"
+        ),
+        default="file",
+    )
+    _add_git_args(parser)
+    _add_profile_arg(parser)
 
+    if load_graph:
+        parser.add_argument(
+            "--graph",
+            metavar="PATH",
+            required=True,
+            help=(
+                "path of a graph artifact written by 'git-select-tests build-graph'. Only the files that changed since "
+                "the commit of the artifact are resolved again. '--test-path', '--src-path', '--extra-deps-file', "
+                "'--graph-cache', '--graph-snapshot' and '--daemon-socket' are ignored since the artifact records what "
+                "the graph was built from"
+            ),
+        )
 
-def _build_parser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--daemon-socket",
+        metavar="PATH",
+        help=(
+            "path of the Unix socket of a daemon started with 'git-select-tests daemon'. "
+            "Test files are selected by the daemon which keeps the import graph in memory between runs. "
+            "Falls back to selecting test files in this process if no daemon is listening on the socket. "
+            "Ignored when '--selector-profile' or '--graph-snapshot' is used"
+        ),
+        default=None,
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        metavar="N",
+        help=(
+            "split the selected test files into N shards of about equal duration and only print the shard given by "
+            "'--shard-index'. Durations are read from the durations recorded by the pytest plugin in the pytest "
+            "cache. Files without a recorded duration are weighted by their size"
+        ),
+        default=None,
+    )
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        metavar="I",
+        help="index of the shard to print starting from 0. Defaults to 0",
+        default=0,
+    )
+    parser.add_argument(
+        "--pytest-cache-dir",
+        metavar="PATH",
+        help=(
+            "pytest cache directory to read test durations from when sharding. "
+            "Recorded paths are relative to the directory specified in '--dir'. "
+            "Defaults to .pytest_cache in the directory specified in '--dir'"
+        ),
+        default=None,
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help=(
+            "select test files for each line of FILE holding the args to pass to git diff e.g. 'main...feature'. "
+            "Use '-' to read from stdin. Blank lines and lines starting with '#' are skipped. The import graph is "
+            "built once for all lines and a JSON object mapping each line to its selected test files is printed. "
+            "Cannot be combined with git diff args after '--'"
+        ),
+        default=None,
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        help=(
+            "output format of the selected test files. 'lines' prints one absolute path per line. 'nul' terminates "
+            "each absolute path with a NUL character e.g. for 'xargs -0'. 'jsonl' prints one JSON object per line "
+            "with the absolute 'path' and pytest 'nodeid' of each file. 'relative' prints paths relative to the "
+            "current working directory. 'nodeid' prints paths relative to the directory specified in '--dir' with "
+            "forward slashes like pytest node IDs. Test files are printed as they are found unless sharding, using a "
+            "daemon or profiling. With '--batch' only 'lines', 'relative' and 'nodeid' can be used and change how "
+            "the paths are formatted. Defaults to 'lines'"
+        ),
+        default="lines",
+    )
+    # Add a dummy option to document the -- delimiter
+    parser.add_argument(
+        "-- ",
+        metavar="[git-diff-args]",
+        help=(
+            "args to pass to git diff. "
+            "They must be appear at the end of the args separated from the rest of the args of git-select-tests using "
+            "the '--' delimiter e.g. pytest --collect-only -- --diff-filter=M HEAD~1..."
+            "git diff is called internally with the --name-status, --no-renames and -z flags automatically. "
+            "Any additional arguments must not interfere with the output format e.g. do not use the --output flag "
+            "which writes to a file instead of stdout"
+        ),
+    )
+    return parser
+
+
+def _add_project_args(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
         "--dir",
         help="base directory of the project containing the .git folder. Defaults to current directory",
@@ -68,25 +230,206 @@ def _build_parser() -> argparse.ArgumentParser:
         ),
         default=None,
     )
-    # Add a dummy option to document the -- delimiter
+
+
+def _add_parse_args(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
-        "-- ",
-        metavar="[git-diff-args]",
+        "--parse-cache",
+        metavar="PATH",
         help=(
-            "args to pass to git diff. "
-            "They must be appear at the end of the args separated from the rest of the args of git-select-tests using "
-            "the '--' delimiter e.g. pytest --collect-only -- --diff-filter=M HEAD~1..."
-            "git diff is called internally with the --name-only and --no-renames automatically. "
-            "Any additional arguments must not interfere with the output format e.g. do not use the --output flag "
-            "which writes to a file instead of stdout"
+            "path of a SQLite database caching the import statements parsed from each file by its git blob SHA. "
+            "Entries do not depend on the checkout so one cache can be shared by every checkout and branch on a "
+            "machine and by parallel jobs. Only used for files that are not in '--graph-cache' or '--graph-snapshot'"
+        ),
+        default=None,
+    )
+    parser.add_argument(
+        "--parse-cache-max-size",
+        type=int,
+        metavar="MB",
+        help=(
+            "maximum size of the import statements stored in '--parse-cache' in megabytes. The least recently used "
+            f"entries are evicted beyond it. Defaults to {DEFAULT_PARSE_CACHE_MAX_SIZE_MB}"
         ),
+        default=DEFAULT_PARSE_CACHE_MAX_SIZE_MB,
+    )
+    parser.add_argument(
+        "--selector-workers",
+        type=int,
+        help=(
+            "number of worker processes used to parse and resolve imports when building the import graph. "
+            "Use 0 to start one worker per CPU. Defaults to 1 which parses files in the current process"
+        ),
+        default=1,
+    )
+
+
+def _add_git_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--git-backend",
+        choices=GIT_BACKENDS,
+        help=(
+            "how git diff is read. 'native' reads the object database and the index in-process without starting "
+            "git and supports comparing commits (A B, A..B and A...B), a commit with the index (--cached) and the "
+            "index or a commit with the working tree, optionally with --diff-filter. 'subprocess' runs git diff. "
+            "'auto' uses 'subprocess', which is faster, and only falls back to 'native' when git cannot be "
+            "started. Defaults to 'auto'"
+        ),
+        default="auto",
+    )
+    parser.add_argument(
+        "--revision",
+        metavar="REV",
+        help=(
+            "build the import graph from the files of the commit REV read from the git object database instead of "
+            "the working tree, e.g. the new side of the diff, so selection works without a checkout. "
+            "'--test-path' and '--src-path' are looked up in the tree of REV as if it was checked out in the "
+            "directory specified in '--dir'. '--daemon-socket' is ignored"
+        ),
+        default=None,
+    )
+
+
+def _add_profile_arg(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--selector-profile",
+        metavar="PATH",
+        help=(
+            "write the wall time of each phase of test selection along with the number of files, nodes and edges "
+            "involved as JSON to PATH. Use '-' to write to stderr"
+        ),
+        default=None,
+    )
+    parser.add_argument(
+        "--selector-profile-memory",
+        action="store_true",
+        help=(
+            "also write the peak memory of each phase with '--selector-profile'. "
+            "Tracing memory slows selection down several times over so the wall times are not representative"
+        ),
+        default=False,
+    )
+
+
+def _build_graph_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="git-select-tests build-graph",
+        description=(
+            "build the import graph of the working tree, or of '--revision', and write it to a graph artifact tagged "
+            "with the commit, e.g. to publish from CI for later jobs to load with 'git-select-tests load-graph'"
+        ),
+    )
+    parser.add_argument(
+        "--output",
+        metavar="PATH",
+        required=True,
+        help="path of the graph artifact to write",
+    )
+    _add_project_args(parser)
+    parser.add_argument(
+        "--graph-cache",
+        help=(
+            "path of a file used to cache the resolved imports of each file between runs. "
+            "The file is created if it does not exist"
+        ),
+        default=None,
+    )
+    _add_parse_args(parser)
+    _add_git_args(parser)
+    _add_profile_arg(parser)
+    return parser
+
+
+def _build_daemon_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="git-select-tests daemon",
+        description=(
+            "serve test selection requests over a Unix socket keeping the import graph in memory. "
+            "Files are polled for changes and the import graph is updated in the background"
+        ),
+    )
+    parser.add_argument(
+        "--socket", required=True, help="path of the Unix socket to listen on"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        help="seconds between polls of the files in the import graph for changes. Defaults to 1",
+        default=1.0,
     )
     return parser
 
 
+def daemon_main(argv: List[str]) -> int:
+    args = _build_daemon_parser().parse_args(argv)
+
+    from pytest_git_selector.daemon import SelectorDaemon
+    from pytest_git_selector.errors import DaemonRunningException
+
+    # Exit through the with block on SIGTERM too so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        daemon = SelectorDaemon(args.socket, poll_interval=args.poll_interval)
+    except DaemonRunningException as e:
+        print(f"git-select-tests: {e}", file=sys.stderr)
+        return 1
+
+    with daemon:
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+
+def build_graph_main(argv: List[str]) -> int:
+    args = _build_graph_parser().parse_args(argv)
+
+    if args.extra_deps_file:
+        extra_deps = parse_extra_deps_file(args.extra_deps_file)
+    else:
+        extra_deps = None
+
+    profile = _create_profile(args)
+
+    from pytest_git_selector.selector import build_graph_artifact
+
+    with _open_parse_cache(args) as parse_cache:
+        build_graph_artifact(
+            args.output,
+            args.test_path,
+            args.src_path,
+            dir_name=args.dir,
+            extra_deps=extra_deps,
+            graph_cache=args.graph_cache,
+            parse_cache=parse_cache,
+            workers=args.selector_workers,
+            profile=profile,
+            git_backend=args.git_backend,
+            revision=args.revision,
+        )
+
+    if profile is not None:
+        _write_profile(profile, args.selector_profile)
+
+    return 0
+
+
 def main():
+    if sys.argv[1:2] == ["daemon"]:
+        return daemon_main(sys.argv[2:])
+    if sys.argv[1:2] == ["build-graph"]:
+        return build_graph_main(sys.argv[2:])
+
+    load_graph = sys.argv[1:2] == ["load-graph"]
+
+    if load_graph:
+        del sys.argv[1]
+
     try:
-        args, git_diff_args = parse_args()
+        args, git_diff_args = parse_args(load_graph)
     except ValueError:
         return 1
 
@@ -95,18 +438,224 @@ def main():
     else:
         extra_deps = None
 
-    required_test_files = select_test_files(
-        git_diff_args,
-        args.test_path,
-        args.src_path,
-        dir_name=args.dir,
-        extra_deps=extra_deps,
-    )
+    profile = _create_profile(args)
+
+    if args.batch is not None:
+        return _batch_main(args, extra_deps, profile)
+
+    if load_graph:
+        return _load_graph_main(args, git_diff_args, profile)
+
+    if (
+        args.daemon_socket
+        and profile is None
+        and args.graph_snapshot is None
+        and args.revision is None
+    ):
+        from pytest_git_selector.daemon import request_selection
+
+        required_test_files = request_selection(
+            args.daemon_socket,
+            git_diff_args,
+            args.test_path,
+            args.src_path,
+            dir_name=args.dir,
+            extra_deps=extra_deps,
+            granularity=args.selector_granularity,
+            git_backend=args.git_backend,
+        )
+
+        if required_test_files is not None:
+            _write_test_files(args, _shard(args, required_test_files))
+            return 0
+
+    # Imported after parsing the args so --help and the daemon client do not pay for importing GitPython and importlab
+    from pytest_git_selector.selector import iter_test_files, select_test_files
+
+    if profile is None and args.shards is None:
+        # Stream test files so consumers can start on them before the traversal of the import graph finishes
+        with _open_parse_cache(args) as parse_cache:
+            _write_test_files(
+                args,
+                iter_test_files(
+                    git_diff_args,
+                    args.test_path,
+                    args.src_path,
+                    dir_name=args.dir,
+                    extra_deps=extra_deps,
+                    graph_cache=args.graph_cache,
+                    parse_cache=parse_cache,
+                    workers=args.selector_workers,
+                    graph_snapshot=args.graph_snapshot,
+                    granularity=args.selector_granularity,
+                    git_backend=args.git_backend,
+                    revision=args.revision,
+                ),
+            )
+        return 0
+
+    with _open_parse_cache(args) as parse_cache:
+        required_test_files = select_test_files(
+            git_diff_args,
+            args.test_path,
+            args.src_path,
+            dir_name=args.dir,
+            extra_deps=extra_deps,
+            graph_cache=args.graph_cache,
+            parse_cache=parse_cache,
+            workers=args.selector_workers,
+            profile=profile,
+            graph_snapshot=args.graph_snapshot,
+            granularity=args.selector_granularity,
+            git_backend=args.git_backend,
+            revision=args.revision,
+        )
+    _write_test_files(args, _shard(args, required_test_files))
+
+    if profile is not None:
+        _write_profile(profile, args.selector_profile)
+
+    return 0
+
+
+def _batch_main(args, extra_deps, profile: Optional[SelectionProfile]) -> int:
+    if args.batch == "-":
+        specs = _read_batch_specs(sys.stdin)
+    else:
+        with open(args.batch) as f:
+            specs = _read_batch_specs(f)
+
+    from pytest_git_selector.selector import select_tests_batch
+
+    with _open_parse_cache(args) as parse_cache:
+        selections = select_tests_batch(
+            [shlex.split(spec) for spec in specs],
+            args.test_path,
+            args.src_path,
+            dir_name=args.dir,
+            extra_deps=extra_deps,
+            graph_cache=args.graph_cache,
+            parse_cache=parse_cache,
+            workers=args.selector_workers,
+            profile=profile,
+            graph_snapshot=args.graph_snapshot,
+            granularity=args.selector_granularity,
+            git_backend=args.git_backend,
+            revision=args.revision,
+        )
+    output = {
+        spec: sorted(_format_path(args, f) for f in _shard(args, selection.test_files))
+        for spec, selection in zip(specs, selections)
+    }
+    print(json.dumps(output, indent=2))
+
+    if profile is not None:
+        _write_profile(profile, args.selector_profile)
+
+    return 0
+
+
+def _load_graph_main(args, git_diff_args, profile: Optional[SelectionProfile]) -> int:
+    from pytest_git_selector.errors import InvalidGraphArtifactException
+    from pytest_git_selector.selector import select_tests_from_graph_artifact
+
+    try:
+        with _open_parse_cache(args) as parse_cache:
+            selection = select_tests_from_graph_artifact(
+                args.graph,
+                git_diff_args,
+                dir_name=args.dir,
+                parse_cache=parse_cache,
+                workers=args.selector_workers,
+                profile=profile,
+                granularity=args.selector_granularity,
+                git_backend=args.git_backend,
+                revision=args.revision,
+            )
+    except InvalidGraphArtifactException as e:
+        # Callers can build the graph from scratch instead, e.g. when the artifact was built with another version
+        print(f"git-select-tests: {e}", file=sys.stderr)
+        return 1
+
+    _write_test_files(args, _shard(args, selection.test_files))
 
-    print("\n".join(required_test_files))
+    if profile is not None:
+        _write_profile(profile, args.selector_profile)
 
     return 0
 
 
+@contextlib.contextmanager
+def _open_parse_cache(args) -> Iterator[Optional["ParseCache"]]:
+    if args.parse_cache is None:
+        yield None
+        return
+
+    from pytest_git_selector.parse_cache import ParseCache
+
+    parse_cache = ParseCache(
+        args.parse_cache, max_size=args.parse_cache_max_size * 1024 * 1024
+    )
+
+    try:
+        yield parse_cache
+    finally:
+        parse_cache.close()
+
+
+def _read_batch_specs(f: IO[str]) -> List[str]:
+    specs = (line.strip() for line in f)
+    return [spec for spec in specs if spec and not spec.startswith("#")]
+
+
+def _write_test_files(args, test_files: Iterable[str]) -> None:
+    for test_file in test_files:
+        if args.format == "nul":
+            sys.stdout.write(test_file + "\0")
+        elif args.format == "jsonl":
+            record = {"path": test_file, "nodeid": _format_path(args, test_file)}
+            sys.stdout.write(json.dumps(record) + "\n")
+        else:
+            sys.stdout.write(_format_path(args, test_file) + "\n")
+
+        sys.stdout.flush()
+
+
+def _format_path(args, path: str) -> str:
+    if args.format == "relative":
+        return os.path.relpath(path, os.path.realpath(os.curdir))
+    if args.format in ("nodeid", "jsonl"):
+        return os.path.relpath(path, os.path.realpath(args.dir)).replace(os.sep, "/")
+    return path
+
+
+def _shard(args, test_files: MutableSet[str]) -> Iterable[str]:
+    if args.shards is None:
+        return test_files
+
+    cache_dir = args.pytest_cache_dir or os.path.join(args.dir, ".pytest_cache")
+    return shard_test_files(
+        test_files,
+        args.shards,
+        args.shard_index,
+        durations=load_durations(cache_dir, args.dir),
+    )
+
+
+def _create_profile(args) -> Optional[SelectionProfile]:
+    if not args.selector_profile:
+        return None
+    return SelectionProfile(trace_memory=args.selector_profile_memory)
+
+
+def _write_profile(profile: SelectionProfile, filename: str) -> None:
+    if filename == "-":
+        json.dump(profile.to_dict(), sys.stderr, indent=2)
+        sys.stderr.write("\n")
+    else:
+        with open(filename, "w") as f:
+            json.dump(profile.to_dict(), f, indent=2)
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,335 @@
+import array
+import collections
+
+from typing import Dict, Iterable, Iterator, List, MutableSet, Tuple
+
+# Type codes of the arrays holding edge offsets and node ids. Fixed size so the arrays can be written out as is
+OFFSET_TYPECODE = "q"
+NODE_TYPECODE = "i"
+
+
+class CompactGraph:
+    """
+    Immutable directed graph of files with paths interned as integer ids and adjacency stored in CSR arrays.
+
+    The predecessors of node i are preds[pred_offsets[i]:pred_offsets[i + 1]] and likewise for successors. Edges
+    point from the importing file to the imported file. Cycles are kept as is rather than collapsed into a single node
+    so every file in a cycle can be matched against a diff.
+    """
+
+    def __init__(
+        self,
+        paths: List[str],
+        pred_offsets: array.array,
+        preds: array.array,
+        succ_offsets: array.array,
+        succs: array.array,
+    ):
+        self.paths = paths
+        self.ids: Dict[str, int] = {path: i for i, path in enumerate(paths)}
+        self.pred_offsets = pred_offsets
+        self.preds = preds
+        self.succ_offsets = succ_offsets
+        self.succs = succs
+
+    @classmethod
+    def from_edges(cls, edges: Iterable[Tuple[str, str]]) -> "CompactGraph":
+        builder = CompactGraphBuilder()
+
+        for u, v in edges:
+            builder.add_edge(u, v)
+
+        return builder.build()
+
+    def number_of_nodes(self) -> int:
+        return len(self.paths)
+
+    def number_of_edges(self) -> int:
+        return len(self.succs)
+
+    def predecessors(self, node: int) -> array.array:
+        return self.preds[self.pred_offsets[node] : self.pred_offsets[node + 1]]
+
+    def successors(self, node: int) -> array.array:
+        return self.succs[self.succ_offsets[node] : self.succ_offsets[node + 1]]
+
+    def ancestors(self, nodes: Iterable[int]) -> MutableSet[int]:
+        # Walk predecessors from all nodes at once. Each node is visited at most once so shared ancestors in diamond
+        # shaped graphs are not revisited and deep import chains cannot exceed the recursion limit
+        offsets = self.pred_offsets
+        preds = self.preds
+        visited = set(nodes)
+        stack = list(visited)
+
+        while stack:
+            node = stack.pop()
+
+            for i in range(offsets[node], offsets[node + 1]):
+                if (pred := preds[i]) not in visited:
+                    visited.add(pred)
+                    stack.append(pred)
+
+        return visited
+
+    def descendants(self, nodes: Iterable[int]) -> MutableSet[int]:
+        # Same walk as ancestors along successors
+        offsets = self.succ_offsets
+        succs = self.succs
+        visited = set(nodes)
+        stack = list(visited)
+
+        while stack:
+            node = stack.pop()
+
+            for i in range(offsets[node], offsets[node + 1]):
+                if (succ := succs[i]) not in visited:
+                    visited.add(succ)
+                    stack.append(succ)
+
+        return visited
+
+    def ancestor_distances(self, nodes: Iterable[int]) -> Dict[int, int]:
+        # Breadth first so each ancestor is given the number of imports on its shortest path to one of the nodes
+        offsets = self.pred_offsets
+        preds = self.preds
+        distances = dict.fromkeys(nodes, 0)
+        queue = collections.deque(distances)
+
+        while queue:
+            node = queue.popleft()
+            distance = distances[node] + 1
+
+            for i in range(offsets[node], offsets[node + 1]):
+                if (pred := preds[i]) not in distances:
+                    distances[pred] = distance
+                    queue.append(pred)
+
+        return distances
+
+    def roots(self, ancestors: MutableSet[int]) -> MutableSet[int]:
+        """
+        Nodes of a set closed under predecessors that no node outside of their import cycle imports.
+
+        Same as the nodes without predecessors once each cycle is collapsed into a single node like importlab does,
+        except all files of a cycle are returned instead of the collapsed node.
+        """
+        offsets = self.pred_offsets
+        roots = set()
+
+        for component in self._strongly_connected_components(ancestors):
+            if len(component) == 1:
+                # Self edges only come from --extra-deps-file and importlab does not treat them as cycles
+                node = component[0]
+
+                if offsets[node] == offsets[node + 1]:
+                    roots.add(node)
+                continue
+
+            members = set(component)
+
+            if all(
+                self.preds[i] in members
+                for node in component
+                for i in range(offsets[node], offsets[node + 1])
+            ):
+                roots.update(members)
+
+        return roots
+
+    def root_ancestors(self, nodes: Iterable[int]) -> MutableSet[int]:
+        return self.roots(self.ancestors(nodes))
+
+    def iter_root_ancestors(self, nodes: Iterable[int]) -> Iterator[int]:
+        """
+        Same nodes as root_ancestors yielded as they are found.
+
+        Ancestors without predecessors are yielded as soon as they are reached. Roots that are part of an import cycle
+        can only be told apart once every ancestor is known so they are yielded last.
+        """
+        offsets = self.pred_offsets
+        preds = self.preds
+        visited = set(nodes)
+        stack = list(visited)
+
+        for node in stack:
+            if offsets[node] == offsets[node + 1]:
+                yield node
+
+        while stack:
+            node = stack.pop()
+
+            for i in range(offsets[node], offsets[node + 1]):
+                if (pred := preds[i]) not in visited:
+                    visited.add(pred)
+                    stack.append(pred)
+
+                    if offsets[pred] == offsets[pred + 1]:
+                        yield pred
+
+        for node in self.roots(visited):
+            if offsets[node] != offsets[node + 1]:
+                yield node
+
+    def to_networkx(self):
+        """Export to a networkx.DiGraph with paths as nodes. Requires networkx to be installed."""
+        import networkx
+
+        graph = networkx.DiGraph()
+        graph.add_nodes_from(self.paths)
+        graph.add_edges_from(
+            (self.paths[node], self.paths[succ])
+            for node in range(len(self.paths))
+            for succ in self.successors(node)
+        )
+        return graph
+
+    def _strongly_connected_components(
+        self, nodes: MutableSet[int]
+    ) -> Iterator[List[int]]:
+        # Iterative Tarjan's algorithm over the predecessors of a set of nodes closed under predecessors
+        offsets = self.pred_offsets
+        preds = self.preds
+        index: Dict[int, int] = {}
+        lowlink: Dict[int, int] = {}
+        stack: List[int] = []
+        on_stack = set()
+
+        for start in nodes:
+            if start in index:
+                continue
+
+            index[start] = lowlink[start] = len(index)
+            stack.append(start)
+            on_stack.add(start)
+            work = [(start, offsets[start])]
+
+            while work:
+                node, i = work[-1]
+
+                if i < offsets[node + 1]:
+                    work[-1] = node, i + 1
+                    pred = preds[i]
+
+                    if pred not in index:
+                        index[pred] = lowlink[pred] = len(index)
+                        stack.append(pred)
+                        on_stack.add(pred)
+                        work.append((pred, offsets[pred]))
+                    elif pred in on_stack:
+                        lowlink[node] = min(lowlink[node], index[pred])
+                    continue
+
+                work.pop()
+
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+                if lowlink[node] == index[node]:
+                    component = []
+
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+
+                        if member == node:
+                            break
+
+                    yield component
+
+
+class CompactGraphBuilder:
+    """Interns paths and collects edges for a CompactGraph. Duplicate edges are dropped when building."""
+
+    def __init__(self):
+        self.paths: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self._sources = array.array(NODE_TYPECODE)
+        self._targets = array.array(NODE_TYPECODE)
+        self._removed: MutableSet[int] = set()
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.ids and self.ids[path] not in self._removed
+
+    def add_node(self, path: str) -> int:
+        if (node := self.ids.get(path)) is None:
+            node = self.ids[path] = len(self.paths)
+            self.paths.append(path)
+        else:
+            self._removed.discard(node)
+
+        return node
+
+    def add_edge(self, u: str, v: str) -> None:
+        self._sources.append(self.add_node(u))
+        self._targets.append(self.add_node(v))
+
+    def remove_node(self, path: str) -> None:
+        # Edges of removed nodes are dropped when building
+        if path in self.ids:
+            self._removed.add(self.ids[path])
+
+    def build(self) -> CompactGraph:
+        paths = self.paths
+        sources = self._sources
+        targets = self._targets
+
+        if self._removed:
+            # Renumber the remaining nodes
+            new_ids = array.array(NODE_TYPECODE, [-1]) * len(paths)
+            paths = []
+
+            for node, path in enumerate(self.paths):
+                if node not in self._removed:
+                    new_ids[node] = len(paths)
+                    paths.append(path)
+
+            sources = array.array(NODE_TYPECODE)
+            targets = array.array(NODE_TYPECODE)
+
+            for u, v in zip(self._sources, self._targets):
+                if new_ids[u] >= 0 and new_ids[v] >= 0:
+                    sources.append(new_ids[u])
+                    targets.append(new_ids[v])
+
+        succ_offsets, succs = _to_csr(len(paths), sources, targets)
+        sources = array.array(
+            NODE_TYPECODE,
+            (
+                node
+                for node in range(len(paths))
+                for _ in range(succ_offsets[node + 1] - succ_offsets[node])
+            ),
+        )
+        pred_offsets, preds = _to_csr(len(paths), succs, sources)
+        return CompactGraph(paths, pred_offsets, preds, succ_offsets, succs)
+
+
+def _to_csr(
+    num_nodes: int, sources: array.array, targets: array.array
+) -> Tuple[array.array, array.array]:
+    # Counting sort of the edges by source followed by removing duplicate targets of each source
+    offsets = array.array(OFFSET_TYPECODE, [0]) * (num_nodes + 1)
+
+    for u in sources:
+        offsets[u + 1] += 1
+
+    for node in range(num_nodes):
+        offsets[node + 1] += offsets[node]
+
+    positions = offsets[:-1]
+    adjacent = array.array(NODE_TYPECODE, [0]) * len(sources)
+
+    for u, v in zip(sources, targets):
+        adjacent[positions[u]] = v
+        positions[u] += 1
+
+    unique_offsets = array.array(OFFSET_TYPECODE, [0]) * (num_nodes + 1)
+    unique_adjacent = array.array(NODE_TYPECODE)
+
+    for node in range(num_nodes):
+        unique_adjacent.extend(sorted(set(adjacent[offsets[node] : offsets[node + 1]])))
+        unique_offsets[node + 1] = len(unique_adjacent)
+
+    return unique_offsets, unique_adjacent
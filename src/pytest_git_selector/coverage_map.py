@@ -0,0 +1,194 @@
+import os
+import sqlite3
+import sys
+import threading
+import types
+
+from typing import Dict, Iterable, MutableSet, Optional, Set
+
+from pytest_git_selector.util import sqlite_chunks, sqlite_placeholders
+
+
+class CoverageMap:
+    """
+    Source files executed by each test item, stored in a SQLite database.
+
+    Paths are stored relative to the root directory so the map can be shared between checkouts of the same
+    repository. Test items are identified by their node ID.
+    """
+
+    def __init__(self, filename: str, root: str):
+        self.filename = filename
+        self.root = os.path.realpath(root)
+        # Concurrent writers such as pytest-xdist workers wait for each other
+        self.connection = sqlite3.connect(filename, timeout=60)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, nodeid TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS item_files (
+                item_id INTEGER NOT NULL,
+                file_id INTEGER NOT NULL,
+                PRIMARY KEY (item_id, file_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS item_files_file_id ON item_files (file_id);
+            """)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def record(self, item_files: Dict[str, Iterable[str]]) -> None:
+        # Replaces anything previously recorded for the given items
+        with self.connection:
+            for nodeid, files in item_files.items():
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO items (nodeid) VALUES (?)", (nodeid,)
+                )
+                (item_id,) = self.connection.execute(
+                    "SELECT id FROM items WHERE nodeid = ?", (nodeid,)
+                ).fetchone()
+                self.connection.execute(
+                    "DELETE FROM item_files WHERE item_id = ?", (item_id,)
+                )
+
+                for path in map(self._to_relative_path, files):
+                    self.connection.execute(
+                        "INSERT OR IGNORE INTO files (path) VALUES (?)", (path,)
+                    )
+                    self.connection.execute(
+                        "INSERT OR IGNORE INTO item_files (item_id, file_id) "
+                        "SELECT ?, id FROM files WHERE path = ?",
+                        (item_id, path),
+                    )
+
+    def recorded_items(self) -> MutableSet[str]:
+        return {
+            nodeid for (nodeid,) in self.connection.execute("SELECT nodeid FROM items")
+        }
+
+    def known_files(self, files: Iterable[str]) -> MutableSet[str]:
+        # Files that were executed by at least one recorded item
+        relative_paths = {self._to_relative_path(f): f for f in files}
+        known = set()
+
+        for chunk in sqlite_chunks(list(relative_paths)):
+            query = (
+                f"SELECT path FROM files WHERE path IN ({sqlite_placeholders(chunk)})"
+            )
+            known.update(
+                relative_paths[path]
+                for (path,) in self.connection.execute(query, chunk)
+            )
+
+        return known
+
+    def items_executing(self, files: Iterable[str]) -> MutableSet[str]:
+        relative_paths = list(set(map(self._to_relative_path, files)))
+        nodeids = set()
+
+        for chunk in sqlite_chunks(relative_paths):
+            query = (
+                "SELECT DISTINCT items.nodeid FROM items "
+                "JOIN item_files ON item_files.item_id = items.id "
+                "JOIN files ON files.id = item_files.file_id "
+                f"WHERE files.path IN ({sqlite_placeholders(chunk)})"
+            )
+            nodeids.update(
+                nodeid for (nodeid,) in self.connection.execute(query, chunk)
+            )
+
+        return nodeids
+
+    def _to_relative_path(self, path: str) -> str:
+        return os.path.relpath(os.path.realpath(path), self.root)
+
+
+class CoverageRecorder:
+    """
+    Records the source files under a root directory executed while recording.
+
+    Uses sys.monitoring on Python 3.12 and later which only reports the first time each code object starts executing.
+    Falls back to a profile function on earlier versions which is called on every function call.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root) + os.sep
+        self._codes: MutableSet[types.CodeType] = set()
+        self._files: Dict[str, Optional[str]] = {}
+        self._excluded = tuple(
+            os.path.realpath(p) + os.sep
+            for p in {sys.prefix, sys.exec_prefix, sys.base_prefix}
+        )
+        self._tool_id = _acquire_monitoring_tool_id()
+
+    def close(self) -> None:
+        if self._tool_id is not None:
+            sys.monitoring.free_tool_id(self._tool_id)
+            self._tool_id = None
+
+    def start(self) -> None:
+        self._codes = set()
+
+        if self._tool_id is not None:
+            sys.monitoring.register_callback(
+                self._tool_id, sys.monitoring.events.PY_START, self._on_py_start
+            )
+            # Events disabled while recording the previous item are reported again
+            sys.monitoring.restart_events()
+            sys.monitoring.set_events(self._tool_id, sys.monitoring.events.PY_START)
+        else:
+            sys.setprofile(self._on_profile_event)
+            threading.setprofile(self._on_profile_event)
+
+    def stop(self) -> Set[str]:
+        if self._tool_id is not None:
+            sys.monitoring.set_events(self._tool_id, 0)
+        else:
+            sys.setprofile(None)
+            threading.setprofile(None)
+
+        files = set()
+
+        for filename in {code.co_filename for code in self._codes}:
+            if filename not in self._files:
+                self._files[filename] = self._filter(filename)
+
+            if (path := self._files[filename]) is not None:
+                files.add(path)
+
+        self._codes = set()
+        return files
+
+    def _on_py_start(self, code: types.CodeType, instruction_offset: int):
+        self._codes.add(code)
+        return sys.monitoring.DISABLE
+
+    def _on_profile_event(self, frame: types.FrameType, event: str, arg) -> None:
+        if event == "call":
+            self._codes.add(frame.f_code)
+
+    def _filter(self, filename: str) -> Optional[str]:
+        # Only source files of the project are recorded. Virtual environments may live under the root directory
+        path = os.path.realpath(filename)
+
+        if not path.startswith(self.root) or path.startswith(self._excluded):
+            return None
+
+        if not os.path.isfile(path):
+            return None
+
+        return path
+
+
+def _acquire_monitoring_tool_id() -> Optional[int]:
+    if not hasattr(sys, "monitoring"):
+        return None
+
+    # Leave the IDs reserved for debuggers and coverage tools to them
+    for tool_id in (sys.monitoring.PROFILER_ID, 3, 4):
+        try:
+            sys.monitoring.use_tool_id(tool_id, "pytest-git-selector")
+        except ValueError:
+            continue
+        return tool_id
+
+    return None
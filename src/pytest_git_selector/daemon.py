@@ -0,0 +1,332 @@
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+from typing import TYPE_CHECKING, Dict, List, MutableSet, Optional, Set, Tuple
+
+from pytest_git_selector.errors import DaemonRunningException
+from pytest_git_selector.util import clear_canonical_path_cache
+
+# Clients only need the socket so the selector and importlab are imported by the daemon when it first needs them
+if TYPE_CHECKING:
+    from pytest_git_selector.graph_artifact import GraphArtifact
+
+# Seconds a client waits for the daemon before falling back to selecting in-process
+CLIENT_TIMEOUT = 600
+
+# Import graphs kept in memory, the least recently requested is dropped first
+MAX_GRAPHS = 4
+
+
+class SelectorDaemon(socketserver.UnixStreamServer):
+    """
+    Server that answers test selection requests over a Unix socket while keeping import graphs in memory.
+
+    Each request is a single line of JSON holding the arguments to select_test_files and is answered with a single
+    line of JSON holding the selected test files. The import graph of each set of test paths, python path and extra
+    dependencies is built on the first request and kept in memory, up to MAX_GRAPHS of them. A background thread
+    polls the files of the graph of the most recent request, and the directories they and the files their imports
+    looked up are in, and only resolves the imports of the files that changed, or may resolve to an added file, so the
+    next request does not have to. Requests check for changes the same way before selecting.
+    """
+
+    def __init__(self, socket_path: str, poll_interval: float = 1.0):
+        self.socket_path = socket_path
+        self.poll_interval = poll_interval
+        self._graphs: Dict[tuple, _WatchedGraph] = {}
+        self._lock = threading.Lock()
+        self._last_graph: Optional[_WatchedGraph] = None
+        self._stopped = threading.Event()
+
+        if os.path.exists(socket_path):
+            _remove_stale_socket(socket_path)
+
+        super().__init__(socket_path, _RequestHandler)
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        poller = threading.Thread(target=self._poll, daemon=True)
+        poller.start()
+
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._stopped.set()
+
+    def server_close(self) -> None:
+        super().server_close()
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def select(self, request: dict) -> MutableSet[str]:
+        from pytest_git_selector.selector import (
+            _call_git_diff,
+            _import_graph_from_artifact,
+            _select_tests_from_graph,
+        )
+
+        granularity = request.get("granularity", "file")
+
+        with self._lock:
+            # Symbolic links may have changed since the last request
+            clear_canonical_path_cache()
+            diff_files, deleted_files = _call_git_diff(
+                request["git_diff_args"],
+                dir_name=request["dir_name"],
+                git_backend=request.get("git_backend", "auto"),
+            )
+            # Files deleted by the diff are presented as empty files the same way as by select_test_files
+            missing_files = {f for f in deleted_files if not os.path.exists(f)}
+            graph = self._get_graph(request, missing_files)
+            graph.refresh(missing_files)
+            self._last_graph = graph
+
+            return _select_tests_from_graph(
+                _import_graph_from_artifact(
+                    graph.artifact, graph.missing_files, granularity
+                ),
+                request["git_diff_args"],
+                diff_files,
+                deleted_files,
+                dir_name=request["dir_name"],
+                granularity=granularity,
+            ).test_files
+
+    def _get_graph(self, request: dict, missing_files: Set[str]) -> "_WatchedGraph":
+        from pytest_git_selector.selector import (
+            _create_import_graph,
+            _graph_artifact,
+            _to_absolute_path_extra_deps,
+        )
+
+        # The same run may list its paths in a different order, e.g. from iterating a set, so order them to reuse
+        # the graph. The python path keeps its order as it decides which file an import resolves to
+        test_paths = sorted(set(request["test_paths"]))
+        python_path = list(dict.fromkeys(request["python_path"]))
+        extra_deps = sorted({tuple(e) for e in request["extra_deps"] or []})
+        key = (
+            tuple(test_paths),
+            tuple(python_path),
+            tuple(extra_deps),
+            request["dir_name"],
+        )
+
+        if key in self._graphs:
+            self._graphs[key] = self._graphs.pop(key)
+        else:
+            while len(self._graphs) >= MAX_GRAPHS:
+                del self._graphs[next(iter(self._graphs))]
+
+            extra_deps = _to_absolute_path_extra_deps(extra_deps, request["dir_name"])
+            import_graph = _create_import_graph(
+                missing_files,
+                python_path,
+                test_paths=test_paths,
+                dir_name=request["dir_name"],
+                extra_deps=extra_deps,
+            )
+            artifact = _graph_artifact(
+                import_graph, None, python_path, test_paths, extra_deps
+            )
+            self._graphs[key] = _WatchedGraph(artifact, missing_files)
+
+        return self._graphs[key]
+
+    def _poll(self) -> None:
+        while not self._stopped.wait(self.poll_interval):
+            with self._lock:
+                if self._last_graph is None:
+                    continue
+
+                # Resolve the files that changed ahead of the next request
+                try:
+                    self._last_graph.refresh(self._last_graph.missing_files)
+                except Exception:
+                    # The working tree may be in the middle of changing. Try again on the next poll
+                    continue
+
+
+class _WatchedGraph:
+    """
+    Import graph kept in memory as a graph artifact along with the state of the files it was built from.
+
+    refresh resolves the imports of the files whose modification time or size changed since, the files added to the
+    watched directories and the files affected by them, and merges them into the graph the same way as a graph
+    artifact is brought up to date.
+    """
+
+    def __init__(self, artifact: "GraphArtifact", missing_files: Set[str]):
+        self.artifact = artifact
+        # Files that do not exist but are presented as empty files so the files importing them keep their edges
+        self.missing_files = missing_files
+        self.watched = _stat_watched(artifact)
+
+    def refresh(self, deleted_files: Set[str]) -> None:
+        from pytest_git_selector.selector import (
+            _advance_graph_artifact,
+            _apply_graph_artifact_changes,
+        )
+
+        watched = _stat_watched(self.artifact)
+        changed_files = _changed_files(self.watched, watched)
+        # Files of the graph deleted since it was built keep being presented as empty files
+        missing_files = deleted_files | {
+            path for path in self.artifact.graph.paths if path not in watched
+        }
+        changed_files.update(missing_files - self.missing_files)
+
+        if not changed_files:
+            return
+
+        import_graph, resolved = _apply_graph_artifact_changes(
+            self.artifact, changed_files, missing_files
+        )
+        self.artifact = _advance_graph_artifact(self.artifact, import_graph, resolved)
+        self.missing_files = missing_files
+        # Files changed while resolving are resolved on the next refresh since they keep the state read before
+        self.watched = {**_stat_watched(self.artifact), **watched}
+
+
+def _stat_watched(artifact: "GraphArtifact") -> Dict[str, Tuple[int, int, int]]:
+    # Directories are watched too so that added and removed files are noticed. The directories of the files looked up
+    # by imports that did not exist are watched even if they do not exist yet, e.g. a package that has not been added
+    graph = artifact.graph
+    paths = set(graph.paths)
+    paths.update(os.path.dirname(f) for f in graph.paths)
+    paths.update(
+        os.path.dirname(f)
+        for missing_files in artifact.missing_files.values()
+        for f in missing_files
+    )
+    paths.update(artifact.test_paths)
+
+    for test_path in artifact.test_paths:
+        for root, dirs, _ in os.walk(test_path):
+            paths.update(os.path.join(root, d) for d in dirs)
+
+    watched = {}
+
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        watched[path] = st.st_mtime_ns, st.st_size, st.st_mode
+
+    return watched
+
+
+def _changed_files(
+    old: Dict[str, Tuple[int, int, int]], new: Dict[str, Tuple[int, int, int]]
+) -> Set[str]:
+    changed = {
+        path for path in old.keys() | new.keys() if old.get(path) != new.get(path)
+    }
+
+    # Files added to a changed directory are not watched yet
+    for path in list(changed):
+        if path in new and stat.S_ISDIR(new[path][2]):
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+
+            changed.update(
+                entry.path
+                for entry in entries
+                if entry.path not in old and entry.is_file()
+            )
+
+    return changed
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        line = self.rfile.readline()
+
+        # Connections closed without a request, e.g. by a daemon checking whether the socket is in use
+        if not line:
+            return
+
+        request = json.loads(line)
+
+        if request.get("command") == "shutdown":
+            self._respond({"status": "ok"})
+            threading.Thread(target=self.server.shutdown).start()
+            return
+
+        try:
+            test_files = self.server.select(request)
+        except Exception as e:
+            self._respond({"error": f"{type(e).__name__}: {e}"})
+        else:
+            self._respond({"test_files": sorted(test_files)})
+
+    def _respond(self, response: dict) -> None:
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+def _remove_stale_socket(socket_path: str) -> None:
+    # The socket of a daemon that was killed is left behind and refuses connections. A live daemon keeps its socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+            return
+
+    raise DaemonRunningException(f"A daemon is already listening on {socket_path}")
+
+
+def request_selection(
+    socket_path: str,
+    git_diff_args: List[str],
+    test_paths: List[str],
+    python_path: List[str],
+    dir_name: str = ".",
+    extra_deps: Optional[List[Tuple[str, str]]] = None,
+    granularity: str = "file",
+    git_backend: str = "auto",
+) -> Optional[MutableSet[str]]:
+    # Returns None if no daemon is listening on the socket or the daemon failed so the caller can select in-process
+    request = {
+        "git_diff_args": git_diff_args,
+        # The daemon runs in a different working directory so send absolute paths
+        "test_paths": sorted({os.path.abspath(p) for p in test_paths}),
+        "python_path": list(dict.fromkeys(os.path.abspath(p) for p in python_path)),
+        "dir_name": os.path.abspath(dir_name),
+        "extra_deps": extra_deps,
+        "granularity": granularity,
+        "git_backend": git_backend,
+    }
+    response = _send(socket_path, request)
+
+    if response is None or "test_files" not in response:
+        return None
+
+    return set(response["test_files"])
+
+
+def shutdown_daemon(socket_path: str) -> bool:
+    return _send(socket_path, {"command": "shutdown"}) is not None
+
+
+def _send(socket_path: str, request: dict) -> Optional[dict]:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(CLIENT_TIMEOUT)
+            client.connect(socket_path)
+            client.sendall(json.dumps(request).encode() + b"\n")
+
+            with client.makefile("rb") as f:
+                response = f.readline()
+    except OSError:
+        return None
+
+    if not response:
+        return None
+
+    return json.loads(response)
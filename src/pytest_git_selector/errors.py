@@ -1,2 +1,17 @@
 class UnsupportedArgumentException(ValueError):
     pass
+
+
+class NativeGitUnsupportedException(UnsupportedArgumentException):
+    # Raised by the native git backend for args or repositories it cannot read without git
+    pass
+
+
+class InvalidGraphArtifactException(ValueError):
+    # Raised for graph artifacts that are corrupt or were written by another format version or platform
+    pass
+
+
+class DaemonRunningException(OSError):
+    # Raised when starting a daemon on the socket of a daemon that is still listening
+    pass
@@ -0,0 +1,221 @@
+import ast
+import functools
+import os
+import sys
+import tempfile
+
+from typing import TYPE_CHECKING, FrozenSet, List, Optional, Set, Tuple
+
+import importlab.environment
+import importlab.fs
+import importlab.import_finder
+import importlab.parsepy
+import importlab.utils
+
+from pytest_git_selector.util import canonical_path
+
+if TYPE_CHECKING:
+    from pytest_git_selector.git_tree import GitTree
+
+
+class OSFileSystem(importlab.fs.OSFileSystem):
+    """
+    importlab.fs.OSFileSystem that checks whether the file system is case insensitive once per process.
+
+    importlab creates a temporary file every time an OSFileSystem is constructed and never removes it.
+    """
+
+    _case_insensitive = None
+
+    def __init__(self, root: str):
+        assert root is not None
+        self.root = root
+
+        if OSFileSystem._case_insensitive is None:
+            fd, tmp_path = tempfile.mkstemp()
+            os.close(fd)
+
+            try:
+                OSFileSystem._case_insensitive = os.path.exists(tmp_path.upper())
+            finally:
+                os.remove(tmp_path)
+
+        self._is_case_insensitive = OSFileSystem._case_insensitive
+
+
+class DeletedFilesOverlay(importlab.fs.FileSystem):
+    """
+    File system that presents deleted files as empty files on top of another file system.
+
+    Imports of deleted files still resolve to the deleted file without having to restore the file in the working tree.
+    """
+
+    def __init__(
+        self, underlying: importlab.fs.FileSystem, deleted_files: FrozenSet[str]
+    ):
+        self.underlying = underlying
+        self.deleted_files = deleted_files
+
+    @property
+    def root(self):
+        return self.underlying.root
+
+    def isfile(self, path):
+        if self.underlying.refer_to(path) in self.deleted_files:
+            return True
+        return self.underlying.isfile(path)
+
+    def isdir(self, path):
+        fullpath = self.underlying.refer_to(path).rstrip(os.sep) + os.sep
+        return self.underlying.isdir(path) or any(
+            f.startswith(fullpath) for f in self.deleted_files
+        )
+
+    def read(self, path):
+        if self.underlying.refer_to(path) in self.deleted_files:
+            return ""
+        return self.underlying.read(path)
+
+    def refer_to(self, path):
+        return self.underlying.refer_to(path)
+
+    def relative_path(self, path):
+        return self.underlying.relative_path(path)
+
+
+class MissingFilesRecorder(importlab.fs.FileSystem):
+    """
+    File system that records the paths looked up in another file system that are not files.
+
+    An import resolves to the same file for as long as none of the paths looked up before it was found exist, so a
+    cached resolution is only valid while the recorded paths are still missing.
+    """
+
+    def __init__(self, underlying: importlab.fs.FileSystem, missing_files: Set[str]):
+        self.underlying = underlying
+        self.missing_files = missing_files
+
+    @property
+    def root(self):
+        return self.underlying.root
+
+    def isfile(self, path):
+        if self.underlying.isfile(path):
+            return True
+
+        self.missing_files.add(os.path.abspath(self.underlying.refer_to(path)))
+        return False
+
+    def isdir(self, path):
+        return self.underlying.isdir(path)
+
+    def read(self, path):
+        return self.underlying.read(path)
+
+    def refer_to(self, path):
+        return self.underlying.refer_to(path)
+
+    def relative_path(self, path):
+        return self.underlying.relative_path(path)
+
+
+class GitTreeFileSystem(importlab.fs.FileSystem):
+    """File system serving the files of a directory in the tree of a commit instead of the working tree."""
+
+    def __init__(self, root: str, tree: "GitTree"):
+        self.root = root
+        self.tree = tree
+
+    def isfile(self, path):
+        return self.tree.isfile(self.refer_to(path))
+
+    def isdir(self, path):
+        return self.tree.isdir(self.refer_to(path))
+
+    def read(self, path):
+        return self.tree.read_blobs([self.refer_to(path)])[self.refer_to(path)].decode()
+
+    def refer_to(self, path):
+        return os.path.normpath(os.path.join(self.root, path))
+
+    def relative_path(self, path):
+        if path.startswith(self.root):
+            return path[len(self.root) + 1 :]
+        return None
+
+
+def create_environment(
+    python_path: List[str],
+    deleted_files: FrozenSet[str] = frozenset(),
+    tree: Optional["GitTree"] = None,
+) -> importlab.environment.Environment:
+    # Same as importlab.environment.path_from_pythonpath
+    path = importlab.fs.Path()
+
+    for p in os.pathsep.join(python_path).split(os.pathsep):
+        if tree is not None:
+            # Canonical so the paths found match the paths of the tree which may not exist on disk
+            path.add_fs(GitTreeFileSystem(canonical_path(p), tree))
+        else:
+            path.add_fs(OSFileSystem(importlab.utils.expand_path(p)))
+
+    env = importlab.environment.Environment(path, sys.version_info[:2])
+    return add_deleted_files_overlay(env, deleted_files)
+
+
+def add_deleted_files_overlay(
+    env: importlab.environment.Environment, deleted_files: FrozenSet[str]
+) -> importlab.environment.Environment:
+    if deleted_files:
+        env.path = [DeletedFilesOverlay(fs, deleted_files) for fs in env.path]
+    return env
+
+
+def is_deleted_file(env: importlab.environment.Environment, filename: str) -> bool:
+    return any(
+        isinstance(fs, DeletedFilesOverlay) and filename in fs.deleted_files
+        for fs in env.path
+    )
+
+
+def get_imports(
+    filename: str, python_version, source: Optional[bytes] = None
+) -> List[importlab.parsepy.ImportStatement]:
+    """
+    Same as importlab.parsepy.get_imports but parses source instead of reading filename when it is given.
+
+    Source is e.g. the contents of the file at a commit that is not checked out. It is always parsed by the running
+    interpreter.
+    """
+    if source is None:
+        return importlab.parsepy.get_imports(filename, python_version)
+
+    finder = importlab.import_finder.ImportFinder()
+
+    try:
+        finder.visit(ast.parse(source, filename=filename))
+    except Exception:
+        raise importlab.parsepy.ParseError(filename)
+
+    return import_statements(finder.imports)
+
+
+def import_statements(
+    parsed: List[Tuple[str, str, bool, bool]],
+) -> List[importlab.parsepy.ImportStatement]:
+    # Import statements of a file parsed earlier, resolved by the running interpreter like importlab does after parsing
+    return [
+        importlab.parsepy.ImportStatement(*imp, _resolve_import(imp[0], imp[2], imp[3]))
+        for imp in parsed
+    ]
+
+
+def clear_resolve_import_cache() -> None:
+    # Modules may have been installed or removed since imports were last resolved
+    _resolve_import.cache_clear()
+
+
+@functools.lru_cache(maxsize=65536)
+def _resolve_import(name: str, is_from: bool, is_star: bool) -> Optional[str]:
+    # Most modules import the same few names. Finding the spec of a name searches sys.path every time
+    return importlab.import_finder.resolve_import(name, is_from, is_star)
@@ -0,0 +1,610 @@
+import hashlib
+import heapq
+import os
+import re
+import stat
+import warnings
+
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import git
+
+from pytest_git_selector.errors import (
+    NativeGitUnsupportedException,
+    UnsupportedArgumentException,
+)
+
+# Mode and binary SHA of a file in a tree, the index or the working tree
+_Entry = Tuple[int, bytes]
+# Old and new entry of a changed file. None if the file does not exist on that side
+_Change = Tuple[Optional[_Entry], Optional[_Entry]]
+
+# Entries of a tree object by name holding the octal mode as written in the tree and the binary SHA
+_Tree = Dict[bytes, Tuple[bytes, bytes]]
+# Each entry of a tree object is the octal mode, a space, the NUL terminated name and the binary SHA
+_TREE_ENTRY = re.compile(rb"([0-7]+) ([^\0]+)\0(.{20})", re.DOTALL)
+_TREE_MODE = b"40000"
+_GITLINK_MODE = 0o160000
+_SYMLINK_MODE = 0o120000
+_EXECUTABLE_MODE = 0o100755
+_REGULAR_MODE = 0o100644
+
+# Flags of the merge base search
+_PARENT1 = 1
+_PARENT2 = 2
+_STALE = 4
+
+
+class GitBackend:
+    """Reads the files changed by git diff args and the files tracked by a repository."""
+
+    def diff_name_status(
+        self, user_git_diff_args: List[str]
+    ) -> Iterable[Tuple[str, str]]:
+        """
+        Status letter and path relative to the repository root of each file changed by git diff with the given args.
+
+        Renames are reported as a deletion followed by an addition. Raises git.GitCommandError if git diff fails.
+        """
+        raise NotImplementedError
+
+    def tracked_files(self) -> List[str]:
+        """Paths of the files in the index relative to the repository root."""
+        raise NotImplementedError
+
+
+class SubprocessGitBackend(GitBackend):
+    """Runs git in a subprocess and parses its output. Supports every git diff arg git does."""
+
+    def __init__(self, dir_name: str = "."):
+        self.repo = git.Repo(dir_name)
+
+    def diff_name_status(
+        self, user_git_diff_args: List[str]
+    ) -> Iterator[Tuple[str, str]]:
+        # Use --no-renames treats renames as a deletion of the pre-rename file and addition of the post-rename file
+        # This is easier to deal with when analyzing the dependencies
+        # Use -z so paths are NUL terminated and never quoted
+        sanitized_args = sanitize_user_git_diff_args(
+            user_git_diff_args, ["--name-status", "--no-renames", "-z"]
+        )
+        git_diff_process = self.repo.git.diff(*sanitized_args, as_process=True)
+        yield from _parse_name_status(git_diff_process.stdout)
+        git_diff_process.wait()  # Raises if git diff fails
+
+    def tracked_files(self) -> List[str]:
+        return [f for f in self.repo.git.ls_files("-z", "--full-name").split("\0") if f]
+
+
+class NativeGitBackend(GitBackend):
+    """
+    Reads the object database and the index in-process without starting git.
+
+    Supports comparing two commits or trees (A B, A..B and A...B), a commit against the index (--cached) and the
+    index or a commit against the working tree, optionally filtered with --diff-filter. Raises
+    NativeGitUnsupportedException for any other args e.g. paths, and for working trees whose contents git may convert
+    before comparing them e.g. because of attributes or core.autocrlf.
+    """
+
+    def __init__(self, dir_name: str = "."):
+        # GitPython deprecates its pure Python object database because it is slower than git cat-file for reading
+        # many objects and was not written to read untrusted repositories. Only the few trees that changed are read
+        # and the repository is the one whose tests are about to run
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            self.repo = git.Repo(dir_name, odbt=git.GitDB)
+
+        # Trees written from the index that are not in the object database
+        self._index_trees: Dict[bytes, _Tree] = {}
+        self._index_file: Optional[git.IndexFile] = None
+
+    def diff_name_status(self, user_git_diff_args: List[str]) -> List[Tuple[str, str]]:
+        cached, revisions, diff_filter = _parse_native_args(user_git_diff_args)
+        changes = self._diff(user_git_diff_args, cached, revisions)
+        name_status = (
+            (_status(old, new), path) for path, (old, new) in sorted(changes.items())
+        )
+        return [
+            (status, path) for status, path in name_status if _keep(status, diff_filter)
+        ]
+
+    def tracked_files(self) -> List[str]:
+        return sorted({path for path, _ in self._index().entries})
+
+    def _diff(
+        self, user_git_diff_args: List[str], cached: bool, revisions: List[str]
+    ) -> Dict[str, _Change]:
+        if len(revisions) == 1 and "..." in revisions[0]:
+            a, b = revisions[0].split("...", 1)
+            a = self._commit(a or "HEAD", user_git_diff_args)
+            b = self._commit(b or "HEAD", user_git_diff_args)
+            return self._diff_trees(self._merge_base(a, b).tree.binsha, b.tree.binsha)
+
+        if len(revisions) == 1 and ".." in revisions[0]:
+            revisions = [r or "HEAD" for r in revisions[0].split("..", 1)]
+
+        if len(revisions) == 2 and not cached:
+            old, new = (self._tree(r, user_git_diff_args) for r in revisions)
+            return self._diff_trees(old, new)
+
+        if len(revisions) > 1:
+            raise NativeGitUnsupportedException(
+                f"Unsupported git diff args: {user_git_diff_args}"
+            )
+
+        if not revisions and not cached:
+            return self._diff_worktree()
+
+        # Compare the commit with a tree written from the index so subtrees the index did not change are skipped
+        tree = self._tree(revisions[0] if revisions else "HEAD", user_git_diff_args)
+        changes = self._diff_trees(tree, self._write_index_tree())
+
+        if cached:
+            return changes
+
+        index_entries = self._index_entries()
+
+        for path, (_, new) in self._diff_worktree().items():
+            old = changes[path][0] if path in changes else index_entries.get(path)
+            changes[path] = old, new
+
+        return {
+            path: change for path, change in changes.items() if change[0] != change[1]
+        }
+
+    def _object(self, revision: str, user_git_diff_args: List[str]):
+        try:
+            obj = self.repo.rev_parse(revision)
+
+            while obj.type == "tag":
+                obj = obj.object
+        except Exception as e:
+            # Report unknown revisions the same way as the subprocess backend
+            raise git.GitCommandError(
+                ["git", "diff", *user_git_diff_args], 128, stderr=str(e)
+            ) from e
+
+        return obj
+
+    def _commit(self, revision: str, user_git_diff_args: List[str]) -> git.Commit:
+        obj = self._object(revision, user_git_diff_args)
+
+        if obj.type != "commit":
+            raise NativeGitUnsupportedException(f"{revision} is not a commit")
+
+        return obj
+
+    def _tree(self, revision: str, user_git_diff_args: List[str]) -> bytes:
+        obj = self._object(revision, user_git_diff_args)
+
+        if obj.type == "commit":
+            obj = obj.tree
+
+        if obj.type != "tree":
+            raise NativeGitUnsupportedException(f"{revision} is not a tree")
+
+        return obj.binsha
+
+    def _merge_base(self, a: git.Commit, b: git.Commit) -> git.Commit:
+        # Walk the history of both commits newest first until every commit left is reachable from a merge base, like
+        # git merge-base does without a commit graph
+        if a == b:
+            return a
+
+        flags = {a.binsha: _PARENT1, b.binsha: _PARENT2}
+        queue = [(-a.committed_date, 0, a), (-b.committed_date, 1, b)]
+        heapq.heapify(queue)
+        counter = len(queue)
+        results = []
+
+        while any(not flags[c.binsha] & _STALE for _, _, c in queue):
+            _, _, commit = heapq.heappop(queue)
+            commit_flags = flags[commit.binsha]
+
+            if commit_flags == _PARENT1 | _PARENT2:
+                results.append(commit)
+                commit_flags |= _STALE
+                flags[commit.binsha] = commit_flags
+
+            for parent in commit.parents:
+                parent_flags = flags.get(parent.binsha, 0)
+
+                if parent_flags & commit_flags == commit_flags:
+                    continue
+
+                flags[parent.binsha] = parent_flags | commit_flags
+                heapq.heappush(queue, (-parent.committed_date, counter, parent))
+                counter += 1
+
+        # Commits with the same date may be found before a later merge base they are an ancestor of
+        results = [
+            r
+            for r in results
+            if not any(_is_ancestor(r, other) for other in results if other != r)
+        ]
+
+        if len(results) != 1:
+            # git picks one of many merge bases or fails without any
+            raise NativeGitUnsupportedException(f"Found {len(results)} merge bases")
+
+        return results[0]
+
+    def _read_tree(self, binsha: Optional[bytes]) -> _Tree:
+        if binsha is None:
+            return {}
+        if binsha in self._index_trees:
+            return self._index_trees[binsha]
+        return _parse_tree(self.repo.odb.stream(binsha).read())
+
+    def _diff_trees(
+        self, old: Optional[bytes], new: Optional[bytes], prefix: bytes = b""
+    ) -> Dict[str, _Change]:
+        # Subtrees with the same SHA on both sides are skipped without being read
+        old_entries = self._read_tree(old)
+        new_entries = self._read_tree(new)
+        changes = {}
+
+        for name in {name for name, _ in old_entries.items() ^ new_entries.items()}:
+            old_entry = old_entries.get(name)
+            new_entry = new_entries.get(name)
+            old_is_tree = old_entry is not None and old_entry[0] == _TREE_MODE
+            new_is_tree = new_entry is not None and new_entry[0] == _TREE_MODE
+
+            if old_is_tree or new_is_tree:
+                changes.update(
+                    self._diff_trees(
+                        old_entry[1] if old_is_tree else None,
+                        new_entry[1] if new_is_tree else None,
+                        prefix + name + b"/",
+                    )
+                )
+                old_entry = None if old_is_tree else old_entry
+                new_entry = None if new_is_tree else new_entry
+
+            if old_entry is not None or new_entry is not None:
+                changes[os.fsdecode(prefix + name)] = (
+                    _to_entry(old_entry),
+                    _to_entry(new_entry),
+                )
+
+        return changes
+
+    def _write_index_tree(self) -> bytes:
+        # Same tree as git write-tree without writing it to the object database
+        root: dict = {}
+
+        for path, (mode, sha) in self._index_entries().items():
+            *dirs, name = os.fsencode(path).split(b"/")
+            directory = root
+
+            for d in dirs:
+                directory = directory.setdefault(d, {})
+
+            directory[name] = b"%o" % mode, sha
+
+        return self._hash_tree(root)
+
+    def _hash_tree(self, directory: dict) -> bytes:
+        tree = {
+            name: (
+                (_TREE_MODE, self._hash_tree(value))
+                if isinstance(value, dict)
+                else value
+            )
+            for name, value in directory.items()
+        }
+        # Subtrees sort as if their names ended with a slash
+        names = sorted(
+            tree, key=lambda name: name + b"/" if tree[name][0] == _TREE_MODE else name
+        )
+        data = b"".join(
+            b"%s %s\0%s" % (tree[name][0], name, tree[name][1]) for name in names
+        )
+        binsha = hashlib.sha1(b"tree %d\0" % len(data) + data).digest()
+        self._index_trees[binsha] = tree
+        return binsha
+
+    def _index(self) -> git.IndexFile:
+        # The entries of an index file are read once
+        if self._index_file is None:
+            self._index_file = self.repo.index
+        return self._index_file
+
+    def _index_entries(self) -> Dict[str, _Entry]:
+        entries = {}
+
+        for (path, stage), entry in self._index().entries.items():
+            if stage != 0 or entry.intent_to_add:
+                raise NativeGitUnsupportedException(
+                    "Unmerged or intent to add index entries"
+                )
+
+            entries[path] = entry.mode, entry.binsha
+
+        return entries
+
+    def _diff_worktree(self) -> Dict[str, _Change]:
+        self._check_worktree_supported()
+        root = self.repo.working_tree_dir
+        index_mtime = int(os.stat(self._index().path).st_mtime)
+        changes = {}
+
+        for (path, stage), entry in self._index().entries.items():
+            if stage != 0 or entry.intent_to_add or entry.mode == _GITLINK_MODE:
+                raise NativeGitUnsupportedException(
+                    "Unmerged, intent to add or submodule index entries"
+                )
+
+            if entry.skip_worktree:
+                continue
+
+            index_entry = entry.mode, entry.binsha
+
+            if (
+                worktree_entry := _worktree_entry(root, entry, index_mtime)
+            ) != index_entry:
+                changes[path] = index_entry, worktree_entry
+
+        return changes
+
+    def _check_worktree_supported(self) -> None:
+        # The contents of files in the working tree are hashed as is so anything that makes git convert them first
+        # or compare them differently is left to git
+        config = self.repo.config_reader()
+
+        for option, unsupported in (
+            ("autocrlf", lambda v: str(v).lower() not in ("false", "0", "no", "off")),
+            ("filemode", lambda v: str(v).lower() in ("false", "0", "no", "off")),
+            ("symlinks", lambda v: str(v).lower() in ("false", "0", "no", "off")),
+            ("splitindex", lambda v: str(v).lower() in ("true", "1", "yes", "on")),
+            ("attributesfile", lambda v: True),
+        ):
+            if config.has_option("core", option) and unsupported(
+                config.get_value("core", option)
+            ):
+                raise NativeGitUnsupportedException(f"core.{option} is set")
+
+        xdg_config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser(
+            "~/.config"
+        )
+        attributes_files = [
+            os.path.join(self.repo.git_dir, "info", "attributes"),
+            os.path.join(xdg_config_home, "git", "attributes"),
+        ]
+
+        if any(os.path.exists(f) for f in attributes_files) or any(
+            os.path.basename(path) == ".gitattributes"
+            for path, _ in self._index().entries
+        ):
+            raise NativeGitUnsupportedException(
+                "Attributes files may convert the working tree"
+            )
+
+
+def create_git_backend(name: str, dir_name: str = ".") -> GitBackend:
+    if name == "native":
+        return NativeGitBackend(dir_name)
+    if name == "subprocess":
+        return SubprocessGitBackend(dir_name)
+    if name == "auto":
+        return AutoGitBackend(dir_name)
+    raise UnsupportedArgumentException(f"Unknown git backend: {name}")
+
+
+class AutoGitBackend(GitBackend):
+    """
+    Runs git and only falls back to the native backend when git cannot be started, e.g. in containers without git.
+
+    Comparing two commits of a repository with 5000 modules takes about 3ms by starting git diff and about 5ms with
+    the native backend, which reads objects through GitPython's pure Python object database, so git is preferred
+    whenever it is installed.
+    """
+
+    def __init__(self, dir_name: str = "."):
+        self.dir_name = dir_name
+
+    def diff_name_status(
+        self, user_git_diff_args: List[str]
+    ) -> Iterator[Tuple[str, str]]:
+        try:
+            yield from SubprocessGitBackend(self.dir_name).diff_name_status(
+                user_git_diff_args
+            )
+        except git.GitCommandNotFound:
+            # Raised when starting git, before any change is yielded
+            yield from NativeGitBackend(self.dir_name).diff_name_status(
+                user_git_diff_args
+            )
+
+    def tracked_files(self) -> List[str]:
+        try:
+            return SubprocessGitBackend(self.dir_name).tracked_files()
+        except git.GitCommandNotFound:
+            return NativeGitBackend(self.dir_name).tracked_files()
+
+
+def sanitize_user_git_diff_args(
+    user_git_diff_args: List[str], extra_git_diff_args: List[str]
+) -> List[str]:
+    # The --name-status flag seems to supersede any other flags that format the output so no need to validate
+    # thoroughly
+
+    # Just need to check:
+    # a) only one diff-filter arg is passed in (using the value given in extra_git_diff_args if duplicates are found)
+    #       since this can interfere with diff-filter args supplied by us
+    # b) the --output flag isn't supplied
+    # c) no other name output format flags are supplied since git rejects them alongside --name-status
+    sanitized_args = []
+    extra_args_contains_diff_filter = any(
+        x.startswith("--diff-filter") for x in extra_git_diff_args
+    )
+    i = 0
+
+    while i < len(user_git_diff_args):
+        v = user_git_diff_args[i]
+
+        if v == "--output":
+            raise UnsupportedArgumentException(
+                "--output argument to git diff is not supported"
+            )
+
+        if v in ("--name-only", "--name-status"):
+            i += 1
+            continue
+
+        if v.startswith("--diff-filter"):
+            if v.startswith("--diff-filter="):
+                _, filter_values = v.split("=", 1)
+            else:
+                filter_values = user_git_diff_args[i + 1]
+                i += 1  # Eat up an extra argument since the filter param is separated from flag by a space
+
+            if "R" in filter_values:
+                raise UnsupportedArgumentException("R diff filter is not supported")
+
+            if extra_args_contains_diff_filter:
+                i += 1
+                continue
+
+        sanitized_args.append(v)
+        i += 1
+
+    return sanitized_args + extra_git_diff_args
+
+
+def _parse_native_args(
+    user_git_diff_args: List[str],
+) -> Tuple[bool, List[str], Optional[str]]:
+    cached = False
+    revisions = []
+    diff_filter = None
+    args = iter(user_git_diff_args)
+
+    for arg in args:
+        if arg == "--output":
+            raise UnsupportedArgumentException(
+                "--output argument to git diff is not supported"
+            )
+        elif arg in ("--cached", "--staged"):
+            cached = True
+        elif arg in ("--name-only", "--name-status", "--no-renames", "-z"):
+            continue
+        elif arg.startswith("--diff-filter"):
+            diff_filter = arg.split("=", 1)[1] if "=" in arg else next(args, "")
+
+            if "R" in diff_filter:
+                raise UnsupportedArgumentException("R diff filter is not supported")
+        elif arg == "--":
+            if next(args, None) is not None:
+                raise NativeGitUnsupportedException("Paths are not supported")
+        elif arg.startswith("-"):
+            raise NativeGitUnsupportedException(f"Unsupported git diff arg: {arg}")
+        else:
+            revisions.append(arg)
+
+    return cached, revisions, diff_filter
+
+
+def _keep(status: str, diff_filter: Optional[str]) -> bool:
+    # Upper case letters select statuses and lower case letters exclude them
+    if not diff_filter:
+        return True
+
+    included = {c for c in diff_filter if c.isupper()}
+    excluded = {c.upper() for c in diff_filter if c.islower()}
+    return (not included or status in included) and status not in excluded
+
+
+def _status(old: Optional[_Entry], new: Optional[_Entry]) -> str:
+    if old is None:
+        return "A"
+    if new is None:
+        return "D"
+    if stat.S_IFMT(old[0]) != stat.S_IFMT(new[0]):
+        return "T"
+    return "M"
+
+
+def _parse_tree(data: bytes) -> _Tree:
+    return {name: (mode, sha) for mode, name, sha in _TREE_ENTRY.findall(data)}
+
+
+def _to_entry(tree_entry: Optional[Tuple[bytes, bytes]]) -> Optional[_Entry]:
+    return None if tree_entry is None else (int(tree_entry[0], 8), tree_entry[1])
+
+
+def _is_ancestor(ancestor: git.Commit, commit: git.Commit) -> bool:
+    seen = {commit.binsha}
+    stack = [commit]
+
+    while stack:
+        for parent in stack.pop().parents:
+            if parent == ancestor:
+                return True
+
+            if parent.binsha not in seen:
+                seen.add(parent.binsha)
+                stack.append(parent)
+
+    return False
+
+
+def _worktree_entry(root: str, entry, index_mtime: int) -> Optional[_Entry]:
+    filename = os.path.join(root, entry.path)
+
+    try:
+        st = os.lstat(filename)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    if stat.S_ISLNK(st.st_mode):
+        mode = _SYMLINK_MODE
+    elif stat.S_ISREG(st.st_mode):
+        mode = _EXECUTABLE_MODE if st.st_mode & stat.S_IXUSR else _REGULAR_MODE
+    else:
+        # e.g. a file replaced by a directory
+        return None
+
+    # Trust the SHA in the index if the file has not been modified since it was added like git does. Files modified in
+    # the same second the index was written may have changed without their size or modification time changing
+    mtime = entry.mtime[0]
+
+    if (
+        mode == entry.mode
+        and st.st_size == entry.size
+        and int(st.st_mtime) == mtime
+        and mtime < index_mtime
+    ):
+        return mode, entry.binsha
+
+    if mode == _SYMLINK_MODE:
+        data = os.readlink(os.fsencode(filename))
+    else:
+        with open(filename, "rb") as f:
+            data = f.read()
+
+    return mode, hashlib.sha1(b"blob %d\0" % len(data) + data).digest()
+
+
+def _parse_name_status(stream: IO[bytes]) -> Iterator[Tuple[str, str]]:
+    # Output of git diff --name-status -z is a sequence of NUL terminated fields: the status letter followed by the
+    # path. Copies and renames are followed by both the source and destination path
+    fields = _iter_nul_terminated(stream)
+
+    for status in fields:
+        path = next(fields)
+
+        if status[0] in ("C", "R"):
+            path = next(fields)
+
+        yield status[0], path
+
+
+def _iter_nul_terminated(stream: IO[bytes], chunk_size: int = 65536) -> Iterator[str]:
+    remainder = b""
+
+    while chunk := stream.read(chunk_size):
+        *fields, remainder = (remainder + chunk).split(b"\0")
+
+        for field in fields:
+            yield os.fsdecode(field)
@@ -0,0 +1,125 @@
+import os
+import subprocess
+
+from typing import Dict, Iterable, List, MutableSet
+
+import git
+
+from pytest_git_selector.util import canonical_path
+
+# Modes of the tree entries read as files. Symbolic links and submodules are left out
+_FILE_MODES = (b"100644", b"100755")
+
+
+class GitTree:
+    """
+    Files of the tree of a commit read from the object database so no working tree is needed.
+
+    The tree is listed once with git ls-tree and the contents of many files are read with a single git cat-file --batch
+    process so reading files costs one process per call of read_blobs rather than one per file. Paths are absolute
+    paths under the repository directory as if the commit was checked out there, so they match the paths of git diff.
+    """
+
+    def __init__(self, revision: str, dir_name: str = "."):
+        self.repo = git.Repo(dir_name)
+        self.root = canonical_path(dir_name)
+        self.commit = self.repo.git.rev_parse("--verify", f"{revision}^{{commit}}")
+        self.blob_shas: Dict[str, str] = {}
+        self.dirs: MutableSet[str] = {self.root}
+
+        listing = self.repo.git.ls_tree(
+            "-r", "-z", "--full-tree", self.commit, stdout_as_string=False
+        )
+
+        for entry in listing.split(b"\0"):
+            if not entry:
+                continue
+
+            info, path = entry.split(b"\t", 1)
+            mode, _, sha = info.split(b" ")
+
+            if mode not in _FILE_MODES:
+                continue
+
+            filename = os.path.join(self.root, *os.fsdecode(path).split("/"))
+            self.blob_shas[filename] = sha.decode()
+            self._add_dirs(os.path.dirname(filename))
+
+    def isfile(self, path: str) -> bool:
+        return path in self.blob_shas
+
+    def isdir(self, path: str) -> bool:
+        return path in self.dirs
+
+    def exists(self, path: str) -> bool:
+        # Paths outside the repository e.g. installed packages are looked up on disk
+        if path != self.root and not path.startswith(self.root + os.sep):
+            return os.path.exists(path)
+        return self.isfile(path) or self.isdir(path)
+
+    def blob_sha(self, path: str) -> str:
+        return self.blob_shas[path]
+
+    def read_blobs(self, paths: Iterable[str]) -> Dict[str, bytes]:
+        """Contents of the files in the tree among paths by path. Paths not in the tree are left out."""
+        paths_by_sha: Dict[str, List[str]] = {}
+
+        for path in paths:
+            if path in self.blob_shas:
+                paths_by_sha.setdefault(self.blob_shas[path], []).append(path)
+
+        if not paths_by_sha:
+            return {}
+
+        process = self.repo.git.cat_file(
+            "--batch", as_process=True, istream=subprocess.PIPE
+        )
+        stdout, _ = process.communicate(
+            "".join(sha + "\n" for sha in paths_by_sha).encode()
+        )
+        process.wait()  # Raises if git cat-file fails
+
+        contents = {}
+        offset = 0
+
+        while offset < len(stdout):
+            end = stdout.index(b"\n", offset)
+            header = stdout[offset:end].split(b" ")
+            offset = end + 1
+
+            # Blobs missing from e.g. a partial clone are reported as "<sha> missing"
+            if len(header) != 3:
+                continue
+
+            size = int(header[2])
+            blob = stdout[offset : offset + size]
+            offset += size + 1
+
+            for path in paths_by_sha.get(header[0].decode(), []):
+                contents[path] = blob
+
+        return contents
+
+    def expand_source_files(self, paths: Iterable[str]) -> List[str]:
+        # Same as importlab.utils.expand_source_files with the files of the tree
+        files = set()
+
+        for path in paths:
+            path = canonical_path(path)
+
+            if self.isdir(path):
+                prefix = path.rstrip(os.sep) + os.sep
+                files.update(
+                    f
+                    for f in self.blob_shas
+                    if f.startswith(prefix) and f.endswith(".py")
+                )
+            elif path.endswith(".py") and self.isfile(path):
+                files.add(path)
+
+        return sorted(files)
+
+    def _add_dirs(self, dir_name: str) -> None:
+        while dir_name not in self.dirs:
+            self.dirs.add(dir_name)
+            dir_name = os.path.dirname(dir_name)
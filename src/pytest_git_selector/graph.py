@@ -0,0 +1,432 @@
+import concurrent.futures
+import contextlib
+import os
+
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Container,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import importlab.environment
+import importlab.graph
+import importlab.parsepy
+import importlab.resolve
+
+from pytest_git_selector.cache import GraphCache, ResolvedImport, content_blob_sha
+from pytest_git_selector.compact_graph import CompactGraph, CompactGraphBuilder
+from pytest_git_selector.fs import (
+    MissingFilesRecorder,
+    clear_resolve_import_cache,
+    get_imports,
+    import_statements,
+    is_deleted_file,
+)
+from pytest_git_selector.parse_cache import ParseCache, ParsedImport
+from pytest_git_selector.profiling import SelectionProfile, profile_phase
+
+if TYPE_CHECKING:
+    from pytest_git_selector.git_tree import GitTree
+
+# Resolved imports, unresolved imports and the paths looked up while resolving them that did not exist of a file or None
+# if the file could not be parsed
+FileDeps = Optional[Tuple[List[ResolvedImport], list, List[str]]]
+
+_PROVENANCE_KINDS = {
+    importlab.resolve.Direct: "direct",
+    importlab.resolve.Builtin: "builtin",
+    importlab.resolve.System: "system",
+    importlab.resolve.Local: "local",
+}
+
+# Environment used by worker processes when resolving imports in parallel
+_worker_env = None
+
+
+def encode_resolved_file(
+    resolved_file: importlab.resolve.ResolvedFile,
+) -> ResolvedImport:
+    kind = _PROVENANCE_KINDS.get(type(resolved_file), "local")
+    return kind, resolved_file.path, resolved_file.module_name
+
+
+def decode_resolved_file(
+    resolved_import: ResolvedImport,
+) -> importlab.resolve.ResolvedFile:
+    kind, path, module_name = resolved_import
+
+    if kind == "direct":
+        return importlab.resolve.Direct(path, module_name)
+    if kind == "builtin":
+        return importlab.resolve.Builtin(path, module_name)
+    if kind == "system":
+        return importlab.resolve.System(path, module_name)
+
+    # The file system a local import was found in is not needed once the import has been resolved
+    return importlab.resolve.Local(path, module_name, None)
+
+
+def resolve_file_imports(
+    env: importlab.environment.Environment,
+    filename: str,
+    parent: importlab.resolve.ResolvedFile,
+    source: Optional[bytes] = None,
+    imports: Optional[List[importlab.parsepy.ImportStatement]] = None,
+) -> FileDeps:
+    # Same as importlab.graph.ImportGraph.get_file_deps without mutating the graph so it can run in a worker process
+    resolved = []
+    unresolved = []
+    missing_files = set()
+    resolver = importlab.resolve.Resolver(
+        [MissingFilesRecorder(fs, missing_files) for fs in env.path], parent
+    )
+
+    if is_deleted_file(env, filename):
+        return resolved, unresolved, []
+
+    if imports is None:
+        try:
+            imports = get_imports(filename, env.python_version, source)
+        except importlab.parsepy.ParseError:
+            return None
+
+    for imp in imports:
+        try:
+            f = resolver.resolve_import(imp)
+        except importlab.resolve.ImportException:
+            unresolved.append(imp)
+            continue
+
+        if isinstance(f, importlab.resolve.Builtin):
+            continue
+
+        f.path = os.path.abspath(f.path)
+        resolved.append(encode_resolved_file(f))
+
+    return resolved, unresolved, sorted(missing_files)
+
+
+def _init_worker(env: importlab.environment.Environment) -> None:
+    global _worker_env
+    _worker_env = env
+
+
+def parse_and_resolve_file_imports(
+    env: importlab.environment.Environment,
+    filename: str,
+    parent: importlab.resolve.ResolvedFile,
+    source: Optional[bytes] = None,
+    parsed: Optional[List[ParsedImport]] = None,
+) -> Tuple[Optional[List[ParsedImport]], FileDeps]:
+    # Same as resolve_file_imports starting from the import statements of a parse cache if given. Also returns the
+    # statements if the file was parsed so they can be added to the parse cache
+    if parsed is not None:
+        imports = import_statements(parsed)
+        return None, resolve_file_imports(env, filename, parent, imports=imports)
+
+    if is_deleted_file(env, filename):
+        return None, ([], [], [])
+
+    try:
+        imports = get_imports(filename, env.python_version, source)
+    except importlab.parsepy.ParseError:
+        return None, None
+
+    parsed = [tuple(imp[:4]) for imp in imports]
+    return parsed, resolve_file_imports(env, filename, parent, imports=imports)
+
+
+def _resolve_file_imports_in_worker(
+    args: Tuple[str, ResolvedImport, Optional[bytes], Optional[List[ParsedImport]]],
+) -> Tuple[Optional[List[ParsedImport]], FileDeps]:
+    filename, parent, source, parsed = args
+    return parse_and_resolve_file_imports(
+        _worker_env, filename, decode_resolved_file(parent), source, parsed
+    )
+
+
+class SelectorImportGraph(importlab.graph.ImportGraph):
+    """
+    Import graph built one level of the dependency tree at a time.
+
+    All files in a level are resolved together so they can be looked up in the cache and resolved across a pool of
+    worker processes. The files and imports are the same as the ones found by importlab.graph.ImportGraph but are
+    stored in compact_graph rather than a networkx graph and cycles are not collapsed.
+
+    Files are read from tree instead of the working tree when it is given. The files of a level that are not cached are
+    read from git at once. Files missing from the cache are looked up by content in parse_cache if given so only their
+    imports are resolved again.
+    """
+
+    def __init__(
+        self,
+        env,
+        cache: Optional[GraphCache] = None,
+        workers: int = 1,
+        profile: Optional[SelectionProfile] = None,
+        tree: Optional["GitTree"] = None,
+        parse_cache: Optional[ParseCache] = None,
+    ):
+        super().__init__(env)
+        self.cache = cache
+        self.tree = tree
+        self.parse_cache = parse_cache
+        self.workers = workers or os.cpu_count() or 1
+        self.profile = profile
+        self.builder = CompactGraphBuilder()
+        self.compact_graph: Optional[CompactGraph] = None
+        # Paths looked up while resolving the imports of each file that did not exist
+        self.missing_files: Dict[str, List[str]] = {}
+        # Files resolved elsewhere, e.g. in a graph artifact, that are added as nodes without being followed
+        self.known_files: Container[str] = frozenset()
+
+    @classmethod
+    def create(
+        cls,
+        env,
+        filenames: List[str],
+        trim: bool = False,
+        cache: Optional[GraphCache] = None,
+        workers: int = 1,
+        profile: Optional[SelectionProfile] = None,
+        extra_deps: Optional[List[Tuple[str, str]]] = None,
+        tree: Optional["GitTree"] = None,
+        parse_cache: Optional[ParseCache] = None,
+    ) -> "SelectorImportGraph":
+        import_graph = cls(
+            env,
+            cache=cache,
+            workers=workers,
+            profile=profile,
+            tree=tree,
+            parse_cache=parse_cache,
+        )
+        import_graph.add_files_recursive([os.path.abspath(f) for f in filenames], trim)
+
+        for u, v in extra_deps or []:
+            import_graph.builder.add_edge(u, v)
+
+        import_graph.build()
+        return import_graph
+
+    def build(self) -> None:
+        assert not self.final, "Trying to mutate a final graph."
+        self.compact_graph = self.builder.build()
+        self.builder = None
+        self.final = True
+
+    def follow_file(self, f: str, seen: set, trim: bool) -> bool:
+        return (
+            f not in self.builder
+            and f not in seen
+            and f not in self.known_files
+            and (
+                not trim
+                or not isinstance(
+                    self.provenance[f],
+                    (importlab.resolve.Builtin, importlab.resolve.System),
+                )
+            )
+        )
+
+    def add_file_recursive(self, filename: str, trim: bool = False) -> None:
+        self.add_files_recursive([filename], trim)
+
+    def add_files_recursive(self, filenames: List[str], trim: bool = False) -> None:
+        assert not self.final, "Trying to mutate a final graph."
+        clear_resolve_import_cache()
+
+        queue = []
+        seen = set()
+
+        for filename in filenames:
+            # Files resolved before keep the provenance they were reached through
+            if filename not in self.provenance:
+                self.add_source_file(filename)
+
+            if filename not in seen:
+                queue.append(filename)
+                seen.add(filename)
+
+        with self._resolver() as resolve_files:
+            while queue:
+                next_queue = []
+
+                with profile_phase(self.profile, "import_parsing"):
+                    queue_deps = resolve_files(queue)
+
+                for filename, file_deps in zip(queue, queue_deps):
+                    self.builder.add_node(filename)
+
+                    if file_deps is None:
+                        # Same handling of files that cannot be parsed as importlab
+                        if os.path.splitext(filename)[1] in (".py", ".so"):
+                            self.unreadable_files.add(filename)
+                        else:
+                            self.builder.remove_node(filename)
+                        continue
+
+                    deps, broken, missing_files = file_deps
+
+                    if missing_files:
+                        self.missing_files[filename] = missing_files
+
+                    for imp in broken:
+                        self.broken_deps[filename].add(imp)
+
+                    for dep in deps:
+                        f = dep[1]
+                        self.provenance[f] = decode_resolved_file(dep)
+
+                        if self.follow_file(f, seen, trim):
+                            next_queue.append(f)
+                            seen.add(f)
+
+                        self.builder.add_node(f)
+
+                        if filename != f:
+                            self.builder.add_edge(filename, f)
+
+                queue = next_queue
+
+    def get_file_deps(self, filename: str) -> Tuple[List[str], list]:
+        with self._resolver() as resolve_files:
+            (file_deps,) = resolve_files([filename])
+
+        if file_deps is None:
+            raise importlab.parsepy.ParseError(filename)
+
+        deps, broken, _ = file_deps
+
+        for dep in deps:
+            self.provenance[dep[1]] = decode_resolved_file(dep)
+
+        return [dep[1] for dep in deps], broken
+
+    def read_sources(self, filenames: Iterable[str]) -> Dict[str, bytes]:
+        # Contents of the files read from the tree. Files in the working tree are read when they are parsed
+        if self.tree is None:
+            return {}
+        return self.tree.read_blobs(filenames)
+
+    def _parse_cache_shas(
+        self, filenames: List[str], sources: Dict[str, bytes]
+    ) -> Dict[str, str]:
+        # Blob SHA of each file to look up in the parse cache. Files in the working tree are read into sources so they
+        # are parsed from the contents that were hashed and only read once
+        shas = {}
+
+        for filename in filenames:
+            if is_deleted_file(self.env, filename):
+                continue
+
+            if self.tree is not None:
+                if filename in sources:
+                    shas[filename] = self.tree.blob_sha(filename)
+                continue
+
+            try:
+                with open(filename, "rb") as f:
+                    sources[filename] = f.read()
+            except OSError:
+                continue
+
+            shas[filename] = content_blob_sha(sources[filename])
+
+        return shas
+
+    def _blob_sha(self, filename: str) -> str:
+        if self.tree is not None:
+            return self.tree.blob_sha(filename)
+        return self.cache.blob_sha(filename)
+
+    @contextlib.contextmanager
+    def _resolver(self) -> Iterator[Callable[[List[str]], List[FileDeps]]]:
+        if self.workers <= 1:
+            yield self._resolve_files
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(self.env,)
+        ) as executor:
+            yield lambda filenames: self._resolve_files(filenames, executor)
+
+    def _resolve_files(
+        self,
+        filenames: List[str],
+        executor: Optional[concurrent.futures.Executor] = None,
+    ) -> List[FileDeps]:
+        results = [None] * len(filenames)
+        shas = [None] * len(filenames)
+        misses = []
+
+        for i, filename in enumerate(filenames):
+            if self.cache is not None:
+                try:
+                    shas[i] = self._blob_sha(filename)
+                except (OSError, KeyError):
+                    pass
+                else:
+                    if (deps := self.cache.get(filename, shas[i])) is not None:
+                        results[i] = deps, [], self.cache.missing(filename)
+                        continue
+
+            misses.append(i)
+
+        sources = self.read_sources(filenames[i] for i in misses)
+
+        if self.parse_cache is not None:
+            parse_shas = self._parse_cache_shas([filenames[i] for i in misses], sources)
+            parsed = self.parse_cache.get(parse_shas.values())
+        else:
+            parse_shas = parsed = {}
+
+        args = [
+            (
+                filenames[i],
+                encode_resolved_file(self.provenance[filenames[i]]),
+                sources.get(filenames[i]),
+                parsed.get(parse_shas.get(filenames[i])),
+            )
+            for i in misses
+        ]
+
+        # Not worth the overhead of sending work to other processes for a handful of files
+        if executor is not None and len(misses) > self.workers:
+            chunksize = max(1, len(misses) // (self.workers * 4))
+            resolved = executor.map(
+                _resolve_file_imports_in_worker, args, chunksize=chunksize
+            )
+        else:
+            resolved = (
+                parse_and_resolve_file_imports(
+                    self.env, filename, decode_resolved_file(parent), source, imports
+                )
+                for filename, parent, source, imports in args
+            )
+
+        for i, (new_parsed, file_deps) in zip(misses, resolved):
+            results[i] = file_deps
+
+            if new_parsed is not None and filenames[i] in parse_shas:
+                self.parse_cache.put(parse_shas[filenames[i]], new_parsed)
+
+            if self.cache is not None and shas[i] is not None and file_deps:
+                deps, broken, missing_files = file_deps
+
+                if not broken:
+                    self.cache.put(filenames[i], shas[i], deps, missing_files)
+
+        if self.profile is not None:
+            parse_cached = sum(1 for arg in args if arg[3] is not None)
+            self.profile.count("parsed_files", len(misses) - parse_cached)
+            self.profile.count("parse_cached_files", parse_cached)
+            self.profile.count("cached_files", len(filenames) - len(misses))
+
+        return results
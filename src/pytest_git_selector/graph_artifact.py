@@ -0,0 +1,336 @@
+import array
+import json
+import mmap
+import os
+import sys
+import tempfile
+import zlib
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pytest_git_selector.cache import ResolvedImport
+from pytest_git_selector.compact_graph import (
+    NODE_TYPECODE,
+    OFFSET_TYPECODE,
+    CompactGraph,
+)
+from pytest_git_selector.errors import InvalidGraphArtifactException
+
+MAGIC = b"PGSGRAPH"
+ARTIFACT_FORMAT_VERSION = 2
+
+# Sections holding the CSR arrays of the graph and the type code of each
+_ARRAYS = (
+    ("pred_offsets", OFFSET_TYPECODE),
+    ("preds", NODE_TYPECODE),
+    ("succ_offsets", OFFSET_TYPECODE),
+    ("succs", NODE_TYPECODE),
+)
+# Arrays start at multiples of the largest item size so they can be read in place
+_ALIGNMENT = 8
+_HEADER_LENGTH_SIZE = 4
+
+
+class GraphArtifact:
+    """
+    Import graph of a repository at a commit written to a single file so it can be shared between machines, e.g. as a
+    CI build artifact, and brought up to date by resolving only the files that changed since the commit.
+
+    The file starts with MAGIC and a JSON header holding the format version, the commit, what the graph was built from
+    and where each section starts. The paths of the nodes along with the provenance of their imports follow, zlib
+    compressed, and then the paths each file looked up while resolving its imports that did not exist, which are only
+    decoded when files changed since the commit. Paths under the repository root are stored relative to it so the
+    artifact can be used from any checkout. The CSR arrays of the graph are stored last, uncompressed in native byte
+    order, so load memory maps the file and reads them in place instead of parsing them.
+    """
+
+    def __init__(
+        self,
+        graph: CompactGraph,
+        commit: Optional[str],
+        python_version: Tuple[int, int],
+        python_path: List[str],
+        test_paths: List[str],
+        extra_deps: List[Tuple[str, str]],
+        provenance: Dict[str, ResolvedImport],
+        dirty_files: Iterable[str] = (),
+        unresolved_files: Iterable[str] = (),
+        missing_files: Optional[Dict[str, List[str]]] = None,
+    ):
+        self.graph = graph
+        # None for graphs kept in memory and brought up to date without git, e.g. by the daemon
+        self.commit = commit
+        self.python_version = tuple(python_version)
+        self.python_path = python_path
+        self.test_paths = test_paths
+        self.extra_deps = extra_deps
+        # Resolved import each file was last reached through. Files only found in extra_deps have none
+        self.provenance = provenance
+        # Files whose contents did not match the commit when the graph was built
+        self.dirty_files = set(dirty_files)
+        # Files with imports that did not resolve when the graph was built and may resolve to files added since
+        self.unresolved_files = set(unresolved_files)
+        self._missing_files = missing_files if missing_files is not None else {}
+        # Compressed missing files of a loaded artifact and the root to resolve them against
+        self._encoded_missing_files: Optional[Tuple[memoryview, str]] = None
+
+    @property
+    def missing_files(self) -> Dict[str, List[str]]:
+        # Paths looked up while resolving the imports of each file that did not exist when the graph was built
+        if self._encoded_missing_files is not None:
+            encoded, root = self._encoded_missing_files
+            self._encoded_missing_files = None
+
+            try:
+                missing_files = json.loads(zlib.decompress(encoded))
+                self._missing_files = {
+                    path: [_absolute_path(f, root) for f in files]
+                    for path, files in zip(self.graph.paths, missing_files)
+                    if files
+                }
+            except (TypeError, ValueError, zlib.error) as e:
+                raise InvalidGraphArtifactException(
+                    f"graph artifact has a corrupt missing files section: {e!r}"
+                ) from None
+
+        return self._missing_files
+
+    def files_looking_up(self, paths: Iterable[str]) -> Set[str]:
+        """Files whose imports may resolve differently once any of paths exists."""
+        looked_up = set(paths)
+        return {
+            path
+            for path, missing_files in self.missing_files.items()
+            if not looked_up.isdisjoint(missing_files)
+        }
+
+    def save(self, filename: str, root: str) -> None:
+        graph = self.graph
+        paths = [_relative_path(path, root) for path in graph.paths]
+        provenance = [self.provenance.get(path) for path in graph.paths]
+        table = zlib.compress(
+            json.dumps(
+                {
+                    "paths": paths,
+                    "kinds": [p[0] if p is not None else None for p in provenance],
+                    "modules": [p[2] if p is not None else None for p in provenance],
+                }
+            ).encode()
+        )
+        missing_files = zlib.compress(
+            json.dumps(
+                [
+                    [_relative_path(f, root) for f in self.missing_files.get(path, [])]
+                    for path in graph.paths
+                ]
+            ).encode()
+        )
+        arrays = [getattr(graph, name) for name, _ in _ARRAYS]
+
+        header = {
+            "version": ARTIFACT_FORMAT_VERSION,
+            "commit": self.commit,
+            "python_version": list(self.python_version),
+            "python_path": [_relative_path(p, root) for p in self.python_path],
+            "test_paths": [_relative_path(p, root) for p in self.test_paths],
+            "extra_deps": [
+                [_relative_path(u, root), _relative_path(v, root)]
+                for u, v in self.extra_deps
+            ],
+            "dirty_files": sorted(_relative_path(f, root) for f in self.dirty_files),
+            "unresolved_files": sorted(
+                _relative_path(f, root) for f in self.unresolved_files
+            ),
+            "byteorder": sys.byteorder,
+            "itemsizes": {name: a.itemsize for (name, _), a in zip(_ARRAYS, arrays)},
+            "nodes": graph.number_of_nodes(),
+        }
+
+        # Offsets of the sections are relative to the end of the header so they do not depend on its length
+        sections = {
+            "table": [0, len(table)],
+            "missing_files": [len(table), len(missing_files)],
+        }
+        offset = len(table) + len(missing_files)
+
+        for (name, _), a in zip(_ARRAYS, arrays):
+            offset = _align(offset)
+            sections[name] = [offset, len(a) * a.itemsize]
+            offset += len(a) * a.itemsize
+
+        header["sections"] = sections
+        encoded_header = json.dumps(header).encode()
+        start = _align(len(MAGIC) + _HEADER_LENGTH_SIZE + len(encoded_header))
+
+        dir_name = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(dir_name, exist_ok=True)
+
+        # Write to a temporary file then rename so readers never map a partially written artifact
+        fd, temp_filename = tempfile.mkstemp(dir=dir_name, prefix=".graph-artifact-")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC)
+                f.write(len(encoded_header).to_bytes(_HEADER_LENGTH_SIZE, "little"))
+                f.write(encoded_header)
+                f.write(b"\0" * (start - f.tell()))
+                f.write(table)
+                f.write(missing_files)
+
+                for (name, _), a in zip(_ARRAYS, arrays):
+                    f.write(b"\0" * (start + sections[name][0] - f.tell()))
+                    # memoryview rather than tobytes so arrays mapped from another artifact are not copied first
+                    f.write(memoryview(a).cast("B"))
+
+            os.replace(temp_filename, filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+    @classmethod
+    def load(cls, filename: str, root: str) -> "GraphArtifact":
+        with open(filename, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise InvalidGraphArtifactException(
+                    f"{filename} is not a graph artifact"
+                )
+
+            header_length = int.from_bytes(f.read(_HEADER_LENGTH_SIZE), "little")
+
+            try:
+                header = json.loads(f.read(header_length))
+            except ValueError:
+                raise InvalidGraphArtifactException(
+                    f"{filename} has a corrupt header"
+                ) from None
+
+            if not isinstance(header, dict):
+                raise InvalidGraphArtifactException(f"{filename} has a corrupt header")
+
+            if header.get("version") != ARTIFACT_FORMAT_VERSION:
+                raise InvalidGraphArtifactException(
+                    f"{filename} has format version {header.get('version')} instead of {ARTIFACT_FORMAT_VERSION}"
+                )
+
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        _check_platform(filename, header)
+        start = _align(len(MAGIC) + _HEADER_LENGTH_SIZE + header_length)
+
+        try:
+            return cls._from_buffer(filename, header, memoryview(buffer), start, root)
+        except (KeyError, IndexError, TypeError, ValueError, zlib.error) as e:
+            # Truncated files and headers or tables missing entries are reported the same way as other corrupt files
+            raise InvalidGraphArtifactException(
+                f"{filename} is corrupt: {e!r}"
+            ) from None
+
+    @classmethod
+    def _from_buffer(
+        cls, filename: str, header: dict, view: memoryview, start: int, root: str
+    ) -> "GraphArtifact":
+        sections = header["sections"]
+        table = json.loads(
+            zlib.decompress(_section(filename, view, start, sections, "table", "B"))
+        )
+        paths = [_absolute_path(path, root) for path in table["paths"]]
+        # Slices of the mapping are read lazily by the OS as the graph is traversed
+        arrays = [
+            _section(filename, view, start, sections, name, typecode)
+            for name, typecode in _ARRAYS
+        ]
+        pred_offsets, preds, succ_offsets, succs = arrays
+
+        if (
+            len(pred_offsets) != len(paths) + 1
+            or len(succ_offsets) != len(paths) + 1
+            or pred_offsets[-1] != len(preds)
+            or succ_offsets[-1] != len(succs)
+            or len(table["kinds"]) != len(paths)
+            or len(table["modules"]) != len(paths)
+        ):
+            raise InvalidGraphArtifactException(f"{filename} has a corrupt graph")
+
+        provenance = {
+            path: (kind, path, module_name)
+            for path, kind, module_name in zip(paths, table["kinds"], table["modules"])
+            if kind is not None
+        }
+
+        missing_files = _section(filename, view, start, sections, "missing_files", "B")
+        artifact = cls(
+            CompactGraph(paths, *arrays),
+            header["commit"],
+            tuple(header["python_version"]),
+            [_absolute_path(p, root) for p in header["python_path"]],
+            [_absolute_path(p, root) for p in header["test_paths"]],
+            [
+                (_absolute_path(u, root), _absolute_path(v, root))
+                for u, v in header["extra_deps"]
+            ],
+            provenance,
+            dirty_files=[_absolute_path(f, root) for f in header["dirty_files"]],
+            unresolved_files=[
+                _absolute_path(f, root) for f in header["unresolved_files"]
+            ],
+        )
+        artifact._encoded_missing_files = missing_files, root
+        return artifact
+
+
+def _section(
+    filename: str,
+    view: memoryview,
+    start: int,
+    sections: dict,
+    name: str,
+    typecode: str,
+) -> memoryview:
+    offset, length = sections[name]
+    itemsize = array.array(typecode).itemsize
+
+    if (
+        not isinstance(offset, int)
+        or not isinstance(length, int)
+        or offset < 0
+        or length < 0
+        or length % itemsize
+        or start + offset + length > len(view)
+    ):
+        raise InvalidGraphArtifactException(
+            f"{filename} is truncated or has a corrupt {name} section"
+        )
+
+    return view[start + offset : start + offset + length].cast(typecode)
+
+
+def _check_platform(filename: str, header: dict) -> None:
+    # The arrays are mapped as is so they must have been written with the same layout
+    itemsizes = {name: array.array(typecode).itemsize for name, typecode in _ARRAYS}
+
+    if header.get("byteorder") != sys.byteorder or header.get("itemsizes") != itemsizes:
+        raise InvalidGraphArtifactException(
+            f"{filename} was written on a platform with a different byte order or integer sizes"
+        )
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _relative_path(path: str, root: str) -> str:
+    # Paths outside the repository, e.g. of installed packages, are kept absolute
+    if path.startswith(root + os.sep):
+        return os.path.relpath(path, root).replace(os.sep, "/")
+    if path == root:
+        return "."
+    return path
+
+
+def _absolute_path(path: str, root: str) -> str:
+    # Joined by hand since it runs for every node of the graph when loading
+    if os.path.isabs(path):
+        return path
+    if path == ".":
+        return root
+    return root + os.sep + path.replace("/", os.sep)
@@ -0,0 +1,303 @@
+import ast
+import functools
+import importlib.util
+import inspect
+import os
+import sys
+import types
+
+from typing import Dict, Iterable, Iterator, List, MutableSet, Optional, Set, Tuple
+
+import pytest
+
+
+class ItemReach:
+    """
+    Static reach of test items to changed top level functions and classes.
+
+    Starting from the test function, its fixtures and its parameters, the global names used by the code of each
+    function are looked up in the function's globals and followed into the functions, classes and modules they refer
+    to. Only code in affected files is followed since no other code can refer to a changed name. Other values are
+    followed into their class and are treated as changed if they are defined in, or imported from, a module that
+    changed as a whole. Values computed at import time by calling a changed function are not detected.
+    """
+
+    def __init__(
+        self,
+        changed_symbols: Dict[str, Optional[Set[str]]],
+        affected_files: Iterable[str],
+    ):
+        self.changed_symbols = {
+            os.path.realpath(f): s for f, s in changed_symbols.items()
+        }
+        self.affected_files = {os.path.realpath(f) for f in affected_files}
+        # Objects are kept alongside the result so their ids are not reused
+        self._reaches: Dict[int, Tuple[object, bool]] = {}
+        self._from_imports: Dict[str, Dict[str, Tuple[str, str]]] = {}
+        self._realpaths: Dict[str, str] = {}
+        self._depth = 0
+        self._negatives: List[int] = []
+
+    def item_reaches_changes(self, item: pytest.Item) -> bool:
+        # Items not defined by a Python function e.g. doctests cannot be analyzed
+        if not isinstance(item, pytest.Function):
+            return True
+
+        objs = [item.obj]
+
+        # Setup and teardown methods of test classes
+        if item.cls is not None:
+            objs.extend(
+                v for k, v in vars(item.cls).items() if not k.startswith("test")
+            )
+
+        if (fixtureinfo := getattr(item, "_fixtureinfo", None)) is not None:
+            for fixturedefs in fixtureinfo.name2fixturedefs.values():
+                objs.extend(fixturedef.func for fixturedef in fixturedefs)
+
+        if (callspec := getattr(item, "callspec", None)) is not None:
+            objs.extend(callspec.params.values())
+
+        try:
+            return any(self.reaches(obj) for obj in objs)
+        except RecursionError:
+            return True
+
+    def reaches(self, obj: object) -> bool:
+        if (memo := self._reaches.get(id(obj))) is not None:
+            return memo[1]
+
+        # Assume objects being analyzed do not reach any changes to break cycles. An object found not to reach any
+        # changes may have relied on that assumption so negative results are only kept once the outermost object is
+        # found not to reach any changes either
+        self._reaches[id(obj)] = obj, False
+        self._depth += 1
+
+        try:
+            reaches = self._reaches_uncached(obj)
+        finally:
+            self._depth -= 1
+
+        if reaches:
+            self._reaches[id(obj)] = obj, True
+        else:
+            self._negatives.append(id(obj))
+
+        if self._depth == 0:
+            if reaches:
+                for negative in self._negatives:
+                    self._reaches.pop(negative, None)
+
+            self._negatives.clear()
+
+        return reaches
+
+    def _reaches_uncached(self, obj: object) -> bool:
+        if isinstance(obj, (types.MethodType, staticmethod, classmethod)):
+            return self.reaches(obj.__func__)
+
+        if isinstance(obj, property):
+            return any(self.reaches(f) for f in (obj.fget, obj.fset, obj.fdel) if f)
+
+        if isinstance(obj, functools.partial):
+            return any(
+                self.reaches(o) for o in (obj.func, *obj.args, *obj.keywords.values())
+            )
+
+        if inspect.isfunction(obj):
+            # Decorators using functools.wraps keep the decorated function in __wrapped__
+            wrapped = getattr(obj, "__wrapped__", None)
+            return self._function_reaches(obj) or (
+                wrapped is not None and self.reaches(wrapped)
+            )
+
+        if inspect.isclass(obj):
+            return self._class_reaches(obj)
+
+        if inspect.ismodule(obj):
+            return self._is_changed(_module_file(obj), None)
+
+        return self.reaches(type(obj))
+
+    def _function_reaches(self, func: types.FunctionType) -> bool:
+        filename = self._realpath(func.__code__.co_filename)
+
+        if self._is_changed(filename, func.__qualname__):
+            return True
+
+        if filename not in self.affected_files:
+            return False
+
+        names = set()
+
+        for code in _walk_code(func.__code__):
+            names.update(code.co_names)
+
+        if self._names_reach(func.__globals__, names):
+            return True
+
+        for cell in func.__closure__ or ():
+            try:
+                value = cell.cell_contents
+            except ValueError:
+                # Empty cell
+                continue
+
+            if self.reaches(value):
+                return True
+
+        defaults = (*(func.__defaults__ or ()), *(func.__kwdefaults__ or {}).values())
+        return any(self.reaches(default) for default in defaults)
+
+    def _class_reaches(self, cls: type) -> bool:
+        filename = _module_file(sys.modules.get(cls.__module__))
+
+        if filename is None:
+            return False
+
+        filename = self._realpath(filename)
+
+        if self._is_changed(filename, cls.__qualname__):
+            return True
+
+        if filename not in self.affected_files:
+            return False
+
+        if any(self.reaches(base) for base in cls.__mro__[1:]):
+            return True
+
+        return any(
+            self.reaches(value)
+            for value in vars(cls).values()
+            if callable(value)
+            or isinstance(value, (staticmethod, classmethod, property))
+        )
+
+    def _names_reach(
+        self,
+        namespace: dict,
+        names: Set[str],
+        seen: Optional[MutableSet[int]] = None,
+    ) -> bool:
+        # Names used by code include attribute names so modules are followed through the same names e.g. a.b.f
+        seen = seen if seen is not None else set()
+
+        for name in names:
+            if name not in namespace:
+                continue
+
+            value = namespace[name]
+
+            if inspect.ismodule(value):
+                if id(value) in seen:
+                    continue
+
+                seen.add(id(value))
+
+                if self.reaches(value) or self._names_reach(vars(value), names, seen):
+                    return True
+            elif self.reaches(value) or self._value_changed(namespace, name):
+                return True
+
+        return False
+
+    def _value_changed(
+        self, namespace: dict, name: str, seen: Optional[MutableSet[str]] = None
+    ) -> bool:
+        # Whether a value is defined in or imported from a module that changed as a whole
+        filename = namespace.get("__file__")
+        seen = seen if seen is not None else set()
+
+        if filename is None or filename in seen:
+            return False
+
+        seen.add(filename)
+
+        filename = self._realpath(filename)
+
+        if self._is_changed(filename, None):
+            return True
+
+        if filename not in self.affected_files:
+            return False
+
+        if (imported := self._get_from_imports(filename, namespace).get(name)) is None:
+            return False
+
+        module_name, imported_name = imported
+        module = sys.modules.get(module_name)
+
+        if module is None:
+            return False
+
+        return self._value_changed(vars(module), imported_name, seen)
+
+    def _get_from_imports(
+        self, filename: str, namespace: dict
+    ) -> Dict[str, Tuple[str, str]]:
+        if filename not in self._from_imports:
+            self._from_imports[filename] = _from_imports(
+                filename, namespace.get("__package__")
+            )
+        return self._from_imports[filename]
+
+    def _is_changed(self, filename: Optional[str], qualname: Optional[str]) -> bool:
+        # A qualname of None checks whether the module changed as a whole
+        if filename is None:
+            return False
+
+        filename = self._realpath(filename)
+
+        if filename not in self.changed_symbols:
+            return False
+
+        symbols = self.changed_symbols[filename]
+
+        if symbols is None:
+            return True
+
+        return qualname is not None and qualname.split(".", 1)[0] in symbols
+
+    def _realpath(self, filename: str) -> str:
+        if filename not in self._realpaths:
+            self._realpaths[filename] = os.path.realpath(filename)
+        return self._realpaths[filename]
+
+
+def _module_file(module: Optional[types.ModuleType]) -> Optional[str]:
+    return getattr(module, "__file__", None)
+
+
+def _walk_code(code: types.CodeType) -> Iterator[types.CodeType]:
+    yield code
+
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _walk_code(const)
+
+
+def _from_imports(filename: str, package: Optional[str]) -> Dict[str, Tuple[str, str]]:
+    # Module and original name of each name bound by a from import in a module
+    try:
+        with open(filename, "rb") as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, ValueError):
+        return {}
+
+    imports = {}
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.ImportFrom):
+            continue
+
+        try:
+            module_name = importlib.util.resolve_name(
+                "." * node.level + (node.module or ""), package
+            )
+        except (ImportError, ValueError):
+            continue
+
+        for alias in node.names:
+            imports[alias.asname or alias.name] = module_name, alias.name
+
+    return imports
@@ -0,0 +1,165 @@
+import contextlib
+import marshal
+import os
+import sqlite3
+import sys
+import time
+
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from pytest_git_selector.util import (
+    DEFAULT_PARSE_CACHE_MAX_SIZE_MB,
+    sqlite_chunks,
+    sqlite_placeholders,
+)
+
+# (name, new name, is from, is star) of an import statement as written in a file before it is resolved
+ParsedImport = Tuple[str, str, bool, bool]
+
+# Evicting down to a fraction of the maximum size leaves room for the next runs before having to evict again
+_EVICTION_TARGET = 0.9
+
+
+class ParseCache:
+    """
+    Import statements of each file keyed by the git blob SHA of the file, stored in a SQLite database.
+
+    Entries only depend on the contents of a file and the Python version parsing it so a single cache can be shared by
+    every checkout and branch on a machine. Statements are stored marshalled without the paths the interpreter resolves
+    them to since those depend on the environment. The least recently used entries are evicted on save once the stored
+    statements take up more than max_size bytes.
+
+    New entries and uses of existing entries are written by save in a single transaction. Several processes can use the
+    same cache at once, writers wait for each other.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        max_size: int = DEFAULT_PARSE_CACHE_MAX_SIZE_MB * 1024 * 1024,
+        python_version: Tuple[int, int] = sys.version_info[:2],
+    ):
+        self.filename = filename
+        self.max_size = max_size
+        self.python_version = "%d.%d" % tuple(python_version)
+        self._pending: Dict[str, bytes] = {}
+        self._used: Set[str] = set()
+
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        # Transactions are started explicitly so writers hold the write lock while evicting
+        self.connection = sqlite3.connect(filename, timeout=60, isolation_level=None)
+        # Readers do not block the writer and the other way around
+        self.connection.execute("PRAGMA journal_mode=WAL")
+
+        with self._transaction():
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS imports (
+                    python_version TEXT NOT NULL,
+                    sha TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used INTEGER NOT NULL,
+                    PRIMARY KEY (python_version, sha)
+                ) WITHOUT ROWID
+                """)
+            # Covers the size and eviction queries so they do not read the entries
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS imports_last_used ON imports (last_used, size)"
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get(self, shas: Iterable[str]) -> Dict[str, List[ParsedImport]]:
+        """Import statements of the blobs in the cache by SHA. Blobs that are not in the cache are left out."""
+        imports = {}
+
+        for chunk in sqlite_chunks(list(set(shas))):
+            query = (
+                "SELECT sha, data FROM imports "
+                f"WHERE python_version = ? AND sha IN ({sqlite_placeholders(chunk)})"
+            )
+
+            for sha, data in self.connection.execute(
+                query, [self.python_version, *chunk]
+            ):
+                try:
+                    imports[sha] = [tuple(imp) for imp in marshal.loads(data)]
+                except (EOFError, ValueError, TypeError):
+                    # Corrupt entries are parsed again and replaced
+                    continue
+
+        self._used.update(imports)
+        return imports
+
+    def put(self, sha: str, imports: List[ParsedImport]) -> None:
+        self._pending[sha] = marshal.dumps([tuple(imp) for imp in imports])
+
+    def save(self) -> None:
+        if not self._pending and not self._used:
+            return
+
+        now = time.time_ns()
+        used = list(self._used.difference(self._pending))
+
+        with self._transaction():
+            for chunk in sqlite_chunks(used):
+                self.connection.execute(
+                    "UPDATE imports SET last_used = ? "
+                    f"WHERE python_version = ? AND sha IN ({sqlite_placeholders(chunk)})",
+                    [now, self.python_version, *chunk],
+                )
+
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO imports (python_version, sha, data, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    (self.python_version, sha, data, len(data), now)
+                    for sha, data in self._pending.items()
+                ),
+            )
+            self._evict()
+
+        self._pending.clear()
+        self._used.clear()
+
+    def size(self) -> int:
+        (size,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM imports"
+        ).fetchone()
+        return size
+
+    def _evict(self) -> None:
+        size = self.size()
+
+        if size <= self.max_size:
+            return
+
+        target = self.max_size * _EVICTION_TARGET
+        evicted = []
+
+        for python_version, sha, entry_size in self.connection.execute(
+            "SELECT python_version, sha, size FROM imports ORDER BY last_used"
+        ):
+            if size <= target:
+                break
+
+            evicted.append((python_version, sha))
+            size -= entry_size
+
+        self.connection.executemany(
+            "DELETE FROM imports WHERE python_version = ? AND sha = ?", evicted
+        )
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # Take the write lock up front. Upgrading a read transaction fails instead of waiting when another process wrote
+        self.connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+        self.connection.execute("COMMIT")
@@ -1,12 +1,55 @@
-from typing import List
+import fnmatch
+import math
+import os
+
+from typing import TYPE_CHECKING, Dict, List, MutableSet, Optional, Set, Tuple
 
 import pytest
 
-from pytest_git_selector.selector import select_test_files
-from pytest_git_selector.util import parse_extra_deps_file
+from pytest_git_selector.coverage_map import CoverageMap, CoverageRecorder
+from pytest_git_selector.errors import UnsupportedArgumentException
+from pytest_git_selector.parse_cache import ParseCache
+from pytest_git_selector.profiling import SelectionProfile
+from pytest_git_selector.items import ItemReach
+from pytest_git_selector.shards import (
+    DURATIONS_CACHE_KEY,
+    ITEM_DURATIONS_CACHE_KEY,
+    absolute_durations,
+    shard_test_files,
+    validate_shard_args,
+)
+from pytest_git_selector.util import (
+    DEFAULT_PARSE_CACHE_MAX_SIZE_MB,
+    GIT_BACKENDS,
+    GRANULARITIES,
+    parse_extra_deps_file,
+)
 
+# The selector imports GitPython and importlab which are only imported once tests are selected so runs without git
+# diff args do not pay for importing them
+if TYPE_CHECKING:
+    from pytest_git_selector.selector import Selection
 
 git_diff_args_key = pytest.StashKey[List[str]]()
+selection_profile_key = pytest.StashKey[SelectionProfile]()
+# Changes the test files were selected for when selecting test items
+selection_key = pytest.StashKey["Selection"]()
+# Candidate test files and the selected subset when selecting before collection
+pruned_test_files_key = pytest.StashKey[Tuple[MutableSet[str], MutableSet[str]]]()
+# Selection computed by the pytest-xdist controller for its workers
+controller_selection_key = pytest.StashKey[dict]()
+# Test files selected by the pytest-xdist controller on behalf of a worker
+controller_test_files_key = pytest.StashKey[MutableSet[str]]()
+coverage_map_key = pytest.StashKey[CoverageMap]()
+coverage_recorder_key = pytest.StashKey[CoverageRecorder]()
+parse_cache_key = pytest.StashKey[ParseCache]()
+# Files executed by each test item while recording a coverage map
+recorded_coverage_key = pytest.StashKey[Dict[str, Set[str]]]()
+# Duration entries of files that no longer exist by cache key, found when reading durations
+stale_durations_key = pytest.StashKey[Dict[str, Set[str]]]()
+
+# Key of the selection sent by the pytest-xdist controller to its workers in workerinput
+WORKERINPUT_KEY = "git_selector_selection"
 
 
 def pytest_load_initial_conftests(early_config, parser, args):
@@ -28,7 +71,7 @@ def pytest_addoption(parser):
         action="append",
         help=(
             "args to pass to git diff. "
-            "git diff is called internally with the --name-only and --no-renames automatically. "
+            "git diff is called internally with the --name-status, --no-renames and -z flags automatically. "
             "Any additional arguments must not interfere with the output format e.g. do not use the --output flag "
             "which writes to a file instead of stdout"
         ),
@@ -46,6 +89,181 @@ def pytest_addoption(parser):
         ),
         default=None,
     )
+    group.addoption(
+        "--graph-cache",
+        help=(
+            "path of a file used to cache the resolved imports of each file between runs. "
+            "Entries are keyed by the git blob SHA of each file so only files that have changed since the last run "
+            "are parsed again. The file is created if it does not exist"
+        ),
+        default=None,
+    )
+    group.addoption(
+        "--graph-snapshot",
+        help=(
+            "path of a file holding the resolved imports of each file tagged with the commit they were saved at. "
+            "Only files that changed since that commit according to git are parsed and the snapshot is then saved "
+            "tagged with the current commit. The file is created if it does not exist. Takes precedence over "
+            "'--graph-cache'"
+        ),
+        default=None,
+    )
+    group.addoption(
+        "--parse-cache",
+        metavar="PATH",
+        help=(
+            "path of a SQLite database caching the import statements parsed from each file by its git blob SHA. "
+            "Entries do not depend on the checkout so one cache can be shared by every checkout and branch on a "
+            "machine and by parallel jobs. Only used for files that are not in '--graph-cache' or '--graph-snapshot'"
+        ),
+        default=None,
+    )
+    group.addoption(
+        "--parse-cache-max-size",
+        type=int,
+        metavar="MB",
+        help=(
+            "maximum size of the import statements stored in '--parse-cache' in megabytes. The least recently used "
+            f"entries are evicted beyond it. Defaults to {DEFAULT_PARSE_CACHE_MAX_SIZE_MB}"
+        ),
+        default=DEFAULT_PARSE_CACHE_MAX_SIZE_MB,
+    )
+    group.addoption(
+        "--selector-workers",
+        type=int,
+        help=(
+            "number of worker processes used to parse and resolve imports when building the import graph. "
+            "Use 0 to start one worker per CPU. Defaults to 1 which parses files in the current process"
+        ),
+        default=1,
+    )
+    group.addoption(
+        "--selector-granularity",
+        choices=(*GRANULARITIES, "item"),
+        help=(
+            "granularity of test selection. 'file' selects every test module that imports a changed file. "
+            "'symbol' maps the changed lines to the top level functions and classes of each changed module and only "
+            "follows modules that import one of the changed names with 'from x import y' or import the whole module. "
+            "Changes outside functions and classes are treated as changes to the whole module. "
+            "'symbol' assumes the working tree matches the new side of the diff. "
+            "'item' selects test modules like 'symbol' then deselects test functions that do not use a changed "
+            "function or class through their code, fixtures or parameters. Defaults to 'file'"
+        ),
+        default="file",
+    )
+    group.addoption(
+        "--git-backend",
+        choices=GIT_BACKENDS,
+        help=(
+            "how git diff is read. 'native' reads the object database and the index in-process without starting "
+            "git and supports comparing commits (A B, A..B and A...B), a commit with the index (--cached) and the "
+            "index or a commit with the working tree, optionally with --diff-filter. 'subprocess' runs git diff. "
+            "'auto' uses 'subprocess', which is faster, and only falls back to 'native' when git cannot be "
+            "started. Defaults to 'auto'"
+        ),
+        default="auto",
+    )
+    group.addoption(
+        "--selector-profile",
+        action="store_true",
+        help=(
+            "print the wall time of each phase of test selection along with the number of files, nodes and edges "
+            "involved"
+        ),
+        default=False,
+    )
+    group.addoption(
+        "--selector-profile-memory",
+        action="store_true",
+        help=(
+            "also print the peak memory of each phase with '--selector-profile'. "
+            "Tracing memory slows selection down several times over so the wall times are not representative"
+        ),
+        default=False,
+    )
+    group.addoption(
+        "--prune-collection",
+        action="store_true",
+        help=(
+            "select test files before collection instead of deselecting items afterwards. "
+            "Python files under the collection args that are not selected are never imported by pytest. "
+            "Test items in unselected files are not reported as deselected"
+        ),
+        default=False,
+    )
+    group.addoption(
+        "--daemon-socket",
+        metavar="PATH",
+        help=(
+            "path of the Unix socket of a daemon started with 'git-select-tests daemon'. "
+            "Test files are selected by the daemon which keeps the import graph in memory between runs. "
+            "Falls back to selecting test files in this process if no daemon is listening on the socket. "
+            "Ignored when '--selector-profile', '--graph-snapshot', '--coverage-map', '--selector-order priority' or "
+            "item granularity is used"
+        ),
+        default=None,
+    )
+    group.addoption(
+        "--record-coverage-map",
+        metavar="PATH",
+        help=(
+            "record the source files executed by each test item to a SQLite database at PATH for use with "
+            "'--coverage-map'. Items that are run replace what was previously recorded for them. "
+            "Only files under the rootdir are recorded"
+        ),
+        default=None,
+    )
+    group.addoption(
+        "--coverage-map",
+        metavar="PATH",
+        help=(
+            "path of a database recorded with '--record-coverage-map'. Test items that executed a changed file when "
+            "they were recorded are selected. The import graph is only used for changed files that no recorded item "
+            "executed. Test items that were never recorded are always selected"
+        ),
+        default=None,
+    )
+    group.addoption(
+        "--selector-order",
+        choices=("collection", "priority"),
+        help=(
+            "order of the selected test items. 'collection' keeps the order of collection. 'priority' runs the items "
+            "that failed on the last run first, followed by the items closest in the import graph to a changed file "
+            "and then the fastest items according to the durations recorded in the pytest cache, so failures are "
+            "found sooner with '-x'. Reordering may set up module and class scoped fixtures more than once. "
+            "Defaults to 'collection'"
+        ),
+        default="collection",
+    )
+    group.addoption(
+        "--shards",
+        type=int,
+        metavar="N",
+        help=(
+            "split the selected test files into N shards of about equal duration and only run the shard given by "
+            "'--shard-index'. Durations of test files are recorded in the pytest cache when sharding or with "
+            "'--record-durations'. Files without a recorded duration are weighted by their size. Can be used without "
+            "git diff args to shard all tests"
+        ),
+        default=None,
+    )
+    group.addoption(
+        "--shard-index",
+        type=int,
+        metavar="I",
+        help="index of the shard to run starting from 0. Defaults to 0",
+        default=0,
+    )
+    group.addoption(
+        "--record-durations",
+        action="store_true",
+        help=(
+            "record the durations of the test items run in the pytest cache for use with '--shards' and "
+            "'--selector-order=priority' by later runs, e.g. on the main branch. Durations are always recorded when "
+            "sharding or ordering by priority"
+        ),
+        default=False,
+    )
     # Add a dummy option to document the -- delimiter
     group.addoption(
         "-- ",
@@ -54,35 +272,533 @@ def pytest_addoption(parser):
             "args to pass to git diff. "
             "They must be appear at the end of the args separated from the rest of the args of pytest using the "
             "'--' delimiter e.g. pytest --collect-only -- --diff-filter=M HEAD~1..."
-            "git diff is called internally with the --name-only and --no-renames automatically. "
+            "git diff is called internally with the --name-status, --no-renames and -z flags automatically. "
             "Any additional arguments must not interfere with the output format e.g. do not use the --output flag "
             "which writes to a file instead of stdout"
         ),
     )
 
 
+class _DurationRecorder:
+    """
+    Records the durations of the test items run in the pytest cache under each of keys. DURATIONS_CACHE_KEY holds the
+    total duration of the items of each test file for --shards and ITEM_DURATIONS_CACHE_KEY the duration of each item
+    for --selector-order.
+
+    Registered as a plugin since pytest_runtest_logreport is not passed the config. Reports of pytest-xdist workers
+    are relayed to the controller which is the only process saving the durations.
+    """
+
+    def __init__(self, config: pytest.Config, keys: List[str]):
+        self.config = config
+        self.keys = keys
+        self.durations: Dict[str, float] = {}
+        self.item_durations: Dict[str, float] = {}
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        path = report.nodeid.split("::", 1)[0]
+        self.durations[path] = self.durations.get(path, 0.0) + report.duration
+        self.item_durations[report.nodeid] = (
+            self.item_durations.get(report.nodeid, 0.0) + report.duration
+        )
+
+    def pytest_sessionfinish(self, session: pytest.Session) -> None:
+        cache = getattr(self.config, "cache", None)
+
+        if not self.durations or cache is None or hasattr(self.config, "workerinput"):
+            return
+
+        if DURATIONS_CACHE_KEY in self.keys:
+            self._update(cache, DURATIONS_CACHE_KEY, self.durations)
+        if ITEM_DURATIONS_CACHE_KEY in self.keys:
+            self._update(cache, ITEM_DURATIONS_CACHE_KEY, self.item_durations)
+
+    def _update(self, cache, key: str, durations: Dict[str, float]) -> None:
+        # Entries of files found to no longer exist when the durations were read are forgotten
+        stale = self.config.stash.get(stale_durations_key, {}).get(key, set())
+        durations = {**cache.get(key, {}), **durations}
+        cache.set(key, {k: d for k, d in durations.items() if k not in stale})
+
+
+def pytest_configure(config):
+    try:
+        validate_shard_args(
+            config.getoption("--shards"), config.getoption("--shard-index")
+        )
+    except UnsupportedArgumentException as e:
+        raise pytest.UsageError(str(e))
+
+    # Durations are only needed by later runs that shard or order by priority so other runs do not write to the cache
+    record_durations = config.getoption("--record-durations")
+    duration_keys = []
+
+    if record_durations or config.getoption("--shards") is not None:
+        duration_keys.append(DURATIONS_CACHE_KEY)
+    if record_durations or config.getoption("--selector-order") == "priority":
+        duration_keys.append(ITEM_DURATIONS_CACHE_KEY)
+
+    if duration_keys:
+        config.pluginmanager.register(
+            _DurationRecorder(config, duration_keys), "git-selector-durations"
+        )
+
+    # pytest-xdist workers use the selection of the controller instead of selecting again
+    workerinput = getattr(config, "workerinput", {})
+
+    if (controller_selection := workerinput.get(WORKERINPUT_KEY)) is not None:
+        _stash_controller_selection(config, controller_selection)
+
+    if config.getoption("--record-coverage-map"):
+        config.stash[coverage_recorder_key] = CoverageRecorder(str(config.rootpath))
+        config.stash[recorded_coverage_key] = {}
+
+
+def pytest_unconfigure(config):
+    if (coverage_map := config.stash.get(coverage_map_key, None)) is not None:
+        coverage_map.close()
+    if (parse_cache := config.stash.get(parse_cache_key, None)) is not None:
+        parse_cache.close()
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    if (recorder := item.config.stash.get(coverage_recorder_key, None)) is None:
+        yield
+        return
+
+    # Setup and teardown are recorded too so fixtures count towards the item
+    recorder.start()
+
+    try:
+        yield
+    finally:
+        item.config.stash[recorded_coverage_key][item.nodeid] = recorder.stop()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+
+    if (recorder := config.stash.get(coverage_recorder_key, None)) is None:
+        return
+
+    recorder.close()
+    coverage_map = CoverageMap(
+        config.getoption("--record-coverage-map"), str(config.rootpath)
+    )
+
+    try:
+        coverage_map.record(config.stash[recorded_coverage_key])
+    finally:
+        coverage_map.close()
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    # pytest-xdist hook called on the controller before starting each worker. The controller does not collect any
+    # test items so test files are selected from the collection args in the same way as with --prune-collection
+    config = node.config
+
+    if not config.stash.get(git_diff_args_key, None):
+        return
+
+    node.workerinput[WORKERINPUT_KEY] = _get_controller_selection(config)
+
+
+@pytest.hookimpl()
+def pytest_ignore_collect(collection_path, config):
+    if not config.getoption("--prune-collection"):
+        return None
+
+    if not config.stash.get(git_diff_args_key, None):
+        return None
+
+    # conftest.py and __init__.py are needed by pytest regardless of which test files are selected
+    if collection_path.suffix != ".py" or collection_path.name in (
+        "conftest.py",
+        "__init__.py",
+    ):
+        return None
+
+    candidate_test_files, selected_test_files = _get_pruned_test_files(config)
+    filename = str(collection_path)
+
+    if filename in candidate_test_files and filename not in selected_test_files:
+        return True
+
+    return None
+
+
 @pytest.hookimpl()
 def pytest_collection_modifyitems(session, config, items):
-    all_test_files = list(set(str(item.path) for item in items))  # remove duplicates
+    git_diff_args = config.stash.get(git_diff_args_key, None)
+    shards = config.getoption("--shards")
+    prioritize = config.getoption("--selector-order") == "priority"
+
+    if not git_diff_args and shards is None and not prioritize:
+        return
+
+    if git_diff_args:
+        selected = _select_changed_items(session, config, items)
+    else:
+        selected = list(items)
+
+    # Test files are sharded before collection when pruning
+    if shards is not None and not (
+        git_diff_args and config.getoption("--prune-collection")
+    ):
+        shard = _shard_test_files(config, set(str(item.path) for item in selected))
+        selected = [item for item in selected if str(item.path) in shard]
+
+    if prioritize:
+        selected = _prioritize_test_items(config, selected)
+
+    selected_ids = set(map(id, selected))
+    deselected = [item for item in session.items if id(item) not in selected_ids]
+    config.hook.pytest_deselected(items=deselected)
+
+    # Docs say this should be done in-place
+    items[:] = selected
+
+
+def _select_changed_items(session, config, items) -> List[pytest.Item]:
+    if config.getoption("--prune-collection"):
+        _, selected_items = _get_pruned_test_files(config)
+    else:
+        all_test_files = list(
+            set(str(item.path) for item in items)
+        )  # remove duplicates
+        selected_items = _select_test_files(config, all_test_files)
+
+    selected = [item for item in session.items if str(item.path) in selected_items]
+
+    if config.getoption("--selector-granularity") == "item":
+        selected = _select_test_items(config.stash[selection_key], selected)
+
+    if (coverage_map := _get_coverage_map(config)) is not None:
+        selected = _select_test_items_by_coverage(
+            coverage_map, config.stash[selection_key], session.items, selected
+        )
+
+    return selected
+
 
-    if git_diff_args := config.stash.get(git_diff_args_key, None):
-        if extra_deps_filename := config.getoption("--extra-deps-file"):
-            extra_deps = parse_extra_deps_file(extra_deps_filename)
-        else:
-            extra_deps = None
+def _get_pruned_test_files(config) -> Tuple[MutableSet[str], MutableSet[str]]:
+    if (pruned_test_files := config.stash.get(pruned_test_files_key, None)) is not None:
+        return pruned_test_files
 
-        selected_items = select_test_files(
-            git_diff_args,
-            all_test_files,
+    candidate_test_files = _get_candidate_test_files(config)
+    selected_test_files = _select_test_files(config, list(candidate_test_files))
+
+    if (coverage_map := _get_coverage_map(config)) is not None:
+        # Collect the modules of items that executed a changed file and modules that were never recorded
+        selection = config.stash[selection_key]
+        recorded_files = _nodeid_files(config, coverage_map.recorded_items())
+        executing_files = _nodeid_files(
+            config, coverage_map.items_executing(selection.diff_files)
+        )
+        selected_test_files = (
+            selected_test_files
+            | executing_files
+            | (candidate_test_files - recorded_files)
+        )
+
+    if config.getoption("--shards") is not None:
+        selected_test_files = _shard_test_files(config, selected_test_files)
+
+    config.stash[pruned_test_files_key] = candidate_test_files, selected_test_files
+    return candidate_test_files, selected_test_files
+
+
+def _get_candidate_test_files(config) -> MutableSet[str]:
+    # importlab is only imported once tests are selected, like the selector
+    import importlab.utils
+
+    invocation_dir = config.invocation_params.dir
+    # Strip any node id suffixes e.g. test/test_f.py::test_f
+    collection_paths = [
+        str(invocation_dir.joinpath(arg.split("::", 1)[0])) for arg in config.args
+    ]
+
+    # Files pytest does not collect because of --ignore or --ignore-glob are not selected either. Relative paths are
+    # made absolute the same way as by pytest
+    ignore_paths = {os.path.abspath(p) for p in config.getoption("ignore") or []}
+    ignore_globs = [os.path.abspath(p) for p in config.getoption("ignore_glob") or []]
+    root = str(config.rootpath)
+
+    return {
+        f
+        for f in importlab.utils.expand_source_files(collection_paths)
+        if not _is_ignored(f, root, ignore_paths, ignore_globs)
+    }
+
+
+def _is_ignored(
+    path: str, root: str, ignore_paths: Set[str], ignore_globs: List[str]
+) -> bool:
+    # Ignoring a directory ignores every file under it
+    while True:
+        if path in ignore_paths or any(fnmatch.fnmatch(path, g) for g in ignore_globs):
+            return True
+
+        parent = os.path.dirname(path)
+
+        if parent == path or not (parent == root or parent.startswith(root + os.sep)):
+            return False
+
+        path = parent
+
+
+def _get_controller_selection(config) -> dict:
+    # Computed once and sent to every worker. Lists and dicts only so it can be sent through execnet
+    if (
+        controller_selection := config.stash.get(controller_selection_key, None)
+    ) is not None:
+        return controller_selection
+
+    if config.getoption("--prune-collection"):
+        candidate_test_files, selected_test_files = _get_pruned_test_files(config)
+        controller_selection = {
+            "candidate_test_files": sorted(candidate_test_files),
+            "selected_test_files": sorted(selected_test_files),
+        }
+    else:
+        selected_test_files = _select_test_files(
+            config, list(_get_candidate_test_files(config))
+        )
+        controller_selection = {"selected_test_files": sorted(selected_test_files)}
+
+    if (selection := config.stash.get(selection_key, None)) is not None:
+        from pytest_git_selector.selector import encode_selection
+
+        controller_selection["selection"] = encode_selection(selection)
+
+    config.stash[controller_selection_key] = controller_selection
+    return controller_selection
+
+
+def _stash_controller_selection(config, controller_selection: dict) -> None:
+    selected_test_files = set(controller_selection["selected_test_files"])
+
+    if "candidate_test_files" in controller_selection:
+        candidate_test_files = set(controller_selection["candidate_test_files"])
+        config.stash[pruned_test_files_key] = candidate_test_files, selected_test_files
+    else:
+        config.stash[controller_test_files_key] = selected_test_files
+
+    if "selection" in controller_selection:
+        from pytest_git_selector.selector import decode_selection
+
+        config.stash[selection_key] = decode_selection(
+            controller_selection["selection"]
+        )
+
+
+def _select_test_items(
+    selection: "Selection", items: List[pytest.Item]
+) -> List[pytest.Item]:
+    # Changes to files other than Python modules e.g. from --extra-deps-file cannot be traced through code
+    if any(not f.endswith(".py") for f in selection.changed_symbols):
+        return items
+
+    item_reach = ItemReach(selection.changed_symbols, selection.affected_files)
+    return [item for item in items if item_reach.item_reaches_changes(item)]
+
+
+def _select_test_items_by_coverage(
+    coverage_map: CoverageMap,
+    selection: "Selection",
+    items: List[pytest.Item],
+    selected: List[pytest.Item],
+) -> List[pytest.Item]:
+    # Items selected by the import graph for changed files the map has never seen are kept
+    recorded = coverage_map.recorded_items()
+    executing = coverage_map.items_executing(selection.diff_files)
+    selected_ids = set(map(id, selected))
+
+    return [
+        item
+        for item in items
+        if id(item) in selected_ids
+        or item.nodeid not in recorded
+        or item.nodeid in executing
+    ]
+
+
+def _prioritize_test_items(config, items: List[pytest.Item]) -> List[pytest.Item]:
+    if (cache := getattr(config, "cache", None)) is not None:
+        last_failed = cache.get("cache/lastfailed", {})
+    else:
+        last_failed = {}
+
+    durations = _read_durations(
+        config, ITEM_DURATIONS_CACHE_KEY, {str(item.path) for item in items}
+    )
+
+    # Items of files that were not selected through the import graph e.g. by a coverage map come last. Items without
+    # a recorded duration are new and as likely to fail as any so they are treated as the fastest
+    selection = config.stash.get(selection_key, None)
+    distances = selection.distances if selection is not None else {}
+
+    # Sorting is stable so ties keep the order of collection
+    return sorted(
+        items,
+        key=lambda item: (
+            item.nodeid not in last_failed,
+            distances.get(str(item.path), math.inf),
+            durations.get(item.nodeid, 0.0),
+        ),
+    )
+
+
+def _shard_test_files(config, test_files: Set[str]) -> Set[str]:
+    durations = absolute_durations(
+        _read_durations(config, DURATIONS_CACHE_KEY, test_files), str(config.rootpath)
+    )
+
+    return set(
+        shard_test_files(
+            test_files,
+            config.getoption("--shards"),
+            config.getoption("--shard-index"),
+            durations=durations,
+        )
+    )
+
+
+def _read_durations(config, key: str, existing_files: Set[str]) -> Dict[str, float]:
+    # Entries of files that no longer exist are pruned when they are read rather than every time durations are
+    # saved. Only the files that are not in existing_files, e.g. the collected test files, are checked, once each
+    if (cache := getattr(config, "cache", None)) is None:
+        return {}
+
+    durations = cache.get(key, {})
+    stale = config.stash.setdefault(stale_durations_key, {}).setdefault(key, set())
+    exists: Dict[str, bool] = {}
+
+    for k in durations:
+        path = str(config.rootpath.joinpath(k.split("::", 1)[0]))
+
+        if path not in exists:
+            exists[path] = path in existing_files or os.path.isfile(path)
+        if not exists[path]:
+            stale.add(k)
+
+    return {k: d for k, d in durations.items() if k not in stale}
+
+
+def _get_coverage_map(config) -> Optional[CoverageMap]:
+    if not (filename := config.getoption("--coverage-map")):
+        return None
+
+    if (coverage_map := config.stash.get(coverage_map_key, None)) is None:
+        coverage_map = CoverageMap(filename, str(config.rootpath))
+        config.stash[coverage_map_key] = coverage_map
+
+    return coverage_map
+
+
+def _get_parse_cache(config) -> Optional[ParseCache]:
+    if not (filename := config.getoption("--parse-cache")):
+        return None
+
+    if (parse_cache := config.stash.get(parse_cache_key, None)) is None:
+        max_size = config.getoption("--parse-cache-max-size") * 1024 * 1024
+        parse_cache = ParseCache(filename, max_size=max_size)
+        config.stash[parse_cache_key] = parse_cache
+
+    return parse_cache
+
+
+def _nodeid_files(config, nodeids: Set[str]) -> Set[str]:
+    return {
+        os.path.realpath(config.rootpath.joinpath(nodeid.split("::", 1)[0]))
+        for nodeid in nodeids
+    }
+
+
+def _select_test_files(config, test_files: List[str]) -> MutableSet[str]:
+    if (
+        selected_test_files := config.stash.get(controller_test_files_key, None)
+    ) is not None:
+        return selected_test_files
+
+    if extra_deps_filename := config.getoption("--extra-deps-file"):
+        extra_deps = parse_extra_deps_file(extra_deps_filename)
+    else:
+        extra_deps = None
+
+    if config.getoption("--selector-profile"):
+        profile = config.stash.setdefault(
+            selection_profile_key,
+            SelectionProfile(
+                trace_memory=config.getoption("--selector-profile-memory")
+            ),
+        )
+    else:
+        profile = None
+
+    granularity = config.getoption("--selector-granularity")
+    daemon_socket = config.getoption("--daemon-socket")
+
+    coverage_map = _get_coverage_map(config)
+    # The daemon only returns the selected test files
+    needs_selection = (
+        granularity == "item"
+        or coverage_map is not None
+        or config.getoption("--selector-order") == "priority"
+    )
+
+    if (
+        daemon_socket
+        and profile is None
+        and not config.getoption("--graph-snapshot")
+        and not needs_selection
+    ):
+        from pytest_git_selector.daemon import request_selection
+
+        selected_test_files = request_selection(
+            daemon_socket,
+            config.stash[git_diff_args_key],
+            test_files,
             config.getoption("--src-path"),
-            str(session.startpath),
+            str(config.invocation_params.dir),
             extra_deps=extra_deps,
+            granularity=granularity,
+            git_backend=config.getoption("--git-backend"),
         )
 
-        deselected = [
-            item for item in session.items if str(item.path) not in selected_items
-        ]
-        config.hook.pytest_deselected(items=deselected)
+        if selected_test_files is not None:
+            return selected_test_files
+
+    from pytest_git_selector.selector import select_tests
+
+    selection = select_tests(
+        config.stash[git_diff_args_key],
+        test_files,
+        config.getoption("--src-path"),
+        str(config.invocation_params.dir),
+        extra_deps=extra_deps,
+        graph_cache=config.getoption("--graph-cache"),
+        parse_cache=_get_parse_cache(config),
+        workers=config.getoption("--selector-workers"),
+        profile=profile,
+        graph_snapshot=config.getoption("--graph-snapshot"),
+        granularity="symbol" if granularity == "item" else granularity,
+        coverage_map=coverage_map,
+        git_backend=config.getoption("--git-backend"),
+    )
+
+    if needs_selection:
+        config.stash[selection_key] = selection
+
+    return selection.test_files
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if (profile := config.stash.get(selection_profile_key, None)) is None:
+        return
+
+    terminalreporter.write_sep("=", "pytest-git-selector profile")
 
-        # Docs say this should be done in-place
-        items[:] = [item for item in session.items if str(item.path) in selected_items]
+    for line in profile.format_lines():
+        terminalreporter.write_line(line)
@@ -0,0 +1,111 @@
+import contextlib
+import time
+import tracemalloc
+
+from typing import ContextManager, Dict, Iterator, List, Optional
+
+
+class SelectionProfile:
+    """
+    Wall time of each phase of test selection, and optionally its peak memory, along with counts of the files and
+    graph elements involved.
+
+    Phases can be nested and the time spent in a nested phase is excluded from the time of the enclosing phase.
+    Entering the same phase more than once accumulates its time. Peak memory is measured with tracemalloc when
+    trace_memory is set so only allocations made by Python in the current process are included. Tracing memory slows
+    selection down several times over so the wall times of such a profile are not representative.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.counts: Dict[str, int] = {}
+        self._stack: List[dict] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+
+        if started_tracing:
+            tracemalloc.start()
+
+        if self._stack:
+            parent = self._stack[-1]
+            parent["peak_memory"] = max(parent["peak_memory"], _get_peak())
+
+        _reset_peak()
+
+        frame = {"child_time": 0.0, "peak_memory": 0}
+        self._stack.append(frame)
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak_memory = max(frame["peak_memory"], _get_peak())
+            self._stack.pop()
+
+            phase = self.phases.setdefault(name, {"wall_time": 0.0, "calls": 0})
+            phase["wall_time"] += elapsed - frame["child_time"]
+            phase["calls"] += 1
+
+            if self.trace_memory:
+                phase["peak_memory"] = max(phase.get("peak_memory", 0), peak_memory)
+
+            if self._stack:
+                parent = self._stack[-1]
+                parent["child_time"] += elapsed
+                parent["peak_memory"] = max(parent["peak_memory"], peak_memory)
+                _reset_peak()
+
+            if started_tracing:
+                tracemalloc.stop()
+
+    def count(self, name: str, value: int) -> None:
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        return {
+            "total_wall_time": sum(p["wall_time"] for p in self.phases.values()),
+            "phases": self.phases,
+            "counts": self.counts,
+        }
+
+    def format_lines(self) -> List[str]:
+        lines = []
+        total = self.to_dict()["total_wall_time"]
+
+        for name, phase in self.phases.items():
+            line = f"{name:<24}{phase['wall_time']:>10.3f}s"
+
+            if "peak_memory" in phase:
+                line += f"{phase['peak_memory'] / 2 ** 20:>10.1f}MiB peak"
+
+            lines.append(line)
+
+        lines.append(f"{'total':<24}{total:>10.3f}s")
+
+        for name, value in self.counts.items():
+            lines.append(f"{name:<24}{value:>10}")
+
+        return lines
+
+
+def _get_peak() -> int:
+    # Zero when memory is not being traced
+    return tracemalloc.get_traced_memory()[1]
+
+
+def _reset_peak() -> None:
+    # tracemalloc.reset_peak was added in Python 3.9. On older versions the peak covers all phases entered so far
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+
+
+def profile_phase(
+    profile: Optional[SelectionProfile], name: str
+) -> ContextManager[None]:
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.phase(name)
@@ -1,16 +1,94 @@
+import codecs
 import git
 import importlab.environment
-import importlab.graph
 import importlab.utils
 import os
-import networkx
-import pathlib
+import re
 import sys
 
-from typing import List, MutableSet, Optional, Tuple
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableSet,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
-from pytest_git_selector.errors import UnsupportedArgumentException
-from pytest_git_selector.util import to_absolute_path
+from pytest_git_selector.cache import GraphCache, GraphSnapshot
+from pytest_git_selector.compact_graph import CompactGraph, CompactGraphBuilder
+from pytest_git_selector.coverage_map import CoverageMap
+from pytest_git_selector.errors import (
+    InvalidGraphArtifactException,
+    UnsupportedArgumentException,
+)
+from pytest_git_selector.fs import create_environment
+from pytest_git_selector.git_backend import (
+    create_git_backend,
+    sanitize_user_git_diff_args,
+)
+from pytest_git_selector.git_tree import GitTree
+from pytest_git_selector.graph import (
+    SelectorImportGraph,
+    decode_resolved_file,
+    encode_resolved_file,
+)
+from pytest_git_selector.graph_artifact import GraphArtifact
+from pytest_git_selector.parse_cache import ParseCache
+from pytest_git_selector.profiling import SelectionProfile, profile_phase
+from pytest_git_selector.symbols import (
+    Hunk,
+    imported_symbols,
+    only_functions_changed_by_hunks,
+    symbols_changed_by_hunks,
+)
+from pytest_git_selector.util import GRANULARITIES, canonical_path
+
+_HUNK_HEADER = re.compile(rb"@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+class Selection(NamedTuple):
+    # Selected test files
+    test_files: MutableSet[str]
+    # Top level functions and classes changed in each changed file or None if the whole file changed
+    changed_symbols: Dict[str, Optional[Set[str]]]
+    # Changed files and the files importing them directly or indirectly after filtering by symbol
+    affected_files: MutableSet[str]
+    # All files in the diff including deleted files
+    diff_files: MutableSet[str]
+    # Number of imports on the shortest path from each affected file to a changed file
+    distances: Dict[str, int]
+
+
+def encode_selection(selection: Selection) -> dict:
+    # Plain lists and dicts so the selection can be sent to other processes
+    return {
+        "test_files": sorted(selection.test_files),
+        "changed_symbols": {
+            f: sorted(symbols) if symbols is not None else None
+            for f, symbols in selection.changed_symbols.items()
+        },
+        "affected_files": sorted(selection.affected_files),
+        "diff_files": sorted(selection.diff_files),
+        "distances": dict(selection.distances),
+    }
+
+
+def decode_selection(encoded_selection: dict) -> Selection:
+    return Selection(
+        set(encoded_selection["test_files"]),
+        {
+            f: set(symbols) if symbols is not None else None
+            for f, symbols in encoded_selection["changed_symbols"].items()
+        },
+        set(encoded_selection["affected_files"]),
+        set(encoded_selection["diff_files"]),
+        dict(encoded_selection["distances"]),
+    )
 
 
 def select_test_files(
@@ -19,148 +97,1054 @@ def select_test_files(
     python_path: List[str],
     dir_name: str = ".",
     extra_deps: Optional[List[Tuple[str, str]]] = None,
+    graph_cache: Union[str, GraphCache, None] = None,
+    workers: int = 1,
+    profile: Optional[SelectionProfile] = None,
+    graph_snapshot: Optional[str] = None,
+    granularity: str = "file",
+    git_backend: str = "auto",
+    revision: Optional[str] = None,
+    parse_cache: Union[str, ParseCache, None] = None,
 ) -> MutableSet[str]:
-    # Use --no-renames treats renames as a deletion of the pre-rename file and addition of the post-rename file
-    # This is easier to deal with when analyzing the dependencies
-    diff_files = _call_git_diff(
-        git_diff_args, ["--name-only", "--no-renames"], dir_name=dir_name
+    return select_tests(
+        git_diff_args,
+        test_paths,
+        python_path,
+        dir_name=dir_name,
+        extra_deps=extra_deps,
+        graph_cache=graph_cache,
+        workers=workers,
+        profile=profile,
+        graph_snapshot=graph_snapshot,
+        granularity=granularity,
+        git_backend=git_backend,
+        revision=revision,
+        parse_cache=parse_cache,
+    ).test_files
+
+
+def select_tests(
+    git_diff_args: List[str],
+    test_paths: List[str],
+    python_path: List[str],
+    dir_name: str = ".",
+    extra_deps: Optional[List[Tuple[str, str]]] = None,
+    graph_cache: Union[str, GraphCache, None] = None,
+    workers: int = 1,
+    profile: Optional[SelectionProfile] = None,
+    graph_snapshot: Optional[str] = None,
+    granularity: str = "file",
+    coverage_map: Optional[CoverageMap] = None,
+    git_backend: str = "auto",
+    revision: Optional[str] = None,
+    parse_cache: Union[str, ParseCache, None] = None,
+) -> Selection:
+    """
+    Same as select_test_files but also returns the changes the test files were selected for.
+
+    Changes confined to top level functions of files known to a coverage map are left to the map to select test items
+    for so the import graph is only used for files the map has never seen and changes that run on import.
+    """
+    (selection,) = select_tests_batch(
+        [git_diff_args],
+        test_paths,
+        python_path,
+        dir_name=dir_name,
+        extra_deps=extra_deps,
+        graph_cache=graph_cache,
+        workers=workers,
+        profile=profile,
+        graph_snapshot=graph_snapshot,
+        granularity=granularity,
+        coverage_map=coverage_map,
+        git_backend=git_backend,
+        revision=revision,
+        parse_cache=parse_cache,
+    )
+    return selection
+
+
+def select_tests_batch(
+    git_diff_args_list: List[List[str]],
+    test_paths: List[str],
+    python_path: List[str],
+    dir_name: str = ".",
+    extra_deps: Optional[List[Tuple[str, str]]] = None,
+    graph_cache: Union[str, GraphCache, None] = None,
+    workers: int = 1,
+    profile: Optional[SelectionProfile] = None,
+    graph_snapshot: Optional[str] = None,
+    granularity: str = "file",
+    coverage_map: Optional[CoverageMap] = None,
+    git_backend: str = "auto",
+    revision: Optional[str] = None,
+    parse_cache: Union[str, ParseCache, None] = None,
+) -> List[Selection]:
+    """
+    Same as select_tests for each of a list of git diff args while building the import graph only once.
+
+    Files deleted by any of the diffs that are missing from the working tree are presented as empty files to the
+    import graph. Files deleted by a diff that still exist in the working tree keep their imports so they are followed
+    for the other diffs.
+    """
+    import_graph, diffs = _build_import_graph_for_diffs(
+        git_diff_args_list,
+        test_paths,
+        python_path,
+        dir_name=dir_name,
+        extra_deps=extra_deps,
+        graph_cache=graph_cache,
+        workers=workers,
+        profile=profile,
+        graph_snapshot=graph_snapshot,
+        granularity=granularity,
+        git_backend=git_backend,
+        revision=revision,
+        parse_cache=parse_cache,
     )
+    return [
+        _select_tests_from_graph(
+            import_graph,
+            git_diff_args,
+            diff_files,
+            deleted_files,
+            dir_name=dir_name,
+            profile=profile,
+            granularity=granularity,
+            coverage_map=coverage_map,
+        )
+        for git_diff_args, (diff_files, deleted_files) in zip(git_diff_args_list, diffs)
+    ]
+
+
+def iter_test_files(
+    git_diff_args: List[str],
+    test_paths: List[str],
+    python_path: List[str],
+    dir_name: str = ".",
+    extra_deps: Optional[List[Tuple[str, str]]] = None,
+    graph_cache: Union[str, GraphCache, None] = None,
+    workers: int = 1,
+    graph_snapshot: Optional[str] = None,
+    granularity: str = "file",
+    git_backend: str = "auto",
+    revision: Optional[str] = None,
+    parse_cache: Union[str, ParseCache, None] = None,
+) -> Iterator[str]:
+    """
+    Same test files as select_test_files yielded while the import graph is traversed.
 
-    import_graph = _create_import_graph(
-        git_diff_args, python_path, test_paths=test_paths, dir_name=dir_name
+    The import graph is built before the first test file is yielded. Test files not in an import cycle are yielded as
+    soon as they are reached from a changed file.
+    """
+    import_graph, ((diff_files, deleted_files),) = _build_import_graph_for_diffs(
+        [git_diff_args],
+        test_paths,
+        python_path,
+        dir_name=dir_name,
+        extra_deps=extra_deps,
+        graph_cache=graph_cache,
+        workers=workers,
+        graph_snapshot=graph_snapshot,
+        granularity=granularity,
+        git_backend=git_backend,
+        revision=revision,
+        parse_cache=parse_cache,
     )
+    changed_nodes, _ = _find_changed_nodes(
+        import_graph,
+        git_diff_args,
+        diff_files,
+        deleted_files,
+        dir_name=dir_name,
+        granularity=granularity,
+    )
+    graph = import_graph.compact_graph
+
+    for node in graph.iter_root_ancestors(graph.ids[path] for path in changed_nodes):
+        yield graph.paths[node]
+
 
-    if extra_deps:
-        extra_deps = _to_absolute_path_extra_deps(extra_deps, dir_name)
-        import_graph.graph.add_edges_from(extra_deps)
+def update_graph_snapshot(
+    graph_snapshot: str,
+    test_paths: List[str],
+    python_path: List[str],
+    dir_name: str = ".",
+    workers: int = 1,
+    profile: Optional[SelectionProfile] = None,
+    git_backend: str = "auto",
+    parse_cache: Union[str, ParseCache, None] = None,
+) -> None:
+    """
+    Update the graph snapshot saved at graph_snapshot to the working tree of the repository in dir_name.
 
-    root_ancestor_nodes = set()
+    Only the files that changed since the commit the snapshot was saved at are parsed. The snapshot is created if it
+    does not exist.
+    """
+    _create_import_graph(
+        set(),
+        python_path,
+        test_paths=test_paths,
+        dir_name=dir_name,
+        workers=workers,
+        profile=profile,
+        graph_snapshot=graph_snapshot,
+        git_backend=git_backend,
+        parse_cache=parse_cache,
+    )
 
-    for node in import_graph.graph.nodes:
-        filename = pathlib.Path(import_graph.format(node))
 
-        if filename in diff_files:
-            _find_root_ancestors(import_graph.graph, node, root_ancestor_nodes)
+def build_graph_artifact(
+    filename: str,
+    test_paths: List[str],
+    python_path: List[str],
+    dir_name: str = ".",
+    extra_deps: Optional[List[Tuple[str, str]]] = None,
+    graph_cache: Union[str, GraphCache, None] = None,
+    workers: int = 1,
+    profile: Optional[SelectionProfile] = None,
+    git_backend: str = "auto",
+    revision: Optional[str] = None,
+    parse_cache: Union[str, ParseCache, None] = None,
+) -> GraphArtifact:
+    """
+    Build the import graph of the working tree, or of revision if given, and save it to filename as a graph artifact
+    tagged with the commit.
 
-    root_ancestor_nodes = set(map(import_graph.format, root_ancestor_nodes))
+    Files of the working tree that differ from HEAD or are not tracked by git are recorded as dirty so they are resolved
+    again when the artifact is loaded.
+    """
+    tree = GitTree(revision, dir_name) if revision is not None else None
+    root = canonical_path(dir_name)
+    extra_deps = _to_absolute_path_extra_deps(extra_deps or [], dir_name)
 
-    return root_ancestor_nodes
+    with profile_phase(profile, "graph_building"):
+        import_graph = _create_import_graph(
+            set(),
+            python_path,
+            test_paths=test_paths,
+            dir_name=dir_name,
+            graph_cache=graph_cache,
+            workers=workers,
+            profile=profile,
+            extra_deps=extra_deps,
+            git_backend=git_backend,
+            tree=tree,
+            parse_cache=parse_cache,
+        )
 
+    graph = import_graph.compact_graph
 
-def _call_git_diff(
-    user_git_diff_args: List[str], extra_git_diff_args: List[str], dir_name: str = "."
-) -> MutableSet[pathlib.Path]:
-    repo = git.Repo(dir_name)
+    if tree is not None:
+        commit = tree.commit
+        dirty_files = set()
+    else:
+        commit = git.Repo(dir_name).git.rev_parse("--verify", "HEAD")
+        dirty_files = {
+            path for path in graph.paths if path.startswith(root + os.sep)
+        } - _clean_files(dir_name, git_backend)
 
-    sanitized_args = _sanitize_user_git_diff_args(
-        user_git_diff_args, extra_git_diff_args
+    artifact = _graph_artifact(
+        import_graph, commit, python_path, test_paths, extra_deps, dirty_files
     )
 
-    git_diff_output = repo.git.diff(*sanitized_args)
+    with profile_phase(profile, "graph_saving"):
+        artifact.save(filename, root)
+
+    if profile is not None:
+        profile.count("nodes", graph.number_of_nodes())
+        profile.count("edges", graph.number_of_edges())
 
-    if not git_diff_output:
-        return set()
+    return artifact
 
-    diff_files_relative_path = git_diff_output.split("\n")
 
-    # Import graph is stated in absolute paths so need absolute paths for diffs also
-    return {to_absolute_path(dir_name, p) for p in diff_files_relative_path}
+def select_tests_from_graph_artifact(
+    graph_artifact: str,
+    git_diff_args: List[str],
+    dir_name: str = ".",
+    workers: int = 1,
+    profile: Optional[SelectionProfile] = None,
+    granularity: str = "file",
+    git_backend: str = "auto",
+    revision: Optional[str] = None,
+    parse_cache: Union[str, ParseCache, None] = None,
+) -> Selection:
+    """
+    Same as select_tests with the import graph loaded from a graph artifact saved by build_graph_artifact.
 
+    The test paths, python path and extra dependencies are the ones the artifact was built with. Only the files that
+    changed between the commit of the artifact and the working tree, or revision if given, are resolved again along
+    with new test files, files whose imports did not resolve and files whose imports looked up a file added since. The
+    graph of the artifact is used as it is mapped from the file unless their imports changed.
+    """
+    if granularity not in GRANULARITIES:
+        raise UnsupportedArgumentException(f"Unknown granularity: {granularity}")
 
-def _sanitize_user_git_diff_args(
-    user_git_diff_args: List[str], extra_git_diff_args: List[str]
-) -> List[str]:
-    # The --name-only flag seems to supersede any other flags that format the output so no need to validate thoroughly
+    with profile_phase(profile, "git_diff"):
+        diff_files, deleted_files = _call_git_diff(
+            git_diff_args, dir_name=dir_name, git_backend=git_backend
+        )
+
+    tree = GitTree(revision, dir_name) if revision is not None else None
+
+    with profile_phase(profile, "graph_loading"):
+        artifact = GraphArtifact.load(graph_artifact, canonical_path(dir_name))
+
+    with profile_phase(profile, "graph_building"):
+        import_graph = _update_graph_artifact(
+            artifact,
+            deleted_files,
+            dir_name=dir_name,
+            workers=workers,
+            profile=profile,
+            granularity=granularity,
+            git_backend=git_backend,
+            tree=tree,
+            parse_cache=parse_cache,
+        )
+
+    if profile is not None:
+        profile.count("nodes", import_graph.compact_graph.number_of_nodes())
+        profile.count("edges", import_graph.compact_graph.number_of_edges())
 
-    # Just need to check:
-    # a) only one diff-filter arg is passed in (using the value given in extra_git_diff_args if duplicates are found)
-    #       since this can interfere with diff-filter args supplied by us
-    # b) the --output flag isn't supplied
-    sanitized_args = []
-    extra_args_contains_diff_filter = any(
-        x.startswith("--diff-filter") for x in extra_git_diff_args
+    return _select_tests_from_graph(
+        import_graph,
+        git_diff_args,
+        diff_files,
+        deleted_files,
+        dir_name=dir_name,
+        profile=profile,
+        granularity=granularity,
     )
-    i = 0
 
-    while i < len(user_git_diff_args):
-        v = user_git_diff_args[i]
 
-        if v == "--output":
-            raise UnsupportedArgumentException(
-                "--output argument to git diff is not supported"
-            )
+def _build_import_graph_for_diffs(
+    git_diff_args_list: List[List[str]],
+    test_paths: List[str],
+    python_path: List[str],
+    dir_name: str = ".",
+    extra_deps: Optional[List[Tuple[str, str]]] = None,
+    graph_cache: Union[str, GraphCache, None] = None,
+    workers: int = 1,
+    profile: Optional[SelectionProfile] = None,
+    graph_snapshot: Optional[str] = None,
+    granularity: str = "file",
+    git_backend: str = "auto",
+    revision: Optional[str] = None,
+    parse_cache: Union[str, ParseCache, None] = None,
+) -> Tuple[SelectorImportGraph, List[Tuple[MutableSet[str], MutableSet[str]]]]:
+    if granularity not in GRANULARITIES:
+        raise UnsupportedArgumentException(f"Unknown granularity: {granularity}")
 
-        if v.startswith("--diff-filter"):
-            if v.startswith("--diff-filter="):
-                _, filter_values = v.split("=", 1)
-            else:
-                filter_values = user_git_diff_args[i + 1]
-                i += 1  # Eat up an extra argument since the filter param is separated from flag by a space
+    with profile_phase(profile, "git_diff"):
+        diffs = [
+            _call_git_diff(git_diff_args, dir_name=dir_name, git_backend=git_backend)
+            for git_diff_args in git_diff_args_list
+        ]
 
-            if "R" in filter_values:
-                raise UnsupportedArgumentException("R diff filter is not supported")
+    tree = GitTree(revision, dir_name) if revision is not None else None
+    exists = tree.exists if tree is not None else os.path.exists
+    missing_deleted_files = set()
 
-            if extra_args_contains_diff_filter:
-                i += 1
-                continue
+    for _, deleted_files in diffs:
+        missing_deleted_files.update(f for f in deleted_files if not exists(f))
 
-        sanitized_args.append(v)
-        i += 1
+    with profile_phase(profile, "graph_building"):
+        import_graph = _create_import_graph(
+            missing_deleted_files,
+            python_path,
+            test_paths=test_paths,
+            dir_name=dir_name,
+            graph_cache=graph_cache,
+            workers=workers,
+            profile=profile,
+            graph_snapshot=graph_snapshot,
+            extra_deps=_to_absolute_path_extra_deps(extra_deps or [], dir_name),
+            git_backend=git_backend,
+            tree=tree,
+            parse_cache=parse_cache,
+        )
 
-    return sanitized_args + extra_git_diff_args
+    if profile is not None:
+        profile.count("nodes", import_graph.compact_graph.number_of_nodes())
+        profile.count("edges", import_graph.compact_graph.number_of_edges())
 
+    return import_graph, diffs
 
-def _to_absolute_path_extra_deps(extra_deps: List[Tuple[str, str]], base_dir_name: str):
-    extra_deps_absolute_paths = []
-
-    for u, v in extra_deps:
-        # Graph uses strings, not pathlib.Path so convert to strings before adding to graph
-        extra_deps_absolute_paths.append(
-            (
-                u if os.path.isabs(u) else str(to_absolute_path(base_dir_name, u)),
-                v if os.path.isabs(v) else str(to_absolute_path(base_dir_name, v)),
+
+def _find_changed_nodes(
+    import_graph: SelectorImportGraph,
+    git_diff_args: List[str],
+    diff_files: MutableSet[str],
+    deleted_files: MutableSet[str],
+    dir_name: str = ".",
+    profile: Optional[SelectionProfile] = None,
+    granularity: str = "file",
+    coverage_map: Optional[CoverageMap] = None,
+) -> Tuple[List[str], Dict[str, Optional[Set[str]]]]:
+    graph = import_graph.compact_graph
+
+    with profile_phase(profile, "changed_node_matching"):
+        changed_nodes = [path for path in diff_files if path in graph.ids]
+
+    hunks = None
+
+    if coverage_map is not None:
+        # The map only records the code each item ran. Code run when a module is imported is not attributed to any
+        # item so changes outside of top level functions are left to the import graph
+        known_files = coverage_map.known_files(changed_nodes)
+
+        if known_files:
+            hunks = _call_git_diff_hunks(git_diff_args, dir_name=dir_name)
+            sources = import_graph.read_sources(known_files)
+            changed_nodes = [
+                node
+                for node in changed_nodes
+                if node not in known_files
+                or not _only_functions_changed(node, hunks, deleted_files, sources)
+            ]
+
+    if granularity == "symbol":
+        with profile_phase(profile, "symbol_matching"):
+            if hunks is None:
+                hunks = _call_git_diff_hunks(git_diff_args, dir_name=dir_name)
+            changed_symbols = _find_changed_symbols(
+                changed_nodes,
+                hunks,
+                deleted_files,
+                import_graph.read_sources(changed_nodes),
             )
-        )
+            changed_nodes = _filter_changed_nodes_by_symbol(
+                import_graph, changed_symbols
+            )
+    else:
+        changed_symbols = {node: None for node in changed_nodes}
 
-    return extra_deps_absolute_paths
+    return changed_nodes, changed_symbols
 
 
-def _create_import_graph(
-    git_diff_args: List[str], python_path, test_paths: List[str], dir_name: str = "."
-) -> importlab.graph.ImportGraph:
-    deleted_files = _call_git_diff(
+def _select_tests_from_graph(
+    import_graph: SelectorImportGraph,
+    git_diff_args: List[str],
+    diff_files: MutableSet[str],
+    deleted_files: MutableSet[str],
+    dir_name: str = ".",
+    profile: Optional[SelectionProfile] = None,
+    granularity: str = "file",
+    coverage_map: Optional[CoverageMap] = None,
+) -> Selection:
+    graph = import_graph.compact_graph
+    changed_nodes, changed_symbols = _find_changed_nodes(
+        import_graph,
         git_diff_args,
-        ["--name-only", "--diff-filter=D", "--no-renames"],
+        diff_files,
+        deleted_files,
         dir_name=dir_name,
+        profile=profile,
+        granularity=granularity,
+        coverage_map=coverage_map,
+    )
+
+    with profile_phase(profile, "ancestor_traversal"):
+        distances = graph.ancestor_distances(graph.ids[path] for path in changed_nodes)
+        ancestor_nodes = set(distances)
+        root_ancestor_nodes = graph.roots(ancestor_nodes)
+
+    if profile is not None:
+        profile.count("diff_files", len(diff_files))
+        profile.count("deleted_files", len(deleted_files))
+        profile.count("changed_nodes", len(changed_nodes))
+        profile.count("selected_test_files", len(root_ancestor_nodes))
+
+    return Selection(
+        {graph.paths[node] for node in root_ancestor_nodes},
+        changed_symbols,
+        {graph.paths[node] for node in ancestor_nodes},
+        diff_files,
+        {graph.paths[node]: distance for node, distance in distances.items()},
     )
 
-    env = importlab.environment.Environment(
-        importlab.environment.path_from_pythonpath(":".join(python_path)),
-        sys.version_info[:2],
+
+def _call_git_diff(
+    user_git_diff_args: List[str], dir_name: str = ".", git_backend: str = "auto"
+) -> Tuple[MutableSet[str], MutableSet[str]]:
+    diff_files = set()
+    deleted_files = set()
+    backend = create_git_backend(git_backend, dir_name)
+
+    for status, relative_path in backend.diff_name_status(user_git_diff_args):
+        # Import graph is stated in absolute paths so need absolute paths for diffs also
+        path = canonical_path(os.path.join(dir_name, relative_path))
+        diff_files.add(path)
+
+        if status == "D":
+            deleted_files.add(path)
+
+    return diff_files, deleted_files
+
+
+def _call_git_diff_hunks(
+    user_git_diff_args: List[str], dir_name: str = "."
+) -> Dict[str, List[Hunk]]:
+    repo = git.Repo(dir_name)
+    # Fix the prefixes so they can be stripped regardless of the user's diff.noprefix or diff.mnemonicPrefix config
+    sanitized_args = sanitize_user_git_diff_args(
+        user_git_diff_args,
+        [
+            "-U0",
+            "--no-renames",
+            "--no-color",
+            "--no-ext-diff",
+            "--src-prefix=a/",
+            "--dst-prefix=b/",
+        ],
     )
-    test_filenames = importlab.utils.expand_source_files(test_paths)
 
-    # Restore the deleted files temporarily to resolve any import issues that may arise from deleting them
+    hunks = {}
+    file_hunks = None
+    in_hunk = False
+
+    git_diff_process = repo.git.diff(*sanitized_args, as_process=True)
+
+    for line in git_diff_process.stdout:
+        if line.startswith(b"diff --git "):
+            file_hunks = None
+            in_hunk = False
+        elif not in_hunk and line.startswith(b"+++ "):
+            # git ends the path with a tab when it contains a space. Paths ending with a tab are quoted instead
+            path = _unquote_git_path(line[4:].rstrip(b"\r\n").rstrip(b"\t"))
+
+            # Deleted files have no hunks in the new version
+            if path != "/dev/null":
+                path = canonical_path(os.path.join(dir_name, path[len("b/") :]))
+                file_hunks = hunks.setdefault(path, [])
+        elif line.startswith(b"@@ "):
+            in_hunk = True
+            match = _HUNK_HEADER.match(line)
+
+            if file_hunks is not None and match:
+                file_hunks.append((int(match[1]), int(match[2] or 1), []))
+        elif in_hunk and line.startswith(b"-") and file_hunks:
+            file_hunks[-1][2].append(line[1:].rstrip(b"\r\n").decode(errors="replace"))
+
+    git_diff_process.wait()  # Raises if git diff fails
+
+    return hunks
+
+
+def _unquote_git_path(path: bytes) -> str:
+    # git quotes paths containing unusual characters using C style escapes
+    if path.startswith(b'"') and path.endswith(b'"'):
+        path = codecs.escape_decode(path[1:-1])[0]
+    return os.fsdecode(path)
+
+
+def _find_changed_symbols(
+    changed_nodes: List[str],
+    hunks: Dict[str, List[Hunk]],
+    deleted_files: MutableSet[str],
+    sources: Dict[str, bytes],
+) -> Dict[str, Optional[Set[str]]]:
+    changed_symbols = {}
+
+    for node in changed_nodes:
+        if os.path.splitext(node)[1] != ".py" or node in deleted_files:
+            changed_symbols[node] = None
+            continue
+
+        changed_symbols[node] = symbols_changed_by_hunks(
+            _read_source(node, sources), hunks.get(node, [])
+        )
+
+    return changed_symbols
+
+
+def _only_functions_changed(
+    node: str,
+    hunks: Dict[str, List[Hunk]],
+    deleted_files: MutableSet[str],
+    sources: Dict[str, bytes],
+) -> bool:
+    if os.path.splitext(node)[1] != ".py" or node in deleted_files:
+        return False
+
+    return only_functions_changed_by_hunks(
+        _read_source(node, sources), hunks.get(node, [])
+    )
+
+
+def _read_source(node: str, sources: Dict[str, bytes]) -> bytes:
+    # sources are the contents of the files read from git. Other files are read from the working tree
+    if node in sources:
+        return sources[node]
+
+    with open(node, "rb") as f:
+        return f.read()
+
+
+def _filter_changed_nodes_by_symbol(
+    import_graph: SelectorImportGraph,
+    changed_symbols: Dict[str, Optional[Set[str]]],
+) -> List[str]:
+    # Replace each changed module whose changes are confined to top level functions and classes with the modules
+    # importing it that refer to the changed names. Only the first hop is filtered by name. Modules importing those
+    # modules are selected as if the whole module changed
+    graph = import_graph.compact_graph
+    nodes = []
+    imported = {}
+    predecessors_by_node = {
+        node: [graph.paths[pred] for pred in graph.predecessors(graph.ids[node])]
+        for node in changed_symbols
+    }
+    sources = import_graph.read_sources(
+        {pred for preds in predecessors_by_node.values() for pred in preds}
+    )
+
+    for node, symbols in changed_symbols.items():
+        predecessors = predecessors_by_node[node]
+
+        if symbols is None:
+            nodes.append(node)
+            continue
+
+        if not symbols:
+            # Only blank lines and comments changed
+            continue
+
+        if not predecessors:
+            # Changed test modules are selected themselves
+            nodes.append(node)
+            continue
+
+        for predecessor in predecessors:
+            if predecessor not in imported:
+                imported[predecessor] = imported_symbols(
+                    import_graph.env,
+                    predecessor,
+                    import_graph.provenance.get(predecessor),
+                    sources.get(predecessor),
+                )
+
+            # Dependencies from --extra-deps-file are not imports so they are never filtered
+            names = imported[predecessor].get(node)
+
+            if names is None or not names.isdisjoint(symbols):
+                nodes.append(predecessor)
+
+    return nodes
+
+
+def _to_absolute_path_extra_deps(extra_deps: List[Tuple[str, str]], base_dir_name: str):
+    # Canonical paths so the dependencies match the paths in the diff. Absolute paths are left as is by the join
+    return [
+        (
+            canonical_path(os.path.join(base_dir_name, u)),
+            canonical_path(os.path.join(base_dir_name, v)),
+        )
+        for u, v in extra_deps
+    ]
+
+
+def _create_import_graph(
+    deleted_files: MutableSet[str],
+    python_path,
+    test_paths: List[str],
+    dir_name: str = ".",
+    graph_cache: Union[str, GraphCache, None] = None,
+    workers: int = 1,
+    profile: Optional[SelectionProfile] = None,
+    graph_snapshot: Optional[str] = None,
+    extra_deps: Optional[List[Tuple[str, str]]] = None,
+    git_backend: str = "auto",
+    tree: Optional[GitTree] = None,
+    parse_cache: Union[str, ParseCache, None] = None,
+) -> SelectorImportGraph:
+    # Present the deleted files as empty files to resolve any import issues that may arise from deleting them
+    env = create_environment(python_path, frozenset(deleted_files), tree)
+
+    if tree is not None:
+        test_filenames = tree.expand_source_files(test_paths)
+    else:
+        test_filenames = importlab.utils.expand_source_files(test_paths)
+
+    if graph_snapshot and tree is not None:
+        # The blob SHAs of the tree are known so no file needs to be trusted
+        cache = GraphSnapshot.load(graph_snapshot, env)
+        cache.update(None)
+    elif graph_snapshot:
+        cache = _load_graph_snapshot(graph_snapshot, env, dir_name, git_backend)
+    elif isinstance(graph_cache, GraphCache):
+        cache = graph_cache
+    elif graph_cache:
+        cache = GraphCache.load(graph_cache, env)
+    else:
+        cache = None
+
+    if cache is not None and tree is not None:
+        cache.exists = tree.exists
+
+    if isinstance(parse_cache, str):
+        parse_cache_filename = parse_cache
+        parse_cache = ParseCache(parse_cache, python_version=env.python_version)
+    else:
+        parse_cache_filename = None
+
     try:
-        for deleted_file in deleted_files:
-            open(deleted_file, "w+").close()
+        import_graph = SelectorImportGraph.create(
+            env,
+            test_filenames,
+            True,
+            cache=cache,
+            workers=workers,
+            profile=profile,
+            extra_deps=extra_deps,
+            tree=tree,
+            parse_cache=parse_cache,
+        )
 
-        import_graph = importlab.graph.ImportGraph.create(env, test_filenames, True)
+        if parse_cache is not None:
+            parse_cache.save()
     finally:
-        for deleted_file in deleted_files:
-            os.remove(deleted_file)
+        # Caches passed in by the caller are left open
+        if parse_cache_filename is not None:
+            parse_cache.close()
+
+    if isinstance(cache, GraphSnapshot) and tree is not None:
+        # Entries that do not match the tree were saved at other commits
+        cache.tag(
+            tree.commit,
+            {
+                f
+                for f, entry in cache.files.items()
+                if tree.blob_shas.get(f) != entry["sha"]
+            },
+        )
+    elif isinstance(cache, GraphSnapshot):
+        _tag_graph_snapshot(cache, dir_name, git_backend)
+
+    if cache is not None:
+        cache.save()
+
+    return import_graph
+
 
+def _graph_artifact(
+    import_graph: SelectorImportGraph,
+    commit: Optional[str],
+    python_path: List[str],
+    test_paths: List[str],
+    extra_deps: List[Tuple[str, str]],
+    dirty_files: Iterable[str] = (),
+) -> GraphArtifact:
+    return GraphArtifact(
+        import_graph.compact_graph,
+        commit,
+        import_graph.env.python_version,
+        # Split the same way as create_environment
+        [canonical_path(p) for p in os.pathsep.join(python_path).split(os.pathsep)],
+        [canonical_path(p) for p in test_paths],
+        extra_deps,
+        {
+            path: encode_resolved_file(resolved_file)
+            for path, resolved_file in import_graph.provenance.items()
+        },
+        dirty_files=dirty_files,
+        unresolved_files=import_graph.broken_deps,
+        missing_files=import_graph.missing_files,
+    )
+
+
+def _update_graph_artifact(
+    artifact: GraphArtifact,
+    deleted_files: MutableSet[str],
+    dir_name: str = ".",
+    workers: int = 1,
+    profile: Optional[SelectionProfile] = None,
+    granularity: str = "file",
+    git_backend: str = "auto",
+    tree: Optional[GitTree] = None,
+    parse_cache: Union[str, ParseCache, None] = None,
+) -> SelectorImportGraph:
+    if artifact.python_version != sys.version_info[:2]:
+        raise InvalidGraphArtifactException(
+            "graph artifact was built with Python %d.%d" % artifact.python_version
+        )
+
+    revisions = [artifact.commit] if tree is None else [artifact.commit, tree.commit]
+    changed_files, changed_deleted_files = _call_git_diff(
+        revisions, dir_name, git_backend
+    )
+    exists = tree.exists if tree is not None else os.path.exists
+    missing_files = {
+        f
+        for f in deleted_files | changed_deleted_files | artifact.dirty_files
+        if not exists(f)
+    }
+    import_graph, _ = _apply_graph_artifact_changes(
+        artifact,
+        changed_files,
+        missing_files,
+        workers=workers,
+        profile=profile,
+        granularity=granularity,
+        tree=tree,
+        parse_cache=parse_cache,
+    )
     return import_graph
 
 
-def _find_root_ancestors(
-    graph: networkx.DiGraph, node: str, root_ancestors: set
+def _apply_graph_artifact_changes(
+    artifact: GraphArtifact,
+    changed_files: MutableSet[str],
+    missing_files: MutableSet[str],
+    workers: int = 1,
+    profile: Optional[SelectionProfile] = None,
+    granularity: str = "file",
+    tree: Optional[GitTree] = None,
+    parse_cache: Union[str, ParseCache, None] = None,
+) -> Tuple[SelectorImportGraph, MutableSet[str]]:
+    # Import graph of the artifact with the imports of changed_files, and of the files they may affect, resolved again
+    # along with the files that were resolved. missing_files do not exist and are presented as empty files so the files
+    # importing them keep their edges
+    graph = artifact.graph
+    env = create_environment(artifact.python_path, frozenset(missing_files), tree)
+
+    if tree is not None:
+        test_filenames = tree.expand_source_files(artifact.test_paths)
+    else:
+        test_filenames = importlab.utils.expand_source_files(artifact.test_paths)
+
+    # Files resolved when the artifact was built are resolved again from where they were reached. Files only found in
+    # the extra dependencies were never resolved
+    stale_files = {
+        f
+        for f in changed_files | artifact.dirty_files | artifact.unresolved_files
+        if f in artifact.provenance
+    }
+    # Files added since the commit where an import was looked up before it was found, e.g. a module shadowing a name
+    # defined in its package, change what the import resolves to
+    stale_files.update(
+        f
+        for f in artifact.files_looking_up(changed_files - missing_files)
+        if f in artifact.provenance
+    )
+    new_test_filenames = [f for f in test_filenames if f not in graph.ids]
+
+    if isinstance(parse_cache, str):
+        parse_cache_filename = parse_cache
+        parse_cache = ParseCache(parse_cache, python_version=env.python_version)
+    else:
+        parse_cache_filename = None
+
+    import_graph = SelectorImportGraph(
+        env, workers=workers, profile=profile, tree=tree, parse_cache=parse_cache
+    )
+    import_graph.known_files = graph.ids
+
+    for f in stale_files:
+        import_graph.provenance[f] = decode_resolved_file(artifact.provenance[f])
+
+    try:
+        import_graph.add_files_recursive(sorted(stale_files) + new_test_filenames, True)
+
+        if parse_cache is not None:
+            parse_cache.save()
+    finally:
+        if parse_cache_filename is not None:
+            parse_cache.close()
+
+    provenance = import_graph.provenance
+    import_graph.build()
+    delta = import_graph.compact_graph
+    # delta holds the files resolved again and the files first reached from them
+    resolved = stale_files | {path for path in delta.paths if path not in graph.ids}
+    import_graph.compact_graph = _merge_graph_artifact(
+        artifact, delta, resolved, missing_files, test_filenames
+    )
+
+    if granularity == "symbol":
+        # Symbols imported by the files importing a changed file are looked up from where the files were reached
+        import_graph.provenance = {
+            path: decode_resolved_file(resolved_import)
+            for path, resolved_import in artifact.provenance.items()
+        }
+        import_graph.provenance.update(provenance)
+
+    return import_graph, resolved
+
+
+def _advance_graph_artifact(
+    artifact: GraphArtifact,
+    import_graph: SelectorImportGraph,
+    resolved: MutableSet[str],
+) -> GraphArtifact:
+    # Artifact holding the graph returned by _apply_graph_artifact_changes so later changes can be applied to it, e.g.
+    # by the daemon which keeps the graph in memory instead of saving it
+    graph = import_graph.compact_graph
+    provenance = dict(artifact.provenance)
+    provenance.update(
+        (path, encode_resolved_file(resolved_file))
+        for path, resolved_file in import_graph.provenance.items()
+    )
+    missing_files = {
+        path: files
+        for path, files in artifact.missing_files.items()
+        if path not in resolved
+    }
+    missing_files.update(import_graph.missing_files)
+    unresolved_files = (artifact.unresolved_files - resolved) | set(
+        import_graph.broken_deps
+    )
+
+    return GraphArtifact(
+        graph,
+        artifact.commit,
+        artifact.python_version,
+        artifact.python_path,
+        artifact.test_paths,
+        artifact.extra_deps,
+        {path: p for path, p in provenance.items() if path in graph.ids},
+        dirty_files=artifact.dirty_files,
+        unresolved_files=[f for f in unresolved_files if f in graph.ids],
+        missing_files={
+            path: files for path, files in missing_files.items() if path in graph.ids
+        },
+    )
+
+
+def _import_graph_from_artifact(
+    artifact: GraphArtifact, missing_files: MutableSet[str], granularity: str = "file"
+) -> SelectorImportGraph:
+    # Import graph of the artifact as it is. Selecting by symbol looks up the imports of the files importing a changed
+    # file from where they were reached
+    import_graph = SelectorImportGraph(
+        create_environment(artifact.python_path, frozenset(missing_files))
+    )
+    import_graph.compact_graph = artifact.graph
+    import_graph.final = True
+
+    if granularity == "symbol":
+        import_graph.provenance = {
+            path: decode_resolved_file(resolved_import)
+            for path, resolved_import in artifact.provenance.items()
+        }
+
+    return import_graph
+
+
+def _merge_graph_artifact(
+    artifact: GraphArtifact,
+    delta: CompactGraph,
+    resolved: MutableSet[str],
+    missing_files: MutableSet[str],
+    test_filenames: List[str],
+) -> CompactGraph:
+    # The imports of the resolved files of delta replace the imports recorded in the artifact. Other files of delta are
+    # only imported by them and keep the imports of the artifact
+    graph = artifact.graph
+    successors = {
+        path: (
+            {delta.paths[succ] for succ in delta.successors(delta.ids[path])}
+            if path in delta.ids
+            else set()
+        )
+        for path in resolved
+    }
+
+    for u, v in artifact.extra_deps:
+        if u in successors:
+            successors[u].add(v)
+
+    changed = any(
+        path not in graph.ids
+        or successors[path]
+        != {graph.paths[succ] for succ in graph.successors(graph.ids[path])}
+        for path in resolved
+    )
+
+    if not changed and not any(path in graph.ids for path in missing_files):
+        return graph
+
+    builder = CompactGraphBuilder()
+
+    for node, path in enumerate(graph.paths):
+        builder.add_node(path)
+
+        if path not in successors:
+            for succ in graph.successors(node):
+                builder.add_edge(path, graph.paths[succ])
+
+    for path, succs in successors.items():
+        builder.add_node(path)
+
+        for succ in succs:
+            builder.add_edge(path, succ)
+
+    result = builder.build()
+    # Files that no test file or extra dependency reaches anymore, e.g. deleted files or modules whose last importer
+    # was deleted or dropped the import, are left out the same as a graph built from the working tree. Nothing imports
+    # them so they would be selected as test files otherwise
+    roots = set(test_filenames)
+    roots.update(u for u, _ in artifact.extra_deps)
+    reachable = result.descendants(
+        result.ids[path] for path in roots if path in result.ids
+    )
+
+    if len(reachable) == result.number_of_nodes():
+        return result
+
+    for node, path in enumerate(result.paths):
+        if node not in reachable:
+            builder.remove_node(path)
+
+    return builder.build()
+
+
+def _load_graph_snapshot(
+    filename: str,
+    env: importlab.environment.Environment,
+    dir_name: str = ".",
+    git_backend: str = "auto",
+) -> GraphSnapshot:
+    snapshot = GraphSnapshot.load(filename, env)
+
+    if snapshot.commit is None:
+        snapshot.update(None)
+        return snapshot
+
+    try:
+        changed_files, deleted_files = _call_git_diff(
+            [snapshot.commit], dir_name, git_backend
+        )
+    except git.GitCommandError:
+        # The commit may not exist in this clone. Entries are still checked against their blob SHA
+        snapshot.update(None)
+        return snapshot
+
+    snapshot.update(changed_files, deleted_files=deleted_files)
+    return snapshot
+
+
+def _tag_graph_snapshot(
+    snapshot: GraphSnapshot, dir_name: str = ".", git_backend: str = "auto"
 ) -> None:
-    predecessors = list(graph.predecessors(node))
+    repo = git.Repo(dir_name)
 
-    if not predecessors:
-        root_ancestors.add(node)
+    try:
+        commit = repo.head.commit.hexsha
+    except ValueError:
+        # No commits yet
+        snapshot.tag(None, set(snapshot.files))
         return
 
-    for predecessor in predecessors:
-        _find_root_ancestors(graph, predecessor, root_ancestors)
+    snapshot.tag(commit, set(snapshot.files) - _clean_files(dir_name, git_backend))
+
+
+def _clean_files(dir_name: str = ".", git_backend: str = "auto") -> MutableSet[str]:
+    # Files tracked by git whose contents in the working tree match HEAD
+    changed_files, _ = _call_git_diff(["HEAD"], dir_name, git_backend)
+    tracked_files = create_git_backend(git_backend, dir_name).tracked_files()
+    return (
+        set(canonical_path(os.path.join(dir_name, f)) for f in tracked_files)
+        - changed_files
+    )
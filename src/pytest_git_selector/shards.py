@@ -0,0 +1,93 @@
+import heapq
+import json
+import os
+
+from typing import Dict, Iterable, List, Optional
+
+from pytest_git_selector.errors import UnsupportedArgumentException
+from pytest_git_selector.util import canonical_path
+
+# Key of the pytest cache entry holding the duration of each test file in seconds by path relative to the rootdir
+DURATIONS_CACHE_KEY = "git_selector/durations"
+# Key of the pytest cache entry holding the duration of each test item in seconds by node ID
+ITEM_DURATIONS_CACHE_KEY = "git_selector/item_durations"
+
+
+def shard_test_files(
+    test_files: Iterable[str],
+    shards: int,
+    shard_index: int,
+    durations: Optional[Dict[str, float]] = None,
+) -> List[str]:
+    """
+    Test files assigned to one of a number of shards balanced by the expected duration of each file.
+
+    Files are assigned longest first to the shard with the least total duration so far. The duration of files
+    without a recorded duration is estimated from their size at the average duration per byte of the files with one,
+    or is the size itself if no file has a recorded duration. Every shard computes the same assignment given the same
+    test files and durations.
+    """
+    test_files = sorted(set(test_files))
+    durations = durations or {}
+    sizes = {f: _file_size(f) for f in test_files if f not in durations}
+    known = [f for f in test_files if f in durations]
+    known_size = sum(_file_size(f) for f in known)
+
+    if known and known_size:
+        seconds_per_byte = sum(durations[f] for f in known) / known_size
+    else:
+        seconds_per_byte = 1.0
+
+    weights = {
+        f: durations[f] if f in durations else sizes[f] * seconds_per_byte
+        for f in test_files
+    }
+    loads = [(0.0, i) for i in range(shards)]
+    assigned: List[List[str]] = [[] for _ in range(shards)]
+
+    for f in sorted(test_files, key=lambda f: -weights[f]):
+        load, i = heapq.heappop(loads)
+        assigned[i].append(f)
+        heapq.heappush(loads, (load + weights[f], i))
+
+    return sorted(assigned[shard_index])
+
+
+def absolute_durations(durations: Dict[str, float], root: str) -> Dict[str, float]:
+    return {
+        canonical_path(os.path.join(root, f)): duration
+        for f, duration in durations.items()
+        if isinstance(duration, (int, float))
+    }
+
+
+def load_durations(cache_dir: str, root: str) -> Dict[str, float]:
+    # Reads the durations recorded by the pytest plugin without pytest. Missing or corrupt entries are ignored
+    try:
+        with open(os.path.join(cache_dir, "v", *DURATIONS_CACHE_KEY.split("/"))) as f:
+            durations = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(durations, dict):
+        return {}
+
+    return absolute_durations(durations, root)
+
+
+def validate_shard_args(shards: Optional[int], shard_index: int) -> None:
+    if shards is None:
+        return
+    if shards < 1:
+        raise UnsupportedArgumentException("--shards must be at least 1")
+    if not 0 <= shard_index < shards:
+        raise UnsupportedArgumentException(
+            f"--shard-index must be between 0 and {shards - 1}"
+        )
+
+
+def _file_size(filename: str) -> int:
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
@@ -0,0 +1,212 @@
+import ast
+import os
+import re
+
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+import importlab.environment
+import importlab.parsepy
+import importlab.resolve
+
+from pytest_git_selector.fs import get_imports
+
+# (first line, number of lines, removed lines) of a hunk of `git diff -U0` in the new version of a file
+Hunk = Tuple[int, int, List[str]]
+
+_DEFINITION_HEADER = re.compile(r"(?:async\s+)?(?:def|class)\s+(\w+)")
+
+
+def symbols_changed_by_hunks(
+    source: Union[str, bytes], hunks: List[Hunk]
+) -> Optional[Set[str]]:
+    """
+    Names of the top level functions and classes of a module affected by the hunks of a diff.
+
+    A function or class is affected if one of its lines changed or it refers to another affected function or class of
+    the same module. Returns None when the whole module has to be treated as changed e.g. a change to a module level
+    statement or a function that was removed.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+
+    # Line range and referenced names of each top level function and class
+    symbols: Dict[str, Tuple[int, int, Set[str]]] = {}
+    # Line ranges and referenced names of all other module level statements
+    statements: List[Tuple[int, int, Set[str]]] = []
+
+    for node in tree.body:
+        start = min([node.lineno] + [d.lineno for d in _decorators(node)])
+
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            statements.append((start, node.end_lineno, _referenced_names(node)))
+        elif node.name in symbols:
+            # Redefined names depend on the order of the definitions
+            return None
+        else:
+            symbols[node.name] = start, node.end_lineno, _referenced_names(node)
+
+    def find_symbol(line: int) -> Optional[str]:
+        for name, (start, end, _) in symbols.items():
+            if start <= line <= end:
+                return name
+        return None
+
+    def in_statement(line: int) -> bool:
+        return any(start <= line <= end for start, end, _ in statements)
+
+    changed = set()
+
+    for start, count, removed in hunks:
+        lines = range(start, start + count)
+
+        if any(in_statement(line) for line in lines):
+            return None
+
+        changed.update(s for s in map(find_symbol, lines) if s is not None)
+        removed_code = [line for line in removed if _is_code(line)]
+
+        if not removed_code:
+            continue
+
+        # Indented removed code belongs to the functions and classes the hunk is in. Hunks that only remove lines sit
+        # between lines start and start + 1
+        if not lines and (in_statement(start) or in_statement(start + 1)):
+            return None
+
+        hunk_symbols = set(map(find_symbol, lines or [start, start + 1]))
+        hunk_symbols.discard(None)
+
+        if not hunk_symbols:
+            return None
+
+        for line in removed_code:
+            if line[0].isspace() or line.startswith("@"):
+                continue
+
+            # Unindented code is the header of a function or class. Removing or renaming one changes the module
+            match = _DEFINITION_HEADER.match(line)
+
+            if match is None or match.group(1) not in symbols:
+                return None
+
+            changed.add(match.group(1))
+
+        changed.update(hunk_symbols)
+
+    # Functions and classes referring to changed ones are changed too
+    while True:
+        affected = {
+            name
+            for name, (_, _, names) in symbols.items()
+            if name not in changed and not names.isdisjoint(changed)
+        }
+
+        if not affected:
+            break
+
+        changed.update(affected)
+
+    if any(not names.isdisjoint(changed) for _, _, names in statements):
+        return None
+
+    return changed
+
+
+def only_functions_changed_by_hunks(
+    source: Union[str, bytes], hunks: List[Hunk]
+) -> bool:
+    """
+    Whether the hunks of a diff only affect top level functions of a module.
+
+    Unlike module level statements and class bodies, which run when the module is imported, the code of a function
+    only runs when it is called.
+    """
+    symbols = symbols_changed_by_hunks(source, hunks)
+
+    if symbols is None:
+        return False
+
+    # symbols_changed_by_hunks parsed the source already
+    functions = {
+        node.name
+        for node in ast.parse(source).body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    }
+    return symbols <= functions
+
+
+def imported_symbols(
+    env: importlab.environment.Environment,
+    filename: str,
+    parent: Optional[importlab.resolve.ResolvedFile],
+    source: Optional[bytes] = None,
+) -> Dict[str, Optional[Set[str]]]:
+    """
+    Names imported by a module from each file it imports by path of the file.
+
+    The names are None for files imported as a whole e.g. `import x` or `from x import *`. Source is parsed instead of
+    reading filename when it is given.
+    """
+    imported = {}
+    resolver = importlab.resolve.Resolver(env.path, parent)
+
+    try:
+        imports = get_imports(filename, env.python_version, source)
+    except importlab.parsepy.ParseError:
+        return imported
+
+    for imp in imports:
+        try:
+            f = resolver.resolve_import(imp)
+        except importlab.resolve.ImportException:
+            continue
+
+        if f.path is None:
+            continue
+
+        name = _imported_name(imp, f.module_name)
+        path = os.path.abspath(f.path)
+
+        if name is None:
+            imported[path] = None
+        elif path not in imported:
+            imported[path] = {name}
+        elif imported[path] is not None:
+            imported[path].add(name)
+
+    return imported
+
+
+def _imported_name(
+    imp: importlab.parsepy.ImportStatement, module_name: str
+) -> Optional[str]:
+    # Name imported by a from import or None if the module itself is imported
+    if not imp.is_from or imp.is_star or imp.name == module_name:
+        return None
+
+    parent, _, imported_name = imp.name.rpartition(".")
+
+    if parent == module_name:
+        return imported_name
+
+    # Relative imports are not qualified by the package. A name matching the module is assumed to be the module
+    if parent.startswith(".") or not parent:
+        if module_name.rpartition(".")[2] != imported_name:
+            return imported_name
+
+    return None
+
+
+def _decorators(node: ast.stmt) -> List[ast.expr]:
+    return getattr(node, "decorator_list", [])
+
+
+def _referenced_names(node: ast.AST) -> Set[str]:
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+
+
+def _is_code(line: str) -> bool:
+    stripped = line.strip()
+    return bool(stripped) and not stripped.startswith("#")
@@ -1,6 +1,15 @@
+import functools
 import pathlib
 import os
-from typing import List, Tuple
+from typing import Iterable, List, Tuple
+
+# Granularities of test selection supported by the selector. Kept here so the command line and the pytest plugin can
+# list them without importing the selector
+GRANULARITIES = ("file", "symbol")
+GIT_BACKENDS = ("auto", "native", "subprocess")
+DEFAULT_PARSE_CACHE_MAX_SIZE_MB = 100
+# Maximum number of parameters of a single SQLite query
+SQLITE_QUERY_CHUNK_SIZE = 500
 
 
 def parse_extra_deps_file(extra_deps_filename) -> List[Tuple[str, str]]:
@@ -14,6 +23,45 @@ def parse_extra_deps_file(extra_deps_filename) -> List[Tuple[str, str]]:
 
 
 def to_absolute_path(base_dir_name: str, relative_path: str) -> pathlib.Path:
-    if not os.path.isabs(base_dir_name):
-        base_dir_name = os.path.join(os.getcwd(), base_dir_name)
-    return pathlib.Path(os.path.join(base_dir_name, relative_path)).resolve()
+    return pathlib.Path(canonical_path(os.path.join(base_dir_name, relative_path)))
+
+
+def canonical_path(path: str) -> str:
+    """
+    Absolute path with all symbolic links resolved, the same as pathlib.Path(path).resolve() but as a string.
+
+    Resolved directories are cached so resolving many files in the same directories only checks whether the last
+    component of each path is a symbolic link. Call clear_canonical_path_cache() if symbolic links may have changed.
+    """
+    if not os.path.isabs(path):
+        path = os.path.join(os.getcwd(), path)
+    return _canonical_absolute_path(path)
+
+
+@functools.lru_cache(maxsize=65536)
+def _canonical_absolute_path(path: str) -> str:
+    parent, name = os.path.split(path)
+
+    # The root directory and paths with components that depend on the components before them being resolved first
+    if parent == path or name in ("", ".", ".."):
+        return os.path.realpath(path)
+
+    path = os.path.join(_canonical_absolute_path(parent), name)
+
+    if os.path.islink(path):
+        return os.path.realpath(path)
+
+    return path
+
+
+def clear_canonical_path_cache() -> None:
+    _canonical_absolute_path.cache_clear()
+
+
+def sqlite_chunks(values: List[str]) -> Iterable[List[str]]:
+    for i in range(0, len(values), SQLITE_QUERY_CHUNK_SIZE):
+        yield values[i : i + SQLITE_QUERY_CHUNK_SIZE]
+
+
+def sqlite_placeholders(values: List[str]) -> str:
+    return ", ".join("?" * len(values))
@@ -374,3 +374,69 @@ def complex_workflow_b_medium_project_a(project_root_dir):
 def complex_workflow_b_medium_project_a_feature_1(project_root_dir):
     complex_workflow_b_medium_project_a(project_root_dir)
     git.Repo(project_root_dir).git.checkout("feature-1")
+
+
+def add_b_shadowing_pkg_small_project_a(project_root_dir):
+    # pkg/b.py shadows the name b defined in pkg/__init__.py so test_b.py imports it instead
+    repo = git.Repo(project_root_dir)
+
+    with open(os.path.join(project_root_dir, "pkg", "b.py"), "w") as f:
+        f.write("b = 2\n")
+
+    repo.git.add(".")
+    repo.git.commit("-m", "Add pkg/b.py")
+
+    with open(os.path.join(project_root_dir, "pkg", "b.py"), "a") as f:
+        f.write("c = 3\n")
+
+
+def add_pkg_small_project_a(project_root_dir):
+    os.makedirs(os.path.join(project_root_dir, "pkg"))
+
+    with open(os.path.join(project_root_dir, "pkg", "__init__.py"), "w") as f:
+        f.write("b = 1\n")
+
+    with open(os.path.join(project_root_dir, "test", "test_b.py"), "w") as f:
+        f.write("from pkg import b\n")
+
+    repo = git.Repo(project_root_dir)
+    repo.git.add(".")
+    repo.git.commit("-m", "Add pkg and test_b.py")
+
+
+def add_k_importing_h_small_project_a(project_root_dir):
+    # h.py is only imported by k.py which is imported by test_k.py
+    for path, contents in [
+        (("small_project_a", "h.py"), "pass\n"),
+        (("small_project_a", "k.py"), "import small_project_a.h\n"),
+        (("test", "test_k.py"), "import small_project_a.k\n"),
+    ]:
+        with open(os.path.join(project_root_dir, *path), "w") as f:
+            f.write(contents)
+
+    repo = git.Repo(project_root_dir)
+    repo.git.add(".")
+    repo.git.commit("-m", "Add h.py, k.py and test_k.py")
+
+
+def delete_k_and_modify_h_small_project_a(project_root_dir):
+    repo = git.Repo(project_root_dir)
+    repo.git.rm(os.path.join(project_root_dir, "small_project_a", "k.py"))
+
+    with open(os.path.join(project_root_dir, "test", "test_k.py"), "w") as f:
+        f.write("pass\n")
+
+    with open(os.path.join(project_root_dir, "small_project_a", "h.py"), "a") as f:
+        f.write("# modify h.py\n")
+
+    repo.git.add(".")
+    repo.git.commit("-m", "Delete k.py and modify h.py")
+
+
+def drop_h_import_and_modify_h_small_project_a(project_root_dir):
+    # Left uncommitted in the working tree
+    with open(os.path.join(project_root_dir, "small_project_a", "k.py"), "w") as f:
+        f.write("pass\n")
+
+    with open(os.path.join(project_root_dir, "small_project_a", "h.py"), "a") as f:
+        f.write("# modify h.py\n")
@@ -1,10 +1,14 @@
 import contextlib
+import git
 import io
+import json
 import os
 import pytest
 import pytest_git_selector.cmd
 import sys
 
+from pytest_git_selector.parse_cache import ParseCache
+
 from conftest import (
     complex_workflow_a_medium_project_a,
     modify_f_small_project_a,
@@ -244,3 +248,312 @@ def _build_command(
         + extra_deps_file_arg
         + git_diff_args_w_delimiter
     )
+
+
+@pytest.mark.parametrize("trace_memory", [False, True])
+def test_command_line_selector_profile(
+    small_project_a, tmp_path, monkeypatch, trace_memory
+):
+    modify_f_small_project_a(small_project_a)
+    monkeypatch.chdir(small_project_a)
+    profile_file = tmp_path / "profile.json"
+
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "git-select-tests",
+            "--test-path",
+            "test",
+            "--src-path",
+            ".",
+            "--selector-profile",
+            str(profile_file),
+            *(["--selector-profile-memory"] if trace_memory else []),
+            "--",
+            "HEAD~1...",
+        ],
+    )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert pytest_git_selector.cmd.main() == 0
+
+    profile = json.loads(profile_file.read_text())
+
+    assert set(profile["phases"]) == {
+        "git_diff",
+        "import_parsing",
+        "graph_building",
+        "changed_node_matching",
+        "ancestor_traversal",
+    }
+    assert profile["counts"]["diff_files"] == 1
+    assert profile["counts"]["selected_test_files"] == 2
+    assert profile["counts"]["nodes"] >= 4
+    assert all(
+        ("peak_memory" in phase) == trace_memory for phase in profile["phases"].values()
+    )
+
+
+def test_command_line_shards(small_project_a, monkeypatch):
+    modify_f_small_project_a(small_project_a)
+    monkeypatch.chdir(small_project_a)
+    shards = []
+
+    for shard_index in (0, 1):
+        monkeypatch.setattr(
+            sys,
+            "argv",
+            [
+                "git-select-tests",
+                "--test-path",
+                "test",
+                "--src-path",
+                ".",
+                "--shards",
+                "2",
+                "--shard-index",
+                str(shard_index),
+                "--",
+                "HEAD~1...",
+            ],
+        )
+        stdout = io.StringIO()
+
+        with contextlib.redirect_stdout(stdout):
+            assert pytest_git_selector.cmd.main() == 0
+
+        shards.append(stdout.getvalue().split())
+
+    assert [len(shard) for shard in shards] == [1, 1]
+    assert sorted(shards[0] + shards[1]) == [
+        os.path.join(small_project_a, "test", "test_f.py"),
+        os.path.join(small_project_a, "test", "test_g.py"),
+    ]
+
+
+@pytest.mark.parametrize("from_stdin", [False, True])
+def test_command_line_batch(small_project_a, tmp_path, monkeypatch, from_stdin):
+    modify_f_small_project_a(small_project_a)
+    monkeypatch.chdir(small_project_a)
+    specs = (
+        "# Comments and blank lines are skipped\nHEAD~1...\n\nHEAD --diff-filter=D\n"
+    )
+
+    if from_stdin:
+        monkeypatch.setattr(sys, "stdin", io.StringIO(specs))
+        batch = "-"
+    else:
+        batch = tmp_path / "specs.txt"
+        batch.write_text(specs)
+
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "git-select-tests",
+            "--test-path",
+            "test",
+            "--src-path",
+            ".",
+            "--batch",
+            str(batch),
+        ],
+    )
+    stdout = io.StringIO()
+
+    with contextlib.redirect_stdout(stdout):
+        assert pytest_git_selector.cmd.main() == 0
+
+    assert json.loads(stdout.getvalue()) == {
+        "HEAD~1...": [
+            os.path.join(small_project_a, "test", "test_f.py"),
+            os.path.join(small_project_a, "test", "test_g.py"),
+        ],
+        "HEAD --diff-filter=D": [],
+    }
+
+
+def test_command_line_batch_with_git_diff_args(small_project_a, tmp_path, monkeypatch):
+    monkeypatch.chdir(small_project_a)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["git-select-tests", "--batch", str(tmp_path / "specs.txt"), "--", "HEAD"],
+    )
+
+    with pytest.raises(SystemExit):
+        pytest_git_selector.cmd.main()
+
+
+@pytest.mark.parametrize(
+    ("output_format", "expected"),
+    [
+        ("lines", "{root}/test/test_f.py\n{root}/test/test_g.py\n"),
+        ("nul", "{root}/test/test_f.py\0{root}/test/test_g.py\0"),
+        (
+            "jsonl",
+            '{{"path": "{root}/test/test_f.py", "nodeid": "test/test_f.py"}}\n'
+            '{{"path": "{root}/test/test_g.py", "nodeid": "test/test_g.py"}}\n',
+        ),
+        ("relative", "test_f.py\ntest_g.py\n"),
+        ("nodeid", "test/test_f.py\ntest/test_g.py\n"),
+    ],
+)
+def test_command_line_format(small_project_a, monkeypatch, output_format, expected):
+    modify_f_small_project_a(small_project_a)
+    monkeypatch.chdir(os.path.join(small_project_a, "test"))
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "git-select-tests",
+            "--dir",
+            "..",
+            "--test-path",
+            ".",
+            "--src-path",
+            "..",
+            "--format",
+            output_format,
+            "--",
+            "HEAD~1...",
+        ],
+    )
+    stdout = io.StringIO()
+
+    with contextlib.redirect_stdout(stdout):
+        assert pytest_git_selector.cmd.main() == 0
+
+    separator = "\0" if output_format == "nul" else "\n"
+    records = stdout.getvalue().split(separator)
+
+    assert records[-1] == ""
+    assert sorted(records) == sorted(
+        expected.format(root=small_project_a).split(separator)
+    )
+
+
+def test_command_line_revision(small_project_a, tmp_path, monkeypatch):
+    modify_f_small_project_a(small_project_a)
+    bare_repo = str(tmp_path / "bare.git")
+    git.Repo(small_project_a).git.clone("--bare", small_project_a, bare_repo)
+    monkeypatch.chdir(bare_repo)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "git-select-tests",
+            "--test-path",
+            "test",
+            "--src-path",
+            ".",
+            "--revision",
+            "HEAD",
+            "--format",
+            "nodeid",
+            "--",
+            "HEAD~1",
+            "HEAD",
+        ],
+    )
+    stdout = io.StringIO()
+
+    with contextlib.redirect_stdout(stdout):
+        assert pytest_git_selector.cmd.main() == 0
+
+    assert sorted(stdout.getvalue().split()) == ["test/test_f.py", "test/test_g.py"]
+
+
+def test_command_line_build_graph_load_graph(small_project_a, tmp_path, monkeypatch):
+    monkeypatch.chdir(small_project_a)
+    artifact = str(tmp_path / "graph.artifact")
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "git-select-tests",
+            "build-graph",
+            "--output",
+            artifact,
+            "--test-path",
+            "test",
+            "--src-path",
+            ".",
+        ],
+    )
+
+    assert pytest_git_selector.cmd.main() == 0
+
+    modify_f_small_project_a(small_project_a)
+    load_graph_argv = [
+        "git-select-tests",
+        "load-graph",
+        "--graph",
+        artifact,
+        "--format",
+        "nodeid",
+        "--",
+        "HEAD~1",
+    ]
+    monkeypatch.setattr(sys, "argv", list(load_graph_argv))
+    stdout = io.StringIO()
+
+    with contextlib.redirect_stdout(stdout):
+        assert pytest_git_selector.cmd.main() == 0
+
+    assert sorted(stdout.getvalue().split()) == ["test/test_f.py", "test/test_g.py"]
+
+    # Artifacts that cannot be loaded fail so the caller can select tests without it
+    with open(artifact, "wb") as f:
+        f.write(b"not a graph artifact")
+
+    monkeypatch.setattr(sys, "argv", list(load_graph_argv))
+    assert pytest_git_selector.cmd.main() == 1
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["--test-path", "test", "--src-path", ".", "--", "HEAD~1"],
+        ["--test-path", "test", "--src-path", ".", "--shards", "2", "--", "HEAD~1"],
+        ["--test-path", "test", "--src-path", ".", "--batch", "-"],
+        ["build-graph", "--test-path", "test", "--src-path", ".", "--output", "a"],
+        ["load-graph", "--graph", "a", "--", "HEAD~1"],
+    ],
+)
+def test_command_line_parse_cache_closed(small_project_a, tmp_path, monkeypatch, argv):
+    modify_f_small_project_a(small_project_a)
+    monkeypatch.chdir(small_project_a)
+    monkeypatch.setattr(sys, "stdin", io.StringIO("HEAD~1\n"))
+    argv = [arg if arg != "a" else str(tmp_path / "graph.artifact") for arg in argv]
+    parse_cache = ["--parse-cache", str(tmp_path / "parse-cache.sqlite")]
+    opened = []
+    closed = []
+    init = ParseCache.__init__
+    close = ParseCache.close
+
+    def track_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        opened.append(self)
+
+    def track_close(self):
+        close(self)
+        closed.append(self)
+
+    monkeypatch.setattr(ParseCache, "__init__", track_init)
+    monkeypatch.setattr(ParseCache, "close", track_close)
+    # The artifact loaded by load-graph does not exist so selection fails after the cache is opened
+    end = argv.index("--") if "--" in argv else len(argv)
+    monkeypatch.setattr(
+        sys, "argv", ["git-select-tests", *argv[:end], *parse_cache, *argv[end:]]
+    )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            pytest_git_selector.cmd.main()
+        except FileNotFoundError:
+            pass
+
+    assert opened
+    assert closed == opened
@@ -0,0 +1,119 @@
+import sys
+
+from pytest_git_selector.compact_graph import CompactGraph, CompactGraphBuilder
+
+
+def _root_ancestors(graph, paths):
+    roots = graph.root_ancestors(graph.ids[p] for p in paths)
+    return {graph.paths[node] for node in roots}
+
+
+def test_root_ancestors_deep_diamonds():
+    # Stack of diamonds deeper than the recursion limit with a changed node at the bottom
+    depth = sys.getrecursionlimit() + 1
+    edges = []
+
+    for layer in range(depth):
+        edges.append((f"{layer}", f"{layer}_a"))
+        edges.append((f"{layer}", f"{layer}_b"))
+        edges.append((f"{layer}_a", f"{layer + 1}"))
+        edges.append((f"{layer}_b", f"{layer + 1}"))
+
+    edges.append(("test_a.py", "1_a"))
+    # Self edge without any predecessors outside of it
+    edges.append(("test_b.py", "test_b.py"))
+    graph = CompactGraph.from_edges(edges)
+
+    assert _root_ancestors(graph, [f"{depth}", "1"]) == {"0", "test_a.py"}
+    assert _root_ancestors(graph, ["test_b.py"]) == set()
+    assert _root_ancestors(graph, []) == set()
+
+
+def test_root_ancestors_cycles():
+    graph = CompactGraph.from_edges(
+        [
+            ("test_a.py", "a.py"),
+            ("a.py", "b.py"),
+            ("b.py", "a.py"),
+            ("test_b.py", "test_c.py"),
+            ("test_c.py", "test_b.py"),
+            ("test_c.py", "b.py"),
+            ("c.py", "d.py"),
+            ("d.py", "c.py"),
+        ]
+    )
+
+    # Cycles imported from outside of the cycle are not roots
+    assert _root_ancestors(graph, ["a.py"]) == {"test_a.py", "test_b.py", "test_c.py"}
+    # Cycles without any predecessors outside of the cycle are roots as a whole
+    assert _root_ancestors(graph, ["test_b.py"]) == {"test_b.py", "test_c.py"}
+    assert _root_ancestors(graph, ["d.py"]) == {"c.py", "d.py"}
+
+
+def test_iter_root_ancestors_yields_roots_outside_of_cycles_first():
+    graph = CompactGraph.from_edges(
+        [
+            ("test_a.py", "a.py"),
+            ("test_b.py", "test_c.py"),
+            ("test_c.py", "test_b.py"),
+            ("test_c.py", "a.py"),
+            ("test_d.py", "test_d.py"),
+            ("test_d.py", "a.py"),
+        ]
+    )
+
+    roots = [
+        graph.paths[node] for node in graph.iter_root_ancestors([graph.ids["a.py"]])
+    ]
+
+    assert roots[0] == "test_a.py"
+    assert sorted(roots[1:]) == ["test_b.py", "test_c.py"]
+    assert set(roots) == _root_ancestors(graph, ["a.py"])
+    assert list(graph.iter_root_ancestors([graph.ids["test_a.py"]])) == [
+        graph.ids["test_a.py"]
+    ]
+
+
+def test_build_drops_duplicate_edges_and_removed_nodes():
+    builder = CompactGraphBuilder()
+    builder.add_edge("a.py", "b.py")
+    builder.add_edge("a.py", "b.py")
+    builder.add_edge("a.py", "data.txt")
+    builder.add_edge("data.txt", "b.py")
+    builder.remove_node("data.txt")
+
+    assert "data.txt" not in builder
+
+    graph = builder.build()
+
+    assert graph.paths == ["a.py", "b.py"]
+    assert graph.number_of_edges() == 1
+    assert list(graph.successors(graph.ids["a.py"])) == [graph.ids["b.py"]]
+    assert list(graph.predecessors(graph.ids["b.py"])) == [graph.ids["a.py"]]
+
+
+def test_to_networkx():
+    graph = CompactGraph.from_edges([("a.py", "b.py"), ("b.py", "c.py")])
+    exported = graph.to_networkx()
+
+    assert set(exported.nodes) == {"a.py", "b.py", "c.py"}
+    assert set(exported.edges) == {("a.py", "b.py"), ("b.py", "c.py")}
+
+
+def test_ancestor_distances():
+    graph = CompactGraph.from_edges(
+        [
+            ("test_a.py", "a.py"),
+            ("test_a.py", "b.py"),
+            ("a.py", "b.py"),
+            ("test_b.py", "a.py"),
+        ]
+    )
+    distances = graph.ancestor_distances([graph.ids["b.py"]])
+
+    assert {graph.paths[node]: d for node, d in distances.items()} == {
+        "b.py": 0,
+        "a.py": 1,
+        "test_a.py": 1,
+        "test_b.py": 2,
+    }
@@ -0,0 +1,166 @@
+import os
+import socket
+import threading
+
+import pytest
+
+import pytest_git_selector.daemon
+import pytest_git_selector.selector
+from pytest_git_selector.daemon import (
+    SelectorDaemon,
+    request_selection,
+    shutdown_daemon,
+)
+from pytest_git_selector.errors import DaemonRunningException
+from pytest_git_selector.selector import select_test_files
+from conftest import (
+    add_b_shadowing_pkg_small_project_a,
+    add_k_importing_h_small_project_a,
+    add_pkg_small_project_a,
+    drop_h_import_and_modify_h_small_project_a,
+    modify_f_small_project_a,
+)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    daemon = SelectorDaemon(str(tmp_path / "selector.sock"), poll_interval=0.05)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+
+    yield daemon
+
+    shutdown_daemon(daemon.socket_path)
+    thread.join()
+    daemon.server_close()
+
+
+@pytest.fixture
+def daemon_socket(daemon):
+    return daemon.socket_path
+
+
+def test_request_selection(small_project_a, daemon_socket, monkeypatch):
+    monkeypatch.chdir(small_project_a)
+    modify_f_small_project_a(small_project_a)
+
+    expected = {
+        os.path.join(small_project_a, "test", "test_f.py"),
+        os.path.join(small_project_a, "test", "test_g.py"),
+    }
+    assert request_selection(daemon_socket, ["HEAD~1..."], ["test"], ["."]) == expected
+
+    # Uncommitted change picked up by the daemon after the first request
+    with open(os.path.join(small_project_a, "test", "test_f.py"), "a+") as f:
+        f.write("# modify test_f.py\n")
+
+    expected = select_test_files(["HEAD"], ["test"], ["."])
+    assert request_selection(daemon_socket, ["HEAD"], ["test"], ["."]) == expected
+    assert expected == {os.path.join(small_project_a, "test", "test_f.py")}
+
+
+def test_request_selection_keeps_graph(small_project_a, daemon_socket, monkeypatch):
+    monkeypatch.chdir(small_project_a)
+    add_pkg_small_project_a(small_project_a)
+
+    assert request_selection(daemon_socket, ["HEAD"], ["test"], ["."]) == set()
+
+    # Later requests only resolve the files that changed instead of building the graph again
+    def create_import_graph(*args, **kwargs):
+        raise AssertionError("import graph built again")
+
+    monkeypatch.setattr(
+        pytest_git_selector.selector, "_create_import_graph", create_import_graph
+    )
+    modify_f_small_project_a(small_project_a)
+    expected = {
+        os.path.join(small_project_a, "test", "test_f.py"),
+        os.path.join(small_project_a, "test", "test_g.py"),
+    }
+    assert request_selection(daemon_socket, ["HEAD~1"], ["test"], ["."]) == expected
+
+    # test_b.py imports the added pkg/b.py instead of the name defined in pkg/__init__.py
+    add_b_shadowing_pkg_small_project_a(small_project_a)
+    expected = {os.path.join(small_project_a, "test", "test_b.py")}
+    assert request_selection(daemon_socket, ["HEAD"], ["test"], ["."]) == expected
+
+
+def test_request_selection_unreachable_module(
+    small_project_a, daemon_socket, monkeypatch
+):
+    monkeypatch.chdir(small_project_a)
+    add_k_importing_h_small_project_a(small_project_a)
+
+    assert request_selection(daemon_socket, ["HEAD"], ["test"], ["."]) == set()
+
+    # h.py is no longer imported by any test file after k.py drops its import
+    drop_h_import_and_modify_h_small_project_a(small_project_a)
+    expected = select_test_files(["HEAD"], ["test"], ["."])
+    assert request_selection(daemon_socket, ["HEAD"], ["test"], ["."]) == expected
+    assert expected == {os.path.join(small_project_a, "test", "test_k.py")}
+
+
+@pytest.mark.parametrize("hash_seeds", [("1", "2"), ("3", "4")])
+def test_request_selection_reuses_graph(
+    small_project_a, daemon, hash_seeds, pytester, monkeypatch
+):
+    monkeypatch.chdir(small_project_a)
+    add_pkg_small_project_a(small_project_a)
+    modify_f_small_project_a(small_project_a)
+
+    # The plugin collects the test files in a set so each run may send them in a different order
+    for hash_seed in hash_seeds:
+        monkeypatch.setenv("PYTHONHASHSEED", hash_seed)
+        result = pytester.runpytest_subprocess(
+            "--daemon-socket", daemon.socket_path, "test", "--", "HEAD~1"
+        )
+        result.assert_outcomes(passed=2)
+
+    assert len(daemon._graphs) == 1
+
+
+def test_request_selection_evicts_graph(small_project_a, daemon, monkeypatch):
+    monkeypatch.chdir(small_project_a)
+    monkeypatch.setattr(pytest_git_selector.daemon, "MAX_GRAPHS", 1)
+    modify_f_small_project_a(small_project_a)
+
+    test_f = os.path.join(small_project_a, "test", "test_f.py")
+    test_g = os.path.join(small_project_a, "test", "test_g.py")
+    assert request_selection(daemon.socket_path, ["HEAD~1"], [test_f], ["."]) == {
+        test_f
+    }
+    assert request_selection(daemon.socket_path, ["HEAD~1"], [test_g], ["."]) == {
+        test_g
+    }
+    assert len(daemon._graphs) == 1
+
+
+def test_request_selection_error(small_project_a, daemon_socket, monkeypatch):
+    monkeypatch.chdir(small_project_a)
+
+    # The caller falls back to selecting in-process when the daemon fails
+    assert request_selection(daemon_socket, ["--output", "x"], ["test"], ["."]) is None
+
+
+def test_request_selection_no_daemon(tmp_path):
+    socket_path = str(tmp_path / "missing.sock")
+
+    assert request_selection(socket_path, ["HEAD"], ["test"], ["."]) is None
+    assert not shutdown_daemon(socket_path)
+
+
+def test_daemon_socket_in_use(daemon_socket, tmp_path):
+    # A live daemon keeps its socket
+    with pytest.raises(DaemonRunningException):
+        SelectorDaemon(daemon_socket)
+
+    assert os.path.exists(daemon_socket)
+
+    # The socket left behind by a daemon that was killed is replaced
+    socket_path = str(tmp_path / "stale.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+
+    daemon = SelectorDaemon(socket_path)
+    daemon.server_close()
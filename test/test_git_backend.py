@@ -0,0 +1,148 @@
+import git
+import os
+import pytest
+
+from pytest_git_selector.errors import (
+    NativeGitUnsupportedException,
+    UnsupportedArgumentException,
+)
+from pytest_git_selector.git_backend import (
+    NativeGitBackend,
+    SubprocessGitBackend,
+    create_git_backend,
+)
+
+from conftest import (
+    add_h_small_project_a,
+    complex_workflow_a_medium_project_a,
+    complex_workflow_b_medium_project_a_feature_1,
+    delete_f_small_project_a,
+    modify_f_small_project_a,
+    modify_g_small_project_a,
+    rename_f_small_project_a,
+)
+
+
+def _modify_working_tree_small_project_a(project_root_dir):
+    modify_g_small_project_a(project_root_dir)
+    repo = git.Repo(project_root_dir)
+    package_dir = os.path.join(project_root_dir, "small_project_a")
+
+    # Staged modification
+    with open(os.path.join(package_dir, "f.py"), "a") as f:
+        f.write("# staged\n")
+    repo.git.add("small_project_a/f.py")
+
+    # Unstaged modification of the same size and an unstaged mode change
+    with open(os.path.join(package_dir, "g.py"), "r+") as f:
+        contents = f.read()
+        f.seek(0)
+        f.write(contents.swapcase())
+    os.chmod(os.path.join(project_root_dir, "test", "test_g.py"), 0o755)
+
+    # Staged addition and unstaged deletion
+    with open(os.path.join(package_dir, "h.py"), "w") as f:
+        f.write("pass\n")
+    repo.git.add("small_project_a/h.py")
+    os.remove(os.path.join(project_root_dir, "test", "test_f.py"))
+
+
+def _name_status(backend, git_diff_args):
+    return sorted(backend.diff_name_status(git_diff_args))
+
+
+@pytest.mark.parametrize(
+    ("repo", "side_effect", "git_diff_args"),
+    [
+        ("small_project_a", delete_f_small_project_a, ["HEAD~1..."]),
+        ("small_project_a", delete_f_small_project_a, ["HEAD~1", "HEAD"]),
+        ("small_project_a", rename_f_small_project_a, ["HEAD~1..HEAD"]),
+        ("small_project_a", add_h_small_project_a, ["HEAD~3..."]),
+        ("small_project_a", add_h_small_project_a, ["--diff-filter=A", "HEAD~3"]),
+        ("small_project_a", add_h_small_project_a, ["--diff-filter=m", "HEAD~3"]),
+        ("medium_project_a", complex_workflow_a_medium_project_a, ["base..."]),
+        ("medium_project_a", complex_workflow_a_medium_project_a, ["feature-1..."]),
+        ("medium_project_a", complex_workflow_a_medium_project_a, ["...feature-1"]),
+        (
+            "medium_project_a",
+            complex_workflow_b_medium_project_a_feature_1,
+            ["feature-2...feature-1"],
+        ),
+        ("small_project_a", _modify_working_tree_small_project_a, []),
+        ("small_project_a", _modify_working_tree_small_project_a, ["HEAD"]),
+        ("small_project_a", _modify_working_tree_small_project_a, ["HEAD~1"]),
+        ("small_project_a", _modify_working_tree_small_project_a, ["--cached"]),
+        (
+            "small_project_a",
+            _modify_working_tree_small_project_a,
+            ["--staged", "HEAD~1"],
+        ),
+    ],
+)
+def test_native_backend_matches_subprocess_backend(
+    repo, side_effect, git_diff_args, request
+):
+    repo = request.getfixturevalue(repo)
+    side_effect(repo)
+
+    expected = _name_status(SubprocessGitBackend(repo), git_diff_args)
+
+    assert expected
+    assert _name_status(NativeGitBackend(repo), git_diff_args) == expected
+    assert _name_status(create_git_backend("auto", repo), git_diff_args) == expected
+    assert NativeGitBackend(repo).tracked_files() == sorted(
+        SubprocessGitBackend(repo).tracked_files()
+    )
+
+
+def test_native_backend_unsupported_args(small_project_a):
+    delete_f_small_project_a(small_project_a)
+    expected = _name_status(
+        SubprocessGitBackend(small_project_a), ["HEAD~1", "--", "test"]
+    )
+
+    with pytest.raises(NativeGitUnsupportedException):
+        NativeGitBackend(small_project_a).diff_name_status(["HEAD~1", "--", "test"])
+
+    # The auto backend runs git which supports every arg
+    auto_backend = create_git_backend("auto", small_project_a)
+    assert _name_status(auto_backend, ["HEAD~1", "--", "test"]) == expected
+
+    with pytest.raises(UnsupportedArgumentException):
+        NativeGitBackend(small_project_a).diff_name_status(["--diff-filter=R", "HEAD"])
+
+
+def test_auto_backend_without_git(small_project_a, monkeypatch):
+    modify_f_small_project_a(small_project_a)
+    backend = create_git_backend("auto", small_project_a)
+    expected = _name_status(backend, ["HEAD~1..."])
+    tracked_files = sorted(backend.tracked_files())
+
+    # The native backend is used when git cannot be started
+    monkeypatch.setattr(git.Git, "GIT_PYTHON_GIT_EXECUTABLE", "/nonexistent/git")
+
+    assert _name_status(backend, ["HEAD~1..."]) == expected
+    assert sorted(backend.tracked_files()) == tracked_files
+
+
+def test_native_backend_unknown_revision(small_project_a):
+    for name in ("native", "auto", "subprocess"):
+        with pytest.raises(git.GitCommandError):
+            list(create_git_backend(name, small_project_a).diff_name_status(["nope"]))
+
+
+def test_native_backend_attributes_fall_back_to_git(small_project_a):
+    with open(os.path.join(small_project_a, ".gitattributes"), "w") as f:
+        f.write("*.py text eol=crlf\n")
+
+    repo = git.Repo(small_project_a)
+    repo.git.add(".gitattributes")
+    repo.git.commit("-m", "Add .gitattributes")
+
+    with pytest.raises(NativeGitUnsupportedException):
+        NativeGitBackend(small_project_a).diff_name_status(["HEAD"])
+
+    # Commits can still be compared without git
+    assert NativeGitBackend(small_project_a).diff_name_status(["HEAD~1..."]) == [
+        ("A", ".gitattributes")
+    ]
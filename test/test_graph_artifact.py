@@ -0,0 +1,295 @@
+import git
+import os
+import pytest
+
+from pytest_git_selector.errors import InvalidGraphArtifactException
+from pytest_git_selector.graph_artifact import (
+    ARTIFACT_FORMAT_VERSION,
+    MAGIC,
+    GraphArtifact,
+)
+from pytest_git_selector.selector import (
+    build_graph_artifact,
+    select_test_files,
+    select_tests_from_graph_artifact,
+)
+
+from conftest import (
+    add_b_shadowing_pkg_small_project_a,
+    add_pkg_small_project_a,
+    add_h_small_project_a,
+    add_k_importing_h_small_project_a,
+    b_2_depends_on_a_2_medium_project_a,
+    complex_workflow_b_medium_project_a_feature_1,
+    delete_f_small_project_a,
+    delete_k_and_modify_h_small_project_a,
+    drop_h_import_and_modify_h_small_project_a,
+    modify_f_small_project_a,
+    modify_h_test_inputs_and_g_small_project_b,
+    rename_f_small_project_a,
+)
+
+SMALL_PROJECT_B_EXTRA_DEPS = [
+    ("test/test_h.py", "test/test_h_modulo_inputs.csv"),
+    ("small_project_b/f/f_1.py", "small_project_b/f/f_1.txt"),
+]
+
+
+def _edges(graph):
+    return {
+        (graph.paths[node], graph.paths[succ])
+        for node in range(graph.number_of_nodes())
+        for succ in graph.successors(node)
+    }
+
+
+def _relocate(path, root, new_root):
+    if path.startswith(root + os.sep):
+        return os.path.join(new_root, os.path.relpath(path, root))
+    return path
+
+
+def _write_test_h_small_project_a(project_root_dir):
+    # New test file in the working tree that is not tracked by git
+    with open(os.path.join(project_root_dir, "test", "test_h.py"), "w") as f:
+        f.write("import small_project_a.g\n")
+
+
+def _modify_g_in_working_tree_small_project_a(project_root_dir):
+    _write_test_h_small_project_a(project_root_dir)
+
+    with open(os.path.join(project_root_dir, "small_project_a", "g.py"), "a") as f:
+        f.write("# modified in the working tree\n")
+
+
+@pytest.mark.parametrize(
+    ("repo", "side_effect", "git_diff_args", "python_path", "extra_deps"),
+    [
+        ("small_project_a", modify_f_small_project_a, ["HEAD~1..."], ["."], None),
+        ("small_project_a", delete_f_small_project_a, ["HEAD~1..."], ["."], None),
+        ("small_project_a", rename_f_small_project_a, ["HEAD~1..."], ["."], None),
+        ("small_project_a", add_h_small_project_a, ["base..."], ["."], None),
+        (
+            "small_project_a",
+            _modify_g_in_working_tree_small_project_a,
+            ["HEAD"],
+            ["."],
+            None,
+        ),
+        (
+            "small_project_b",
+            modify_h_test_inputs_and_g_small_project_b,
+            ["HEAD~1..."],
+            ["."],
+            SMALL_PROJECT_B_EXTRA_DEPS,
+        ),
+        (
+            "medium_project_a",
+            b_2_depends_on_a_2_medium_project_a,
+            ["HEAD~1..."],
+            ["src"],
+            None,
+        ),
+        (
+            "medium_project_a",
+            complex_workflow_b_medium_project_a_feature_1,
+            ["base..."],
+            ["src"],
+            None,
+        ),
+    ],
+)
+def test_select_tests_from_graph_artifact(
+    repo,
+    side_effect,
+    git_diff_args,
+    python_path,
+    extra_deps,
+    request,
+    tmp_path,
+    monkeypatch,
+):
+    repo = request.getfixturevalue(repo)
+    monkeypatch.chdir(repo)
+    artifact = str(tmp_path / "graph.artifact")
+
+    build_graph_artifact(artifact, ["test"], python_path, extra_deps=extra_deps)
+    side_effect(repo)
+    expected = select_test_files(
+        git_diff_args, ["test"], python_path, extra_deps=extra_deps
+    )
+
+    assert expected
+    assert select_tests_from_graph_artifact(artifact, git_diff_args).test_files == (
+        expected
+    )
+
+
+def test_graph_artifact_round_trip(medium_project_a, tmp_path, monkeypatch):
+    monkeypatch.chdir(medium_project_a)
+    filename = str(tmp_path / "graph.artifact")
+
+    artifact = build_graph_artifact(filename, ["test"], ["src"])
+    # Loaded from another checkout of the same commit
+    clone = str(tmp_path / "clone")
+    git.Repo(medium_project_a).git.clone(medium_project_a, clone)
+    loaded = GraphArtifact.load(filename, clone)
+
+    assert loaded.commit == git.Repo(medium_project_a).head.commit.hexsha
+    assert loaded.python_path == [os.path.join(clone, "src")]
+    assert loaded.test_paths == [os.path.join(clone, "test")]
+    assert not loaded.dirty_files
+    # The arrays are read from the mapped file rather than copied
+    assert isinstance(loaded.graph.preds, memoryview)
+    assert _edges(loaded.graph) == {
+        (_relocate(u, medium_project_a, clone), _relocate(v, medium_project_a, clone))
+        for u, v in _edges(artifact.graph)
+    }
+
+    monkeypatch.chdir(clone)
+
+    with open(os.path.join(clone, "src", "b", "b_1.py"), "a") as f:
+        f.write("# modified\n")
+
+    assert select_tests_from_graph_artifact(filename, ["HEAD"]).test_files == (
+        select_test_files(["HEAD"], ["test"], ["src"])
+    )
+
+
+def test_graph_artifact_revision(small_project_a, tmp_path, monkeypatch):
+    monkeypatch.chdir(small_project_a)
+    filename = str(tmp_path / "graph.artifact")
+    build_graph_artifact(filename, ["test"], ["."])
+    add_h_small_project_a(small_project_a)
+    expected = select_test_files(["base..."], ["test"], ["."])
+
+    # The changes since the artifact are read from the commit so the working tree is not needed
+    repo = git.Repo(small_project_a)
+    repo.git.checkout("--orphan", "empty")
+    repo.git.rm("-r", "-f", "-q", ".")
+
+    selection = select_tests_from_graph_artifact(
+        filename, ["base...feature"], revision="feature"
+    )
+
+    assert selection.test_files == expected
+
+
+def test_graph_artifact_dirty_files(small_project_a, tmp_path, monkeypatch):
+    monkeypatch.chdir(small_project_a)
+    filename = str(tmp_path / "graph.artifact")
+    _write_test_h_small_project_a(small_project_a)
+
+    artifact = build_graph_artifact(filename, ["test"], ["."])
+
+    assert artifact.dirty_files == {os.path.join(small_project_a, "test", "test_h.py")}
+
+    # The untracked test file is gone in another checkout of the commit
+    os.remove(os.path.join(small_project_a, "test", "test_h.py"))
+    modify_f_small_project_a(small_project_a)
+
+    assert select_tests_from_graph_artifact(filename, ["HEAD~1"]).test_files == (
+        select_test_files(["HEAD~1"], ["test"], ["."])
+    )
+
+
+def test_graph_artifact_invalid(small_project_a, tmp_path, monkeypatch):
+    monkeypatch.chdir(small_project_a)
+    filename = str(tmp_path / "graph.artifact")
+
+    with open(filename, "wb") as f:
+        f.write(b"not a graph artifact")
+
+    with pytest.raises(InvalidGraphArtifactException):
+        select_tests_from_graph_artifact(filename, ["HEAD"])
+
+    build_graph_artifact(filename, ["test"], ["."])
+
+    with open(filename, "r+b") as f:
+        contents = f.read().replace(
+            b'"version": %d' % ARTIFACT_FORMAT_VERSION, b'"version": 0'
+        )
+        f.seek(0)
+        f.write(contents)
+
+    with pytest.raises(InvalidGraphArtifactException):
+        GraphArtifact.load(filename, small_project_a)
+
+
+def _truncate(contents):
+    return contents[: len(contents) - 16]
+
+
+def _drop_sections(contents):
+    return contents.replace(b'"sections"', b'"sectionz"')
+
+
+def _corrupt_table(contents):
+    # The compressed table starts with the zlib header right after the aligned JSON header
+    start = contents.index(b"\x78\x9c")
+    return contents[:start] + b"\0" * 8 + contents[start + 8 :]
+
+
+def _truncate_header(contents):
+    return contents[: len(MAGIC) + 4 + 10]
+
+
+def _replace_header(contents):
+    return contents.replace(b'{"version"', b'["version"', 1)
+
+
+@pytest.mark.parametrize(
+    "corrupt",
+    [_truncate, _drop_sections, _corrupt_table, _truncate_header, _replace_header],
+)
+def test_graph_artifact_corrupt(small_project_a, tmp_path, monkeypatch, corrupt):
+    monkeypatch.chdir(small_project_a)
+    filename = str(tmp_path / "graph.artifact")
+    build_graph_artifact(filename, ["test"], ["."])
+
+    with open(filename, "rb") as f:
+        contents = corrupt(f.read())
+
+    with open(filename, "wb") as f:
+        f.write(contents)
+
+    with pytest.raises(InvalidGraphArtifactException):
+        GraphArtifact.load(filename, small_project_a)
+
+
+def test_graph_artifact_added_module(small_project_a, tmp_path, monkeypatch):
+    monkeypatch.chdir(small_project_a)
+    filename = str(tmp_path / "graph.artifact")
+    add_pkg_small_project_a(small_project_a)
+    build_graph_artifact(filename, ["test"], ["."])
+
+    # test_b.py is unchanged but imports pkg/b.py once it is added
+    add_b_shadowing_pkg_small_project_a(small_project_a)
+    expected = {os.path.join(small_project_a, "test", "test_b.py")}
+
+    assert select_test_files(["HEAD"], ["test"], ["."]) == expected
+    assert select_tests_from_graph_artifact(filename, ["HEAD"]).test_files == expected
+
+
+@pytest.mark.parametrize(
+    ("side_effect", "git_diff_args"),
+    [
+        (delete_k_and_modify_h_small_project_a, ["HEAD~1"]),
+        (drop_h_import_and_modify_h_small_project_a, ["HEAD"]),
+    ],
+)
+def test_graph_artifact_unreachable_module(
+    small_project_a, tmp_path, monkeypatch, side_effect, git_diff_args
+):
+    monkeypatch.chdir(small_project_a)
+    filename = str(tmp_path / "graph.artifact")
+    add_k_importing_h_small_project_a(small_project_a)
+    build_graph_artifact(filename, ["test"], ["."])
+
+    # h.py is no longer imported by anything so it is not a test file
+    side_effect(small_project_a)
+    expected = select_test_files(git_diff_args, ["test"], ["."])
+    selection = select_tests_from_graph_artifact(filename, git_diff_args)
+
+    assert os.path.join(small_project_a, "small_project_a", "h.py") not in expected
+    assert selection.test_files == expected
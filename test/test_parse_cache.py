@@ -0,0 +1,67 @@
+import concurrent.futures
+
+from pytest_git_selector.parse_cache import ParseCache
+
+
+def _put_entries(filename, start):
+    cache = ParseCache(filename)
+
+    for i in range(start, start + 50):
+        cache.put(f"{i:040x}", [(f"module_{i}", f"module_{i}", False, False)])
+        cache.save()
+
+    cache.close()
+
+
+def test_parse_cache_round_trip(tmp_path):
+    filename = str(tmp_path / "cache" / "parse-cache.sqlite")
+    imports = [("os", "os", False, False), ("a.b", "b", True, False)]
+
+    cache = ParseCache(filename)
+    cache.put("a" * 40, imports)
+    assert cache.get(["a" * 40]) == {}
+    cache.save()
+    cache.close()
+
+    cache = ParseCache(filename)
+    assert cache.get(["a" * 40, "b" * 40]) == {"a" * 40: imports}
+    # Entries of other Python versions are kept apart
+    assert ParseCache(filename, python_version=(2, 7)).get(["a" * 40]) == {}
+
+
+def test_parse_cache_evicts_least_recently_used(tmp_path):
+    filename = str(tmp_path / "parse-cache.sqlite")
+    imports = [("module", "module", False, False)]
+    cache = ParseCache(filename)
+
+    for sha in ("a" * 40, "b" * 40, "c" * 40):
+        cache.put(sha, imports)
+        cache.save()
+
+    entry_size = cache.size() // 3
+    # Room for three and a half entries so evicting down to the target only evicts one
+    cache.max_size = entry_size * 7 // 2
+    # Using an entry makes it the most recently used
+    cache.get(["a" * 40])
+    cache.put("d" * 40, imports)
+    cache.save()
+
+    assert cache.size() <= cache.max_size
+    assert set(cache.get(["a" * 40, "b" * 40, "c" * 40, "d" * 40])) == {
+        "a" * 40,
+        "c" * 40,
+        "d" * 40,
+    }
+
+
+def test_parse_cache_concurrent_writers(tmp_path):
+    filename = str(tmp_path / "parse-cache.sqlite")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_put_entries, [filename] * 4, range(0, 200, 50)))
+
+    shas = [f"{i:040x}" for i in range(200)]
+    entries = ParseCache(filename).get(shas)
+
+    assert len(entries) == 200
+    assert entries[shas[7]] == [("module_7", "module_7", False, False)]
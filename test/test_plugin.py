@@ -1,5 +1,11 @@
+import git
+import json
 import os
 import pytest
+import subprocess
+import sys
+
+import pytest_git_selector.plugin
 
 from conftest import (
     complex_workflow_a_medium_project_a,
@@ -149,3 +155,433 @@ def _build_pytest_args(
     git_diff_args_w_delimiter = ["--"] + git_diff_args
 
     return src_path_args + extra_deps_file_args + git_diff_args_w_delimiter
+
+
+@pytest.mark.parametrize(
+    ("repo", "side_effect", "pytest_args", "expected_outcomes"),
+    [
+        (
+            "small_project_a",
+            modify_g_small_project_a,
+            ["--", "HEAD~1"],
+            {"passed": 1, "deselected": 0},
+        ),
+        (
+            "small_project_a",
+            modify_f_small_project_a,
+            ["--", "HEAD~1"],
+            {"passed": 2, "deselected": 0},
+        ),
+        (
+            "small_project_a",
+            modify_g_small_project_a,
+            ["test/test_f.py", "--", "HEAD~1"],
+            {
+                "passed": 0,
+                "deselected": 1,
+            },  # Test files passed explicitly are always collected
+        ),
+        (
+            "small_project_b",
+            modify_h_test_inputs_and_g_small_project_b,
+            ["--extra-deps-file", "extra_deps.txt", "--", "HEAD~1..."],
+            {"passed": 3, "deselected": 0},
+        ),
+    ],
+)
+def test_plugin_prune_collection(
+    repo, side_effect, pytest_args, expected_outcomes, pytester, request
+):
+    repo_path = request.getfixturevalue(repo)
+    os.chdir(repo_path)
+    side_effect(repo_path)
+
+    pytester.syspathinsert(repo_path)
+
+    result = pytester.runpytest(
+        f"--basetemp={pytester.path.parent.joinpath('basetemp')}",
+        "--prune-collection",
+        *pytest_args,
+    )
+
+    # Unselected test modules are never collected so they are not reported as deselected
+    result.assert_outcomes(**expected_outcomes)
+
+
+@pytest.mark.parametrize(
+    ("pytest_args", "expected"),
+    [
+        (["--ignore=test/test_g.py"], {"test_f.py"}),
+        (["--ignore=test"], set()),
+        (["--ignore-glob=*/test_g.*"], {"test_f.py"}),
+        ([], {"test_f.py", "test_g.py"}),
+    ],
+)
+def test_plugin_candidate_test_files_ignore(
+    small_project_a, pytester, pytest_args, expected
+):
+    os.chdir(small_project_a)
+    config = pytester.parseconfig(*pytest_args, "test")
+
+    # Files pytest would not collect are not candidates for selection
+    assert pytest_git_selector.plugin._get_candidate_test_files(config) == {
+        os.path.join(small_project_a, "test", f) for f in expected
+    }
+
+
+@pytest.mark.parametrize("trace_memory", [False, True])
+def test_plugin_selector_profile(small_project_a, pytester, trace_memory):
+    os.chdir(small_project_a)
+    modify_g_small_project_a(small_project_a)
+    pytester.syspathinsert(small_project_a)
+
+    result = pytester.runpytest(
+        f"--basetemp={pytester.path.parent.joinpath('basetemp')}",
+        "--selector-profile",
+        *(["--selector-profile-memory"] if trace_memory else []),
+        "--",
+        "HEAD~1",
+    )
+
+    result.assert_outcomes(passed=1, deselected=1)
+    peak = "*MiB peak" if trace_memory else ""
+    result.stdout.fnmatch_lines(
+        [
+            "*pytest-git-selector profile*",
+            f"git_diff*s{peak}",
+            f"ancestor_traversal*s{peak}",
+            "total*s",
+            "selected_test_files*1",
+        ]
+    )
+    assert ("MiB peak" in result.stdout.str()) == trace_memory
+
+
+@pytest.mark.parametrize(
+    ("old", "new", "expected_outcomes"),
+    [
+        # Function called by a parametrized test through another function
+        ("return 1", "return -1", {"passed": 3, "deselected": 4}),
+        # Method of a class used through a fixture
+        ("abs(3)", "abs(-3)", {"passed": 1, "deselected": 6}),
+    ],
+)
+def test_plugin_item_granularity(
+    small_project_a, pytester, old, new, expected_outcomes
+):
+    os.chdir(small_project_a)
+    repo = git.Repo(small_project_a)
+    module = os.path.join(small_project_a, "small_project_a", "h.py")
+
+    with open(module, "w+") as h:
+        h.write(
+            "def helper():\n"
+            "    return 1\n"
+            "\n\n"
+            "def one():\n"
+            "    return abs(helper())\n"
+            "\n\n"
+            "def two():\n"
+            "    return 2\n"
+            "\n\n"
+            "class K:\n"
+            "    def value(self):\n"
+            "        return abs(3)\n"
+        )
+
+    with open(os.path.join(small_project_a, "test", "test_h.py"), "w+") as t:
+        t.write(
+            "import pytest\n"
+            "from small_project_a.h import K, one, two\n"
+            "\n\n"
+            "@pytest.fixture\n"
+            "def k():\n"
+            "    return K()\n"
+            "\n\n"
+            "@pytest.mark.parametrize('x', [1, 2, 3])\n"
+            "def test_one(x):\n"
+            "    assert one() == 1\n"
+            "\n\n"
+            "def test_two():\n"
+            "    assert two() == 2\n"
+            "\n\n"
+            "def test_k(k):\n"
+            "    assert k.value() == 3\n"
+        )
+
+    repo.git.add(".")
+    repo.git.commit("-m", "Add h.py")
+
+    with open(module, "r") as h:
+        content = h.read()
+
+    with open(module, "w") as h:
+        h.write(content.replace(old, new))
+
+    pytester.syspathinsert(small_project_a)
+
+    result = pytester.runpytest(
+        f"--basetemp={pytester.path.parent.joinpath('basetemp')}",
+        "--selector-granularity",
+        "item",
+        "--",
+        "HEAD",
+    )
+
+    result.assert_outcomes(**expected_outcomes)
+
+
+def test_plugin_coverage_map(small_project_a, pytester, tmp_path):
+    os.chdir(small_project_a)
+    repo = git.Repo(small_project_a)
+    coverage_map = str(tmp_path / "coverage-map.db")
+    module = os.path.join(small_project_a, "small_project_a", "h.py")
+
+    with open(module, "w+") as h:
+        h.write("def one():\n    return 1\n")
+
+    with open(os.path.join(small_project_a, "test", "test_h_1.py"), "w+") as t:
+        t.write(
+            "import small_project_a.h\n\n\n"
+            "def test_one():\n"
+            "    assert small_project_a.h.one() == 1\n"
+        )
+
+    # Imports h.py without executing any of it during the test
+    with open(os.path.join(small_project_a, "test", "test_h_2.py"), "w+") as t:
+        t.write("import small_project_a.h\n\n\ndef test_two():\n    pass\n")
+
+    repo.git.add(".")
+    repo.git.commit("-m", "Add h.py")
+    pytester.syspathinsert(small_project_a)
+    basetemp = f"--basetemp={pytester.path.parent.joinpath('basetemp')}"
+
+    result = pytester.runpytest(basetemp, f"--record-coverage-map={coverage_map}")
+    result.assert_outcomes(passed=4)
+
+    with open(module, "a") as h:
+        h.write("\n\ndef two():\n    return 2\n")
+
+    with open(os.path.join(small_project_a, "test", "test_h_3.py"), "w+") as t:
+        t.write("def test_three():\n    pass\n")
+
+    # test_three was never recorded so it is selected regardless of the changes
+    result = pytester.runpytest(
+        basetemp, f"--coverage-map={coverage_map}", "--", "HEAD"
+    )
+    result.assert_outcomes(passed=2, deselected=3)
+
+    result = pytester.runpytest(
+        basetemp, "-v", f"--coverage-map={coverage_map}", "--", "HEAD"
+    )
+    result.stdout.fnmatch_lines(["*test_h_1.py::test_one PASSED*"])
+    result.stdout.fnmatch_lines(["*test_h_3.py::test_three PASSED*"])
+
+
+@pytest.mark.parametrize(
+    ("change", "expected_outcomes"),
+    [
+        # Module level statements run on import so no recorded item executed them
+        (("X = 1\n", "X = 2\n"), {"failed": 1, "passed": 1}),
+        (("    return 1\n", "    return 2\n"), {"failed": 1, "deselected": 1}),
+    ],
+)
+def test_plugin_coverage_map_module_level_change(
+    small_project_a, pytester, tmp_path, change, expected_outcomes
+):
+    os.chdir(small_project_a)
+    repo = git.Repo(small_project_a)
+    coverage_map = str(tmp_path / "coverage-map.db")
+    module = os.path.join(small_project_a, "small_project_a", "consts.py")
+
+    with open(module, "w+") as consts:
+        consts.write("X = 1\n\n\ndef f():\n    return 1\n")
+
+    with open(os.path.join(small_project_a, "test", "test_consts.py"), "w+") as t:
+        t.write(
+            "import small_project_a.consts\n\n\n"
+            "def test_a():\n"
+            "    assert small_project_a.consts.X == 1\n\n\n"
+            "def test_b():\n"
+            "    assert small_project_a.consts.f() == 1\n"
+        )
+
+    repo.git.add(".")
+    repo.git.commit("-m", "Add consts.py")
+    pytester.syspathinsert(small_project_a)
+    basetemp = f"--basetemp={pytester.path.parent.joinpath('basetemp')}"
+
+    result = pytester.runpytest(basetemp, f"--record-coverage-map={coverage_map}")
+    result.assert_outcomes(passed=4)
+
+    with open(module) as consts:
+        source = consts.read()
+
+    with open(module, "w") as consts:
+        consts.write(source.replace(*change))
+
+    result = pytester.runpytest(
+        basetemp, f"--coverage-map={coverage_map}", "test/test_consts.py", "--", "HEAD"
+    )
+    result.assert_outcomes(**expected_outcomes)
+
+
+def test_plugin_shards(small_project_a, pytester):
+    os.chdir(small_project_a)
+    modify_f_small_project_a(small_project_a)
+    pytester.syspathinsert(small_project_a)
+    basetemp = f"--basetemp={pytester.path.parent.joinpath('basetemp')}"
+
+    durations_file = os.path.join(
+        small_project_a, ".pytest_cache", "v", "git_selector", "durations"
+    )
+
+    # Durations are not recorded unless asked for
+    result = pytester.runpytest(basetemp)
+    result.assert_outcomes(passed=2)
+    assert not os.path.exists(durations_file)
+
+    # Durations of both test files are recorded by a full run
+    result = pytester.runpytest(basetemp, "--record-durations")
+    result.assert_outcomes(passed=2)
+
+    with open(durations_file) as f:
+        durations = f.read()
+
+    assert set(json.loads(durations)) == {"test/test_f.py", "test/test_g.py"}
+
+    passed = []
+
+    for shard_index in (0, 1):
+        # Every CI node starts from the same cache
+        with open(durations_file, "w") as f:
+            f.write(durations)
+
+        result = pytester.runpytest(
+            basetemp, "-v", "--shards=2", f"--shard-index={shard_index}", "--", "HEAD~1"
+        )
+        result.assert_outcomes(passed=1, deselected=1)
+        passed.extend(
+            line.split("::")[0] for line in result.outlines if "PASSED" in line
+        )
+
+    assert sorted(passed) == ["test/test_f.py", "test/test_g.py"]
+
+    # Sharding without git diff args shards all tests
+    result = pytester.runpytest(basetemp, "--shards=2", "--shard-index=1")
+    result.assert_outcomes(passed=1, deselected=1)
+
+    result = pytester.runpytest(
+        basetemp, "--prune-collection", "--shards=2", "--", "HEAD~1"
+    )
+    result.assert_outcomes(passed=1)
+
+    result = pytester.runpytest(basetemp, "--shards=2", "--shard-index=2")
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+
+def test_plugin_selector_order(small_project_a, pytester):
+    os.chdir(small_project_a)
+    repo = git.Repo(small_project_a)
+
+    with open(os.path.join(small_project_a, "test", "test_z.py"), "w+") as t:
+        t.write("import small_project_a.f\n\n\ndef test_z():\n    pass\n")
+
+    repo.git.add(".")
+    repo.git.commit("-m", "Add test_z.py")
+    modify_f_small_project_a(small_project_a)
+    pytester.syspathinsert(small_project_a)
+    basetemp = f"--basetemp={pytester.path.parent.joinpath('basetemp')}"
+
+    def run_order():
+        result = pytester.runpytest(
+            basetemp, "-v", "--selector-order=priority", "--", "HEAD~1"
+        )
+        result.assert_outcomes(passed=3)
+        return [line.split("::")[0] for line in result.outlines if "PASSED" in line]
+
+    # test_g.py imports f.py through g.py
+    assert run_order() == ["test/test_f.py", "test/test_z.py", "test/test_g.py"]
+
+    # Items that failed on the last run come first
+    lastfailed = os.path.join(small_project_a, ".pytest_cache", "v", "cache")
+
+    with open(os.path.join(lastfailed, "lastfailed"), "w") as f:
+        json.dump({"test/test_g.py::test_add": True}, f)
+
+    assert run_order()[0] == "test/test_g.py"
+
+    # Only the item durations used by the ordering are recorded. Items of deleted files are forgotten
+    durations = os.path.join(small_project_a, ".pytest_cache", "v", "git_selector")
+    assert not os.path.exists(os.path.join(durations, "durations"))
+
+    with open(os.path.join(durations, "item_durations")) as f:
+        item_durations = json.load(f)
+
+    assert "test/test_z.py::test_z" in item_durations
+    os.remove(os.path.join(small_project_a, "test", "test_z.py"))
+    result = pytester.runpytest(basetemp, "--selector-order=priority", "--", "HEAD~1")
+    result.assert_outcomes(passed=2)
+
+    with open(os.path.join(durations, "item_durations")) as f:
+        item_durations = json.load(f)
+
+    assert "test/test_z.py::test_z" not in item_durations
+    assert "test/test_g.py::test_add" in item_durations
+
+
+@pytest.mark.parametrize(
+    "pytest_args",
+    [
+        ["--", "HEAD~1"],
+        ["--prune-collection", "--", "HEAD~1"],
+        ["--selector-order=priority", "--", "HEAD~1"],
+    ],
+)
+def test_plugin_xdist(small_project_a, pytester, monkeypatch, pytest_args):
+    pytest.importorskip("xdist")
+    os.chdir(small_project_a)
+    modify_g_small_project_a(small_project_a)
+    monkeypatch.setenv("PYTHONPATH", small_project_a)
+
+    # Workers fail if they select tests themselves
+    with open(os.path.join(small_project_a, "conftest.py"), "w+") as f:
+        f.write(
+            "import pytest_git_selector.selector\n\n\n"
+            "def _fail(*args, **kwargs):\n"
+            "    raise AssertionError('tests selected on a worker')\n\n\n"
+            "def pytest_configure(config):\n"
+            "    if hasattr(config, 'workerinput'):\n"
+            "        pytest_git_selector.selector.select_tests = _fail\n"
+            "        pytest_git_selector.selector._call_git_diff = _fail\n"
+        )
+
+    result = pytester.runpytest(
+        f"--basetemp={pytester.path.parent.joinpath('basetemp')}",
+        "-n",
+        "2",
+        *pytest_args,
+    )
+
+    result.assert_outcomes(passed=1)
+
+
+@pytest.mark.parametrize(
+    "module", ["pytest_git_selector.plugin", "pytest_git_selector.cmd"]
+)
+def test_import_does_not_import_selector_dependencies(module):
+    # Runs without git diff args should not pay for importing GitPython, importlab and networkx
+    heavy_modules = ("git", "importlab", "networkx", "pytest_git_selector.selector")
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, {module}; "
+            f"print(' '.join(m for m in {heavy_modules!r} if m in sys.modules))",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+    assert output.split() == []
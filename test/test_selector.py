@@ -1,11 +1,27 @@
+import json
 import os
 
 import git
+import importlab.parsepy
 import pytest
 
+import pytest_git_selector.cache
+import pytest_git_selector.graph
+import pytest_git_selector.selector
 from pytest_git_selector.errors import UnsupportedArgumentException
-from pytest_git_selector.selector import select_test_files
+from pytest_git_selector.selector import (
+    iter_test_files,
+    select_test_files,
+    select_tests_batch,
+    update_graph_snapshot,
+)
+from pytest_git_selector.symbols import (
+    only_functions_changed_by_hunks,
+    symbols_changed_by_hunks,
+)
 from conftest import (
+    add_b_shadowing_pkg_small_project_a,
+    add_pkg_small_project_a,
     add_h_small_project_a,
     b_2_depends_on_a_2_medium_project_a,
     complex_workflow_a_medium_project_a,
@@ -453,3 +469,457 @@ def test_select_test_files(
         expected = set(os.path.join(repo_path, p) for p in expected)
 
         assert test_files == expected
+
+
+def test_select_test_files_graph_cache(small_project_a, tmp_path, monkeypatch):
+    os.chdir(small_project_a)
+    graph_cache = str(tmp_path / "graph-cache.json")
+
+    modify_f_small_project_a(small_project_a)
+    expected = {
+        os.path.join(small_project_a, p) for p in ("test/test_f.py", "test/test_g.py")
+    }
+    assert (
+        select_test_files(["HEAD~1..."], ["test"], ["."], graph_cache=graph_cache)
+        == expected
+    )
+    assert os.path.exists(graph_cache)
+
+    parsed_files = []
+    get_imports = importlab.parsepy.get_imports
+
+    def record_get_imports(filename, python_version):
+        parsed_files.append(filename)
+        return get_imports(filename, python_version)
+
+    monkeypatch.setattr(importlab.parsepy, "get_imports", record_get_imports)
+
+    modify_g_small_project_a(small_project_a)
+    test_files = select_test_files(
+        ["HEAD~1..."], ["test"], ["."], graph_cache=graph_cache
+    )
+
+    assert test_files == {os.path.join(small_project_a, "test/test_g.py")}
+    # Only the modified file needs to be parsed again
+    assert parsed_files == [os.path.join(small_project_a, "small_project_a", "g.py")]
+
+
+def test_select_test_files_graph_cache_added_module(small_project_a, tmp_path):
+    os.chdir(small_project_a)
+    graph_cache = str(tmp_path / "graph-cache.json")
+    add_pkg_small_project_a(small_project_a)
+
+    assert (
+        select_test_files(["HEAD"], ["test"], ["."], graph_cache=graph_cache) == set()
+    )
+
+    add_b_shadowing_pkg_small_project_a(small_project_a)
+    expected = {os.path.join(small_project_a, "test", "test_b.py")}
+
+    assert select_test_files(["HEAD"], ["test"], ["."]) == expected
+    assert (
+        select_test_files(["HEAD"], ["test"], ["."], graph_cache=graph_cache)
+        == expected
+    )
+
+
+def test_select_test_files_graph_snapshot(small_project_a, tmp_path, monkeypatch):
+    os.chdir(small_project_a)
+    graph_snapshot = str(tmp_path / "graph-snapshot.json")
+    update_graph_snapshot(graph_snapshot, ["test"], ["."])
+
+    with open(graph_snapshot, "r") as f:
+        assert json.load(f)["commit"] == git.Repo(".").head.commit.hexsha
+
+    parsed_files = []
+    hashed_files = []
+    get_imports = importlab.parsepy.get_imports
+    blob_sha = pytest_git_selector.cache.blob_sha
+
+    def record_get_imports(filename, python_version):
+        parsed_files.append(filename)
+        return get_imports(filename, python_version)
+
+    def record_blob_sha(filename):
+        hashed_files.append(filename)
+        return blob_sha(filename)
+
+    monkeypatch.setattr(importlab.parsepy, "get_imports", record_get_imports)
+    monkeypatch.setattr(pytest_git_selector.cache, "blob_sha", record_blob_sha)
+
+    modify_g_small_project_a(small_project_a)
+    test_files = select_test_files(
+        ["HEAD~1..."], ["test"], ["."], graph_snapshot=graph_snapshot
+    )
+
+    g = os.path.join(small_project_a, "small_project_a", "g.py")
+    assert test_files == {os.path.join(small_project_a, "test/test_g.py")}
+    # Only the file changed since the snapshot was saved is read
+    assert parsed_files == [g]
+    assert hashed_files == [g]
+
+    # Deleted files are dropped from the snapshot
+    delete_f_small_project_a(small_project_a)
+    test_files = select_test_files(
+        ["HEAD~1..."], ["test"], ["."], graph_snapshot=graph_snapshot
+    )
+
+    assert test_files == {
+        os.path.join(small_project_a, p) for p in ("test/test_f.py", "test/test_g.py")
+    }
+
+    with open(graph_snapshot, "r") as f:
+        content = json.load(f)
+
+    assert content["commit"] == git.Repo(".").head.commit.hexsha
+    assert (
+        os.path.join(small_project_a, "small_project_a", "f.py") not in content["files"]
+    )
+
+
+@pytest.mark.parametrize("revision", [None, "HEAD"])
+def test_select_test_files_graph_snapshot_added_module(
+    small_project_a, tmp_path, revision
+):
+    os.chdir(small_project_a)
+    graph_snapshot = str(tmp_path / "graph-snapshot.json")
+    add_pkg_small_project_a(small_project_a)
+    update_graph_snapshot(graph_snapshot, ["test"], ["."])
+
+    # Files whose blob SHA did not change since the snapshot still resolve their imports again
+    add_b_shadowing_pkg_small_project_a(small_project_a)
+    git.Repo(small_project_a).git.commit("-a", "-m", "Modify pkg/b.py")
+
+    assert select_test_files(
+        ["HEAD~2"],
+        ["test"],
+        ["."],
+        graph_snapshot=graph_snapshot,
+        revision=revision,
+    ) == {os.path.join(small_project_a, "test", "test_b.py")}
+
+
+def test_select_test_files_import_cycle(small_project_a):
+    # Files in a cycle of imports are matched against the diff individually
+    os.chdir(small_project_a)
+    repo = git.Repo(small_project_a)
+
+    with open(os.path.join(small_project_a, "small_project_a", "f.py"), "a+") as f:
+        f.write("import small_project_a.g\n")
+    repo.git.add(".")
+    repo.git.commit("-m", "Import g.py from f.py")
+
+    modify_g_small_project_a(small_project_a)
+
+    test_files = select_test_files(["HEAD~1"], ["test"], ["."])
+    assert test_files == {
+        os.path.join(small_project_a, p) for p in ("test/test_f.py", "test/test_g.py")
+    }
+
+
+def test_select_test_files_unusual_paths(small_project_a):
+    # git quotes paths containing non-ASCII characters unless -z is used
+    os.chdir(small_project_a)
+    repo = git.Repo(small_project_a)
+    module = os.path.join(small_project_a, "small_project_a", "hé.py")
+
+    with open(module, "w+") as h:
+        h.write("pass\n")
+    with open(os.path.join(small_project_a, "test", "test_h.py"), "w+") as h:
+        h.write("import small_project_a.hé\n")
+    repo.git.add(".")
+    repo.git.commit("-m", "Add hé.py")
+
+    with open(module, "a+") as h:
+        h.write("# modify hé.py\n")
+
+    assert select_test_files(["HEAD"], ["test"], ["."]) == {
+        os.path.join(small_project_a, "test", "test_h.py")
+    }
+
+    os.remove(module)
+
+    assert select_test_files(["HEAD"], ["test"], ["."]) == {
+        os.path.join(small_project_a, "test", "test_h.py")
+    }
+    assert not os.path.exists(module)
+
+
+@pytest.mark.parametrize("workers", [1, 2, 0])
+def test_select_test_files_workers(medium_project_a, workers):
+    os.chdir(medium_project_a)
+    complex_workflow_a_medium_project_a(medium_project_a)
+
+    test_files = select_test_files(["base..."], ["test"], ["src"], workers=workers)
+
+    expected = {
+        "test/test_a/test_a_1.py",
+        "test/test_a/test_a_2.py",
+        "test/test_a/test_a_3.py",
+        "test/test_b/test_b_1.py",
+        "test/test_b/test_b.py",
+        "test/test_c/test_c_1.py",
+        "test/test_c/test_c_2.py",
+        "test/test_d/test_d_1.py",
+    }
+    assert test_files == set(os.path.join(medium_project_a, p) for p in expected)
+
+
+def test_select_test_files_deleted_files_not_restored(medium_project_a):
+    os.chdir(medium_project_a)
+    complex_workflow_a_medium_project_a(medium_project_a)
+    deleted_file_dir = os.path.join(medium_project_a, "src", "a")
+    mtime = os.stat(deleted_file_dir).st_mtime_ns
+
+    test_files = select_test_files(["base..."], ["test"], ["src"])
+
+    assert os.path.join(medium_project_a, "test/test_a/test_a_2.py") in test_files
+    # Creating and removing a placeholder for the deleted file would update the modification time of its directory
+    assert os.stat(deleted_file_dir).st_mtime_ns == mtime
+    assert not os.path.exists(os.path.join(deleted_file_dir, "a_2.py"))
+
+
+@pytest.mark.parametrize(
+    ("old", "new", "granularity", "expected"),
+    [
+        # Changed function
+        (
+            "def one():\n    return 1\n",
+            "def one():\n    return 2\n",
+            "symbol",
+            {"test/test_one.py", "test/test_module.py"},
+        ),
+        (
+            "def one():\n    return 1\n",
+            "def one():\n    return 2\n",
+            "file",
+            {"test/test_one.py", "test/test_two.py", "test/test_module.py"},
+        ),
+        # Function referring to a changed function
+        (
+            "def one():\n    return 1\n",
+            "def one():\n    return 2\n\n\ndef three():\n    return one()\n",
+            "symbol",
+            {"test/test_one.py", "test/test_module.py"},
+        ),
+        # Only comments changed
+        (
+            "# one\n",
+            "# two\n",
+            "symbol",
+            set(),
+        ),
+        # Module level change
+        (
+            "CONSTANT = 1\n",
+            "CONSTANT = 2\n",
+            "symbol",
+            {"test/test_one.py", "test/test_two.py", "test/test_module.py"},
+        ),
+        # Removed function
+        (
+            "def one():\n    return 1\n\n\ndef four():\n    return 4\n",
+            "def one():\n    return 1\n",
+            "symbol",
+            {"test/test_one.py", "test/test_two.py", "test/test_module.py"},
+        ),
+    ],
+)
+def test_select_test_files_granularity(
+    small_project_a, old, new, granularity, expected
+):
+    os.chdir(small_project_a)
+    repo = git.Repo(small_project_a)
+    module = os.path.join(small_project_a, "small_project_a", "h.py")
+    template = "import os\n\n{}\n\ndef two():\n    return os.sep\n"
+
+    with open(module, "w+") as h:
+        h.write(template.format(old))
+
+    for name, imports in (
+        ("test_one", "from small_project_a.h import one"),
+        ("test_two", "from small_project_a.h import two"),
+        ("test_module", "import small_project_a.h"),
+    ):
+        with open(os.path.join(small_project_a, "test", f"{name}.py"), "w+") as t:
+            t.write(imports + "\n")
+
+    repo.git.add(".")
+    repo.git.commit("-m", "Add h.py")
+
+    with open(module, "w+") as h:
+        h.write(template.format(new))
+
+    test_files = select_test_files(["HEAD"], ["test"], ["."], granularity=granularity)
+
+    assert test_files == {os.path.join(small_project_a, p) for p in expected}
+
+
+def test_call_git_diff_hunks_path_with_space(small_project_a):
+    os.chdir(small_project_a)
+    repo = git.Repo(small_project_a)
+    module = os.path.join(small_project_a, "small_project_a", "my mod.py")
+
+    with open(module, "w") as f:
+        f.write("def one():\n    return 1\n")
+
+    repo.git.add(".")
+    repo.git.commit("-m", "Add my mod.py")
+
+    with open(module, "w") as f:
+        f.write("def one():\n    return 2\n")
+
+    hunks = pytest_git_selector.selector._call_git_diff_hunks(["HEAD"])
+
+    assert list(hunks) == [module]
+    with open(module, "rb") as f:
+        assert symbols_changed_by_hunks(f.read(), hunks[module]) == {"one"}
+
+
+def test_select_tests_batch(small_project_a):
+    os.chdir(small_project_a)
+    modify_g_small_project_a(small_project_a)
+    delete_f_small_project_a(small_project_a)
+    specs = [["HEAD~1"], ["HEAD~2", "HEAD~1"], ["HEAD~2"], ["HEAD"]]
+
+    selections = select_tests_batch(specs, ["test"], ["."])
+
+    assert [s.test_files for s in selections] == [
+        select_test_files(spec, ["test"], ["."]) for spec in specs
+    ]
+    assert selections[1].test_files == {
+        os.path.join(small_project_a, "test", "test_g.py")
+    }
+    assert selections[3].test_files == set()
+
+
+def test_iter_test_files(small_project_a):
+    os.chdir(small_project_a)
+    modify_f_small_project_a(small_project_a)
+
+    test_files = list(iter_test_files(["HEAD~1..."], ["test"], ["."]))
+
+    assert len(test_files) == len(set(test_files))
+    assert set(test_files) == select_test_files(["HEAD~1..."], ["test"], ["."])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_select_test_files_revision(medium_project_a, tmp_path, workers):
+    os.chdir(medium_project_a)
+    complex_workflow_a_medium_project_a(medium_project_a)
+    repo = git.Repo(medium_project_a)
+    specs = [["base...feature-1"], ["base...feature-2"]]
+    graph_snapshot = str(tmp_path / "graph-snapshot.json")
+
+    expected = []
+
+    for spec in specs:
+        repo.git.checkout(spec[0].split("...")[1])
+        expected.append(select_test_files(spec, ["test"], ["src"]))
+
+    # Files are read from the commit so the working tree is not needed
+    repo.git.checkout("--orphan", "empty")
+    repo.git.rm("-r", "-f", "-q", ".")
+
+    for spec, expected_test_files in zip(specs, expected):
+        revision = spec[0].split("...")[1]
+
+        for _ in range(2):
+            test_files = select_test_files(
+                spec,
+                ["test"],
+                ["src"],
+                workers=workers,
+                graph_snapshot=graph_snapshot,
+                revision=revision,
+            )
+            assert test_files == expected_test_files
+
+    with open(graph_snapshot) as f:
+        assert json.load(f)["commit"] == repo.git.rev_parse("feature-2")
+
+
+def test_select_test_files_revision_granularity(small_project_a):
+    os.chdir(small_project_a)
+    repo = git.Repo(small_project_a)
+    repo.git.checkout("-b", "feature")
+    module = os.path.join(small_project_a, "small_project_a", "h.py")
+
+    for name in ("one", "two"):
+        with open(os.path.join(small_project_a, "test", f"test_{name}.py"), "w") as t:
+            t.write(f"from small_project_a.h import {name}\n")
+
+    for body in ("1", "2"):
+        with open(module, "w") as h:
+            h.write(f"def one():\n    return {body}\n\n\ndef two():\n    return 2\n")
+
+        repo.git.add(".")
+        repo.git.commit("-m", "Modify h.py")
+
+    repo.git.checkout("--orphan", "empty")
+    repo.git.rm("-r", "-f", "-q", ".")
+
+    test_files = select_test_files(
+        ["feature~1", "feature"],
+        ["test"],
+        ["."],
+        granularity="symbol",
+        revision="feature",
+    )
+
+    assert test_files == {os.path.join(small_project_a, "test", "test_one.py")}
+
+
+def test_select_test_files_parse_cache(small_project_a, tmp_path, monkeypatch):
+    parse_cache = str(tmp_path / "parse-cache.sqlite")
+    clone = str(tmp_path / "clone")
+    git.Repo(small_project_a).git.clone(small_project_a, clone)
+    modify_f_small_project_a(small_project_a)
+
+    parsed_files = []
+    get_imports = pytest_git_selector.graph.get_imports
+
+    def record_get_imports(filename, python_version, source=None):
+        parsed_files.append(filename)
+        return get_imports(filename, python_version, source)
+
+    monkeypatch.setattr(pytest_git_selector.graph, "get_imports", record_get_imports)
+
+    os.chdir(small_project_a)
+    expected = select_test_files(["HEAD~1..."], ["test"], ["."])
+    parsed_files.clear()
+
+    assert (
+        select_test_files(["HEAD~1..."], ["test"], ["."], parse_cache=parse_cache)
+        == expected
+    )
+    assert len(parsed_files) == 4
+
+    # Files with the same contents in another checkout are not parsed again. The clone has f.py before it was modified
+    os.chdir(clone)
+    parsed_files.clear()
+    select_test_files(["HEAD"], ["test"], ["."], parse_cache=parse_cache)
+
+    assert parsed_files == [os.path.join(clone, "small_project_a", "f.py")]
+
+
+@pytest.mark.parametrize(
+    ("hunks", "expected"),
+    [
+        # Body of f
+        ([(5, 1, ["    return 1"])], True),
+        # Module level constant
+        ([(1, 1, ["X = 1"])], False),
+        # Body of the class is run on import
+        ([(9, 1, ["    y = 1"])], False),
+        # Added function
+        ([(12, 2, [])], True),
+    ],
+)
+def test_only_functions_changed_by_hunks(hunks, expected):
+    source = (
+        "X = 2\n\n\ndef f():\n    return 2\n\n\nclass C:\n    y = 2\n\n\n"
+        "def g():\n    pass\n"
+    )
+
+    assert only_functions_changed_by_hunks(source, hunks) == expected
@@ -0,0 +1,81 @@
+import json
+import os
+
+import pytest
+
+from pytest_git_selector.errors import UnsupportedArgumentException
+from pytest_git_selector.shards import (
+    load_durations,
+    shard_test_files,
+    validate_shard_args,
+)
+
+
+def _write(path, size):
+    with open(path, "w") as f:
+        f.write("#" * size)
+    return str(path)
+
+
+def test_shard_test_files_durations(tmp_path):
+    files = [_write(tmp_path / f"test_{i}.py", 10) for i in range(5)]
+    durations = dict(zip(files, [8.0, 4.0, 3.0, 2.0, 1.0]))
+    shards = [shard_test_files(files, 2, i, durations) for i in range(2)]
+
+    # Longest processing time first: 8 + 1 | 4 + 3 + 2
+    assert shards == [[files[0], files[4]], files[1:4]]
+    assert shards == [
+        shard_test_files(reversed(files), 2, i, durations) for i in (0, 1)
+    ]
+
+    # test_4.py has no recorded duration so it is estimated from its size
+    durations = dict(zip(files, [18.0, 4.0, 3.0, 2.0]))
+
+    shards = [shard_test_files(files, 2, i, durations) for i in range(2)]
+
+    assert shards == [[files[0]], files[1:]]
+
+
+def test_shard_test_files_sizes(tmp_path):
+    files = [
+        _write(tmp_path / f"test_{i}.py", size) for i, size in enumerate([30, 20, 10])
+    ]
+    missing = str(tmp_path / "test_missing.py")
+
+    shards = [shard_test_files(files + [missing], 2, i) for i in range(2)]
+
+    assert sorted(f for shard in shards for f in shard) == sorted(files + [missing])
+    assert files[0] in shards[0]
+    assert {files[1], files[2]} <= set(shards[1])
+
+    # Files without a duration are estimated from their size at the rate of the files with one
+    durations = {files[0]: 1.0}
+    assert shard_test_files(files, 2, 0, durations) == [files[0]]
+    assert shard_test_files(files, 2, 1, durations) == [files[1], files[2]]
+
+
+def test_shard_test_files_more_shards_than_files(tmp_path):
+    files = [_write(tmp_path / "test_a.py", 1)]
+
+    assert shard_test_files(files, 3, 0) == files
+    assert shard_test_files(files, 3, 2) == []
+
+
+def test_load_durations(tmp_path):
+    cache_dir = tmp_path / ".pytest_cache"
+    os.makedirs(cache_dir / "v" / "git_selector")
+
+    assert load_durations(str(cache_dir), str(tmp_path)) == {}
+
+    with open(cache_dir / "v" / "git_selector" / "durations", "w") as f:
+        json.dump({"test/test_a.py": 1.5, "test/test_b.py": "x"}, f)
+
+    assert load_durations(str(cache_dir), str(tmp_path)) == {
+        str((tmp_path / "test" / "test_a.py").resolve()): 1.5
+    }
+
+
+@pytest.mark.parametrize(("shards", "shard_index"), [(0, 0), (2, 2), (2, -1)])
+def test_validate_shard_args(shards, shard_index):
+    with pytest.raises(UnsupportedArgumentException):
+        validate_shard_args(shards, shard_index)
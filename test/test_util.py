@@ -0,0 +1,47 @@
+import os
+import pathlib
+
+from pytest_git_selector.util import (
+    canonical_path,
+    clear_canonical_path_cache,
+    to_absolute_path,
+)
+
+
+def test_canonical_path(tmp_path):
+    real_dir = tmp_path / "real"
+    (real_dir / "sub").mkdir(parents=True)
+    (tmp_path / "link").symlink_to(real_dir)
+    (real_dir / "file_link.py").symlink_to(real_dir / "sub" / "a.py")
+    os.chdir(tmp_path)
+
+    paths = [
+        "link/sub/a.py",
+        "link/file_link.py",
+        "link/sub/../b.py",
+        str(tmp_path / "link" / "sub" / "."),
+        "missing/c.py",
+    ]
+
+    for path in paths:
+        assert canonical_path(path) == str(pathlib.Path(path).resolve())
+
+    assert to_absolute_path(str(tmp_path), "link/sub/a.py") == real_dir / "sub" / "a.py"
+
+
+def test_canonical_path_cache_clear(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    os.symlink(tmp_path / "a", tmp_path / "link")
+
+    assert canonical_path(str(tmp_path / "link" / "x.py")) == str(
+        (tmp_path / "a" / "x.py").resolve()
+    )
+
+    os.remove(tmp_path / "link")
+    os.symlink(tmp_path / "b", tmp_path / "link")
+    clear_canonical_path_cache()
+
+    assert canonical_path(str(tmp_path / "link" / "x.py")) == str(
+        (tmp_path / "b" / "x.py").resolve()
+    )